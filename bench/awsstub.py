@@ -0,0 +1,550 @@
+"""In-memory stand-ins for the AWS calls bench/pipeline.py's run makes.
+
+AwsStub answers boto3 clients' S3, Step Functions, Textract and DynamoDB
+calls, and PynamoDB's DynamoDB calls, from dictionaries in this process,
+so the pipeline benchmark measures our code rather than the network:
+    stub = AwsStub().install()
+    ... run the pipeline ...
+    stub.uninstall()
+Clients made before install() are answered too, since the stub replaces
+the method every botocore client and PynamoDB connection calls.
+
+It keeps only the calls our functions make on the pipeline's path, and
+only the DynamoDB expressions our models write: conditions of AND, OR,
+NOT, comparisons, BETWEEN and attribute_(not_)exists, and SET and ADD
+updates of top level attributes. Anything else raises NotImplemented.
+Errors are raised as the real clients raise them, ClientError with the
+service's code.
+
+Every call is counted in calls, by (service, operation), and DynamoDB
+writes in write_units, a write capacity unit per started KB written.
+A call to a service in latency, {service: seconds}, sleeps that long first.
+
+on_object_created runs a function for every object stored under a prefix,
+as an S3 event notification would invoke a Lambda, and on_execution one for
+every execution started; wait_task waits for a task token's result. They run
+once the call that caused them has returned, outside the stub's lock, so
+they should hand their work to a thread rather than do it.
+"""
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
+
+import botocore.client
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+TEXTRACT_TEXT = 'stub text'
+
+
+class AwsStub(object):
+    """S3, Step Functions, Textract and DynamoDB in memory, see the module docstring."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.buckets = {}      # bucket: {key: S3Object}
+        self.uploads = {}      # multipart UploadId: {part number: bytes}
+        self.executions = {}   # name: {'executionArn', 'input', ...}
+        self.tasks = {}        # token: ('success', output) or ('failure', error)
+        self.tables = {}       # name: Table
+        self.calls = Counter()
+        self.write_units = 0
+        self.latency = {}
+        self._task_done = threading.Condition(self.lock)
+        self._object_listeners = []
+        self._execution_listeners = []
+        self._fired = []
+        self._saved = None
+
+    def install(self):
+        """Answer every botocore client and PynamoDB connection from here; returns self."""
+        from pynamodb.connection import base
+        self._saved = (botocore.client.BaseClient._make_api_call, base.Connection._make_api_call)
+        stub = self
+
+        def client_call(client, operation_name, api_params):
+            service = client.meta.service_model.service_name
+            return stub.call(service, operation_name, api_params, client=client)
+
+        def pynamodb_call(connection, operation_name, operation_kwargs):
+            return stub.call('dynamodb', operation_name, operation_kwargs, pynamodb=True)
+
+        botocore.client.BaseClient._make_api_call = client_call
+        base.Connection._make_api_call = pynamodb_call
+        return self
+
+    def uninstall(self):
+        from pynamodb.connection import base
+        botocore.client.BaseClient._make_api_call, base.Connection._make_api_call = self._saved
+
+    def call(self, service, operation_name, params, client=None, pynamodb=False):
+        """Run one API call, raising ClientError as botocore, or PynamoDB, would."""
+        service = 'stepfunctions' if service == 'states' else service
+        handler = getattr(self, f'{service}_{_snake(operation_name)}', None)
+        if self.latency.get(service):
+            time.sleep(self.latency[service])
+        try:
+            if handler is None:
+                raise StubError('NotImplemented', f'AwsStub has no {service} {operation_name}', 501)
+            with self.lock:
+                self.calls[service, operation_name] += 1
+                try:
+                    response = handler(**params)
+                finally:
+                    fired, self._fired = self._fired, []
+            for listener, arg in fired:
+                listener(arg)
+            return response
+        except StubError as e:
+            response = dict(e.extra, Error={'Code': e.code, 'Message': e.message},
+                            ResponseMetadata={'HTTPStatusCode': e.status})
+            if pynamodb:
+                from pynamodb.connection.base import VerboseClientError
+                raise VerboseClientError(response, operation_name, {'table_name': params.get('TableName')})
+            if client is not None:
+                raise client.exceptions.from_code(e.code)(response, operation_name)
+            raise ClientError(response, operation_name)
+
+    def on_object_created(self, listener, prefix='', suffix=''):
+        """Call listener(s3 event) for every object stored with a key of prefix and suffix."""
+        self._object_listeners.append((prefix, suffix, listener))
+
+    def on_execution(self, listener):
+        """Call listener(execution) for every Step Functions execution started."""
+        self._execution_listeners.append(listener)
+
+    def wait_task(self, token, timeout=None):
+        """Wait for a task token's result, ('success', output) or ('failure', error); None on timeout."""
+        with self._task_done:
+            self._task_done.wait_for(lambda: token in self.tasks, timeout)
+            return self.tasks.get(token)
+
+    # S3
+
+    def put(self, bucket, key, data):
+        """Store an object directly, as a user's upload would."""
+        with self.lock:
+            obj = self._store(bucket, key, data)
+            fired, self._fired = self._fired, []
+        for listener, arg in fired:
+            listener(arg)
+        return obj
+
+    def _store(self, bucket, key, data):
+        obj = self.buckets.setdefault(bucket, {})[key] = S3Object(data)
+        event = {'Records': [{'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+                              's3': {'bucket': {'name': bucket},
+                                     'object': {'key': key, 'size': len(data), 'eTag': obj.etag.strip('"')}}}]}
+        self._fired.extend((listener, event) for prefix, suffix, listener in self._object_listeners
+                           if key.startswith(prefix) and key.endswith(suffix))
+        return obj
+
+    def _object(self, Bucket, Key, code='NoSuchKey'):
+        try:
+            return self.buckets[Bucket][Key]
+        except KeyError:
+            raise StubError(code, 'The specified key does not exist.', 404)
+
+    def s3_put_object(self, Bucket, Key, Body=b'', **_kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        return {'ETag': self._store(Bucket, Key, bytes(Body)).etag}
+
+    def s3_get_object(self, Bucket, Key, Range=None, **_kwargs):
+        obj = self._object(Bucket, Key)
+        data = obj.data
+        response = {'ETag': obj.etag, 'LastModified': obj.modified}
+        if Range:
+            start, end = _byte_range(Range, len(data))
+            response['ContentRange'] = f'bytes {start}-{end}/{len(data)}'
+            data = data[start:end + 1]
+        response.update(ContentLength=len(data), Body=StreamingBody(io.BytesIO(data), len(data)))
+        return response
+
+    def s3_head_object(self, Bucket, Key, **_kwargs):
+        obj = self._object(Bucket, Key, code='404')
+        return {'ETag': obj.etag, 'LastModified': obj.modified, 'ContentLength': len(obj.data)}
+
+    def s3_list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **_kwargs):
+        objects = self.buckets.get(Bucket, {})
+        keys = sorted(key for key in objects if key.startswith(Prefix) and key > (ContinuationToken or ''))
+        page = keys[:MaxKeys]
+        response = {'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys, 'Prefix': Prefix,
+                    'Contents': [{'Key': key, 'Size': len(objects[key].data), 'ETag': objects[key].etag,
+                                  'LastModified': objects[key].modified} for key in page]}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def s3_create_multipart_upload(self, Bucket, Key, **_kwargs):
+        upload_id = uuid4().hex
+        self.uploads[upload_id] = {}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def s3_upload_part(self, Bucket, Key, UploadId, PartNumber, Body=b'', **_kwargs):
+        if UploadId not in self.uploads:
+            raise StubError('NoSuchUpload', 'The specified upload does not exist.', 404)
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': '"%s"' % hashlib.md5(Body).hexdigest()}
+
+    def s3_complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **_kwargs):
+        parts = self.uploads.pop(UploadId, None)
+        if parts is None:
+            raise StubError('NoSuchUpload', 'The specified upload does not exist.', 404)
+        obj = self._store(Bucket, Key, b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts']))
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': obj.etag}
+
+    def s3_abort_multipart_upload(self, Bucket, Key, UploadId, **_kwargs):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+    # Step Functions
+
+    def stepfunctions_start_execution(self, stateMachineArn, name=None, input='{}'):
+        name = name or uuid4().hex
+        if name in self.executions:
+            raise StubError('ExecutionAlreadyExists', f'Execution Already Exists: {name}', 400)
+        arn = stateMachineArn.replace(':stateMachine:', ':execution:') + ':' + name
+        self.executions[name] = {'executionArn': arn, 'name': name, 'input': input,
+                                 'startDate': datetime.now(timezone.utc)}
+        self._fired.extend((listener, self.executions[name]) for listener in self._execution_listeners)
+        return {'executionArn': arn, 'startDate': self.executions[name]['startDate']}
+
+    def stepfunctions_send_task_success(self, taskToken, output):
+        return self._task_result(taskToken, ('success', output))
+
+    def stepfunctions_send_task_failure(self, taskToken, error='', cause=''):
+        return self._task_result(taskToken, ('failure', error))
+
+    def _task_result(self, token, result):
+        if token in self.tasks:
+            raise StubError('TaskTimedOut', 'Task Timed Out', 400)  # what a used token gets
+        self.tasks[token] = result
+        self._task_done.notify_all()
+        return {}
+
+    # Textract
+
+    def textract_detect_document_text(self, Document):
+        return {'Blocks': [{'BlockType': 'PAGE'}, {'BlockType': 'LINE', 'Text': TEXTRACT_TEXT}]}
+
+    # DynamoDB
+
+    def table(self, name):
+        """The named table, made from the PynamoDB model for it if need be."""
+        from pynamodb.constants import ATTR_TYPE_MAP
+        if name not in self.tables:
+            model = _find_model(name)
+            if model is None:
+                raise StubError('ResourceNotFoundException', f'Requested resource not found: {name}', 400)
+            attributes = model.get_attributes().values()
+            hash_key = next(attr for attr in attributes if attr.is_hash_key)
+            range_key = next((attr for attr in attributes if attr.is_range_key), None)
+            self.tables[name] = Table(name, (hash_key.attr_name, ATTR_TYPE_MAP[hash_key.attr_type]),
+                                      (range_key.attr_name, ATTR_TYPE_MAP[range_key.attr_type]) if range_key else None)
+        return self.tables[name]
+
+    def _written(self, item):
+        self.write_units += max(1, -(-len(json.dumps(item)) // 1024))
+
+    def dynamodb_describe_table(self, TableName):
+        return {'Table': self.table(TableName).description()}
+
+    def dynamodb_get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None,
+                          **_kwargs):
+        item = self.table(TableName).items.get(self.table(TableName).key(Key))
+        return {} if item is None else {'Item': _project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def dynamodb_put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                          ExpressionAttributeValues=None, **_kwargs):
+        table = self.table(TableName)
+        key = table.key(Item)
+        _check(ConditionExpression, table.items.get(key), ExpressionAttributeNames, ExpressionAttributeValues)
+        table.items[key] = Item
+        self._written(Item)
+        return {}
+
+    def dynamodb_update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None,
+                             ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                             ReturnValues='NONE', **_kwargs):
+        table = self.table(TableName)
+        key = table.key(Key)
+        old = table.items.get(key)
+        _check(ConditionExpression, old, ExpressionAttributeNames, ExpressionAttributeValues)
+        new = json.loads(json.dumps(old)) if old is not None else dict(Key)
+        _Parser(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues).update(new)
+        table.items[key] = new
+        self._written(new)
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': new}
+        if ReturnValues != 'NONE':
+            raise StubError('NotImplemented', f'AwsStub has no ReturnValues {ReturnValues}', 501)
+        return {}
+
+    def dynamodb_transact_write_items(self, TransactItems, **_kwargs):
+        requests = []
+        for action in TransactItems:
+            (kind, request), = action.items()
+            if kind != 'Update':
+                raise StubError('NotImplemented', f'AwsStub has no transaction {kind}', 501)
+            requests.append(request)
+        reasons = []
+        for request in requests:
+            table = self.table(request['TableName'])
+            try:
+                _check(request.get('ConditionExpression'), table.items.get(table.key(request['Key'])),
+                       request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'))
+                reasons.append({'Code': 'None'})
+            except StubError as e:
+                reasons.append({'Code': 'ConditionalCheckFailed', 'Message': e.message})
+        if any(reason['Code'] != 'None' for reason in reasons):
+            raise StubError('TransactionCanceledException',
+                            'Transaction cancelled, please refer cancellation reasons for specific reasons [%s]' %
+                            ', '.join(reason['Code'] for reason in reasons), 400, CancellationReasons=reasons)
+        units = self.write_units
+        for request in requests:
+            self.dynamodb_update_item(**{name: value for name, value in request.items()
+                                         if name != 'ConditionExpression'})
+        self.write_units += self.write_units - units  # transactional writes cost double
+        return {}
+
+    def dynamodb_batch_write_item(self, RequestItems, **_kwargs):
+        for name, requests in RequestItems.items():
+            table = self.table(name)
+            for request in requests:
+                if 'PutRequest' not in request:
+                    raise StubError('NotImplemented', 'AwsStub has no batch DeleteRequest', 501)
+                item = request['PutRequest']['Item']
+                table.items[table.key(item)] = item
+                self._written(item)
+        return {'UnprocessedItems': {}}
+
+    def dynamodb_query(self, TableName, KeyConditionExpression, ExpressionAttributeNames=None,
+                       ExpressionAttributeValues=None, ScanIndexForward=True, ProjectionExpression=None,
+                       **_kwargs):
+        """All of a Query's items in one page: our queries read a document's pages or a few hours of stats."""
+        table = self.table(TableName)
+        match = _Parser(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues).condition()
+        items = sorted((item for item in table.items.values() if match(item)), key=table.key,
+                       reverse=not ScanIndexForward)
+        return {'Count': len(items), 'ScannedCount': len(items),
+                'Items': [_project(item, ProjectionExpression, ExpressionAttributeNames) for item in items]}
+
+
+class StubError(Exception):
+    def __init__(self, code, message, status, **extra):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+        self.message = message
+        self.status = status
+        self.extra = extra  # more of the error response, such as a transaction's CancellationReasons
+
+
+class S3Object(object):
+    __slots__ = ('data', 'etag', 'modified')
+
+    def __init__(self, data):
+        self.data = data
+        self.etag = '"%s"' % hashlib.md5(data).hexdigest()
+        self.modified = datetime.now(timezone.utc)
+
+
+class Table(object):
+    """A DynamoDB table's items, {key: item}, in the wire format: {'name': {'S': 'value'}}.
+
+    Its keys are (attribute name, type) pairs, type being 'S', 'N' or 'B'.
+    """
+
+    def __init__(self, name, hash_key, range_key=None):
+        self.name = name
+        (self.hash_key, hash_type), (self.range_key, range_type) = hash_key, range_key or (None, None)
+        self.key_types = {self.hash_key: hash_type, self.range_key: range_type}
+        self.items = {}
+
+    def key(self, item):
+        try:
+            return tuple(_plain(item[name]) for name in (self.hash_key, self.range_key) if name)
+        except KeyError:
+            raise StubError('ValidationException', 'The provided key element does not match the schema', 400)
+
+    def description(self):
+        keys = [(self.hash_key, 'HASH')] + ([(self.range_key, 'RANGE')] if self.range_key else [])
+        return {'TableName': self.name, 'TableStatus': 'ACTIVE', 'ItemCount': len(self.items),
+                'KeySchema': [{'AttributeName': name, 'KeyType': type} for name, type in keys],
+                'AttributeDefinitions': [{'AttributeName': name, 'AttributeType': self.key_types[name]}
+                                         for name, _ in keys],
+                'BillingModeSummary': {'BillingMode': 'PAY_PER_REQUEST'}}
+
+
+def _snake(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+def _byte_range(header, size):
+    start, end = header.split('=', 1)[1].split('-')
+    if not start:
+        return max(0, size - int(end)), size - 1
+    return int(start), min(int(end), size - 1) if end else size - 1
+
+
+def _find_model(table_name):
+    from pynamodb.models import Model
+    models = list(Model.__subclasses__())
+    while models:
+        model = models.pop()
+        if getattr(getattr(model, 'Meta', None), 'table_name', None) == table_name:
+            return model
+        models.extend(model.__subclasses__())
+    return None
+
+
+def _plain(value):
+    """The Python value of a wire format value, {'N': '1'} -> Decimal('1')."""
+    (type, data), = value.items()
+    return Decimal(data) if type == 'N' else data
+
+
+def _project(item, projection, names):
+    if not projection:
+        return item
+    wanted = [(names or {}).get(name.strip(), name.strip()) for name in projection.split(',')]
+    return {name: item[name] for name in wanted if name in item}
+
+
+def _check(condition, item, names, values):
+    if condition and not _Parser(condition, names, values).condition()(item or {}):
+        raise StubError('ConditionalCheckFailedException', 'The conditional request failed', 400)
+
+
+_TOKEN_RE = re.compile(r'\s*(<>|<=|>=|[=<>(),]|[#:]?[A-Za-z0-9_]+)')
+_COMPARE = {'=': lambda a, b: a == b, '<>': lambda a, b: a != b, '<': lambda a, b: a < b,
+            '<=': lambda a, b: a <= b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+_MISSING = object()
+
+
+class _Parser(object):
+    """Parse the condition and update expressions our models write into functions of an item."""
+
+    def __init__(self, expression, names, values):
+        self.names = names or {}
+        self.values = values or {}
+        self.tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = _TOKEN_RE.match(expression, pos)
+            if not match:
+                raise StubError('ValidationException', f'Invalid expression: {expression}', 400)
+            self.tokens.append(match.group(1))
+            pos = match.end()
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos].upper() if self.pos < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        if expected is not None and (token or '').upper() != expected:
+            raise StubError('ValidationException', f'Expected {expected}, found {token}', 400)
+        self.pos += 1
+        return token
+
+    def condition(self):
+        cond = self._or()
+        if self.peek() is not None:
+            raise StubError('NotImplemented', f'AwsStub cannot parse {self.take()}', 501)
+        return cond
+
+    def _or(self):
+        left = self._and()
+        while self.peek() == 'OR':
+            self.take()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, self._and())
+        return left
+
+    def _and(self):
+        left = self._not()
+        while self.peek() == 'AND':
+            self.take()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, self._not())
+        return left
+
+    def _not(self):
+        if self.peek() == 'NOT':
+            self.take()
+            inner = self._not()
+            return lambda item: not inner(item)
+        if self.peek() == '(':
+            self.take()
+            cond = self._or()
+            self.take(')')
+            return cond
+        if self.peek() in ('ATTRIBUTE_EXISTS', 'ATTRIBUTE_NOT_EXISTS'):
+            exists = self.take().upper() == 'ATTRIBUTE_EXISTS'
+            self.take('(')
+            name = self.name()
+            self.take(')')
+            return lambda item: (name in item) == exists
+        left = self.operand()
+        op = self.take().upper()
+        if op == 'BETWEEN':
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: _compare('<=', low(item), left(item)) and _compare('<=', left(item), high(item))
+        if op not in _COMPARE:
+            raise StubError('NotImplemented', f'AwsStub cannot compare with {op}', 501)
+        right = self.operand()
+        return lambda item: _compare(op, left(item), right(item))
+
+    def name(self):
+        token = self.take()
+        return self.names.get(token, token)
+
+    def operand(self):
+        """Return a function of an item giving a wire format value, or _MISSING."""
+        if (self.tokens[self.pos] if self.pos < len(self.tokens) else '').startswith(':'):
+            value = self.values[self.take()]
+            return lambda item: value
+        name = self.name()
+        return lambda item: item.get(name, _MISSING)
+
+    def update(self, item):
+        """Apply a SET and ADD update expression to item in place."""
+        while self.peek() is not None:
+            clause = self.take().upper()
+            while True:
+                name = self.name()
+                if clause == 'SET':
+                    self.take('=')
+                    item[name] = self.operand()(item)
+                elif clause == 'ADD':
+                    value = self.operand()(item)
+                    if 'N' not in value:
+                        raise StubError('NotImplemented', 'AwsStub only ADDs numbers', 501)
+                    old = item.get(name, {'N': '0'})
+                    item[name] = {'N': str(Decimal(old['N']) + Decimal(value['N']))}
+                else:
+                    raise StubError('NotImplemented', f'AwsStub has no update clause {clause}', 501)
+                if self.peek() != ',':
+                    break
+                self.take()
+
+
+def _compare(op, left, right):
+    if left is _MISSING or right is _MISSING:
+        return op == '<>' and not (left is _MISSING and right is _MISSING)
+    if op not in ('=', '<>') and next(iter(left)) != next(iter(right)):
+        return False
+    return _COMPARE[op](_plain(left), _plain(right))
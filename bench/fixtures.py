@@ -0,0 +1,110 @@
+"""Synthetic PDFs for benchmarks: scans, pages that are one grey JPEG each, and text pages.
+
+gray_jpeg writes a baseline JPEG of a flat grey page directly, a couple of
+bits per 8x8 block, so no imaging library is needed; a COM segment carries
+a label, which keeps every page's bytes distinct, and pads it to the size
+of a real scan. The PDFs are written with our PyPDF2, which must be
+importable, as it is from stepsfunction.
+"""
+import io
+
+from PyPDF2 import PdfFileWriter
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject,
+                            NumberObject, TextStringObject)
+
+# 8.5x11 inches at 300 dpi, and what such a scan typically weighs as a JPEG
+PAGE_WIDTH, PAGE_HEIGHT = 2550, 3300
+PAGE_JPEG_BYTES = 200 * 1024
+
+
+def _segment(marker, payload):
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+
+def gray_jpeg(width=PAGE_WIDTH, height=PAGE_HEIGHT, label=b'', size=0):
+    """Return a JPEG of a flat mid-grey image, padded with comments to at least size bytes.
+
+    Every block's DC difference and AC coefficients are zero, so one-code
+    Huffman tables encode each block as two 0 bits.
+    """
+    blocks = -(-width // 8) * -(-height // 8)
+    bits = 2 * blocks
+    scan = bytearray(b'\x00' * (bits // 8))
+    if bits % 8:
+        scan.append(0xFF >> (bits % 8))  # pad the last byte with 1 bits
+    header = (b'\xff\xd8' +
+              _segment(0xDB, b'\x00' + b'\x01' * 64) +
+              _segment(0xC0, b'\x08' + height.to_bytes(2, 'big') + width.to_bytes(2, 'big') + b'\x01\x01\x11\x00') +
+              _segment(0xC4, b'\x00' + b'\x01' + b'\x00' * 15 + b'\x00') +   # DC: category 0 is code 0
+              _segment(0xC4, b'\x10' + b'\x01' + b'\x00' * 15 + b'\x00'))    # AC: end of block is code 0
+    comment = _segment(0xFE, label) if label else b''
+    tail = _segment(0xDA, b'\x01\x01\x00\x00\x3f\x00') + bytes(scan) + b'\xff\xd9'
+    padding = size - len(header) - len(comment) - len(tail)
+    while padding > 4:
+        chunk = min(padding - 4, 65533)
+        comment += _segment(0xFE, b' ' * chunk)
+        padding -= chunk + 4
+    return header + comment + tail
+
+
+def _image(writer, jpeg, width, height):
+    image = DecodedStreamObject()
+    image.setData(jpeg)
+    image.update({NameObject('/Type'): NameObject('/XObject'),
+                  NameObject('/Subtype'): NameObject('/Image'),
+                  NameObject('/Width'): NumberObject(width),
+                  NameObject('/Height'): NumberObject(height),
+                  NameObject('/ColorSpace'): NameObject('/DeviceGray'),
+                  NameObject('/BitsPerComponent'): NumberObject(8),
+                  NameObject('/Filter'): NameObject('/DCTDecode')})
+    return writer._addObject(image)
+
+
+def scanned_pdf(num_pages, width=PAGE_WIDTH, height=PAGE_HEIGHT, jpeg_bytes=PAGE_JPEG_BYTES, label=''):
+    """Return the bytes of a PDF of num_pages letter pages, each drawing its own grey scan."""
+    writer = PdfFileWriter()
+    for page_num in range(num_pages):
+        jpeg = gray_jpeg(width, height, label=f'{label} page {page_num}'.encode(), size=jpeg_bytes)
+        content = DecodedStreamObject()
+        content.setData(b'q 612 0 0 792 0 0 cm /Im0 Do Q')
+        page = writer.addBlankPage(612, 792)
+        page[NameObject('/Contents')] = writer._addObject(content)
+        page[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): DictionaryObject(
+            {NameObject('/Im0'): _image(writer, jpeg, width, height)})})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def text_pdf(num_pages, lines=60, links=10):
+    """Return the bytes of a PDF of num_pages born-digital pages: lines of text and links, unfiltered.
+
+    Its objects and content streams are many small tokens, as a parser
+    meets in text documents, rather than a few large images.
+    """
+    writer = PdfFileWriter()
+    font = writer._addObject(DictionaryObject({NameObject('/Type'): NameObject('/Font'),
+                                               NameObject('/Subtype'): NameObject('/Type1'),
+                                               NameObject('/BaseFont'): NameObject('/Helvetica')}))
+    for page_num in range(num_pages):
+        content = DecodedStreamObject()
+        content.setData(b''.join(
+            b'0.9 0.9 0.9 rg 72 %d 468 12 re f BT /F1 10 Tf 72 %d Td 0 Tw (Line %d of page %d: the quick '
+            b'brown fox \\(jumps\\) over <the> lazy dog.) Tj [(Ke) -40 (rned)] TJ ET\n'
+            % (740 - 12 * line, 742 - 12 * line, line, page_num) for line in range(lines)))
+        page = writer.addBlankPage(612, 792)
+        page[NameObject('/Contents')] = writer._addObject(content)
+        page[NameObject('/Resources')] = DictionaryObject({NameObject('/Font'): DictionaryObject(
+            {NameObject('/F1'): font})})
+        page[NameObject('/Annots')] = ArrayObject(writer._addObject(DictionaryObject({
+            NameObject('/Type'): NameObject('/Annot'),
+            NameObject('/Subtype'): NameObject('/Link'),
+            NameObject('/Rect'): ArrayObject(FloatObject(x) for x in (72, 740 - 12 * link, 540.5, 752.25 - 12 * link)),
+            NameObject('/Border'): ArrayObject([NumberObject(0), NumberObject(0), NumberObject(0)]),
+            NameObject('/A'): DictionaryObject({NameObject('/S'): NameObject('/URI'),
+                                                NameObject('/URI'): TextStringObject(
+                                                    f'https://example.com/page/{page_num}/{link}')})}))
+            for link in range(links))
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
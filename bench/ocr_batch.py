@@ -0,0 +1,119 @@
+"""Compare OCR throughput and cost: one page per invocation vs batched pages.
+
+ocr_page OCRs one page per Lambda invocation with one tesseract process;
+ocr_pages OCRs a batch of pages on OCR_WORKERS threads, each driving a
+single-threaded tesseract. This runs both models over local page PDFs, such
+as a downloaded page_pdf/jid/ prefix, leaving S3 and DynamoDB out, and prices
+the measured durations with Lambda's GB-second and request prices.
+
+Run it from the repo root with stepsfunction's requirements installed:
+    python bench/ocr_batch.py --pages /path/to/page_pdf/jid
+    python bench/ocr_batch.py --pages DIR --workers 2 --batch-size 10 --json
+
+The local CPUs are not Lambda's: pass --workers to match the vCPUs of the
+--batch-memory you want to price (about 1 vCPU per 1769 MB).
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STEPSFUNCTION = os.path.join(HERE, '..', 'stepsfunction')
+
+# ocr extends LD_LIBRARY_PATH at import; ENV keeps models off real tables
+os.environ.setdefault('ENV', 'bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LD_LIBRARY_PATH', '')
+
+GB_SECOND_PRICE = 0.0000166667
+REQUEST_PRICE = 0.20 / 1000000
+
+
+def invocation_cost(seconds, memory_mb, billing_ms):
+    """Price one invocation of a duration, rounded up to the billing granularity."""
+    billed = math.ceil(seconds * 1000 / billing_ms) * billing_ms / 1000
+    return REQUEST_PRICE + billed * memory_mb / 1024 * GB_SECOND_PRICE
+
+
+def one_page_per_invocation(ocr, pdfs, args):
+    """OCR pages one after another, each as its own invocation would."""
+    seconds = []
+    t_0 = time()
+    for pdf in pdfs:
+        t_page = time()
+        ocr.ocr_images(ocr.extract_images_from_pdf(pdf))
+        seconds.append(time() - t_page + args.invoke_overhead)
+    wall = time() - t_0
+    cost = sum(invocation_cost(s, args.page_memory, args.billing_ms) for s in seconds)
+    return {'model': 'one page per invocation', 'pages': len(pdfs), 'invocations': len(pdfs),
+            'memory_mb': args.page_memory, 'workers': 1, 'seconds': wall,
+            'pages_per_second': len(pdfs) / wall, 'cost_per_page': cost / len(pdfs)}
+
+
+def batched(ocr, pdfs, args):
+    """OCR batches of pages on a pool of single-threaded tesseracts, as ocr_pages does."""
+    env = dict(os.environ, OMP_THREAD_LIMIT='1')
+    cost = 0.0
+    t_0 = time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for i in range(0, len(pdfs), args.batch_size):
+            t_batch = time()
+            list(pool.map(lambda pdf: ocr.ocr_images(ocr.extract_images_from_pdf(pdf), env=env),
+                          pdfs[i:i + args.batch_size]))
+            cost += invocation_cost(time() - t_batch + args.invoke_overhead,
+                                    args.batch_memory, args.billing_ms)
+    wall = time() - t_0
+    return {'model': 'batched', 'pages': len(pdfs), 'invocations': math.ceil(len(pdfs) / args.batch_size),
+            'memory_mb': args.batch_memory, 'workers': args.workers, 'seconds': wall,
+            'pages_per_second': len(pdfs) / wall, 'cost_per_page': cost / len(pdfs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', required=True, help='directory of single-page scanned PDFs')
+    parser.add_argument('--limit', type=int, default=0, help='use only the first LIMIT pages')
+    parser.add_argument('--workers', type=int, default=0, help='batch tesseract processes, default our vCPUs')
+    parser.add_argument('--batch-size', type=int, default=10, help='pages per batched invocation')
+    parser.add_argument('--page-memory', type=int, default=1024, help='MB of the one-page function')
+    parser.add_argument('--batch-memory', type=int, default=3008, help='MB of the batch function')
+    parser.add_argument('--invoke-overhead', type=float, default=0.0,
+                        help='seconds billed per invocation besides OCR, e.g. S3 and DynamoDB calls')
+    parser.add_argument('--billing-ms', type=int, default=1, help='billing granularity, 100 before Dec 2020')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.pages, '*.pdf')))
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        parser.error(f'no PDFs in {args.pages}')
+    pdfs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            pdfs.append(f.read())
+
+    # TESSERACT_BIN and TESSERACT_DATA are relative to the function's directory
+    os.chdir(STEPSFUNCTION)
+    sys.path.insert(0, STEPSFUNCTION)
+    import ocr
+    ocr.LOG.setLevel('WARNING')
+    args.workers = args.workers or ocr.OCR_WORKERS
+
+    results = [one_page_per_invocation(ocr, pdfs, args), batched(ocr, pdfs, args)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"model":<24} {"pages":>6} {"invokes":>8} {"MB":>5} {"workers":>7} '
+          f'{"seconds":>8} {"pages/s":>8} {"$/1000 pages":>13}')
+    for r in results:
+        print(f'{r["model"]:<24} {r["pages"]:>6} {r["invocations"]:>8} {r["memory_mb"]:>5} {r["workers"]:>7} '
+              f'{r["seconds"]:>8.2f} {r["pages_per_second"]:>8.2f} {r["cost_per_page"] * 1000:>13.5f}')
+
+
+if __name__ == '__main__':
+    main()
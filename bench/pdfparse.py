@@ -0,0 +1,159 @@
+"""Measure how fast our PyPDF2 parses: opening a PDF, reading its objects and its content streams.
+
+Each case parses a synthetic PDF from bench/fixtures.py in this process,
+with stepsfunction's PyPDF2, as PlanSplit, SplitRange and OcrPage do:
+  xref     PdfFileReader over the bytes: the cross-reference table and trailer, text pages
+  open     PdfFileReader over the bytes and resolving every object, text pages
+  file     the same over a file on disk rather than bytes in memory
+  content  parsing every page's content stream into operations, text pages
+  split    PageSplitter writing every page of a scan, as SplitRange does
+Each number is the median of --runs runs, in milliseconds, with the tokens
+or pages per second it comes to.
+
+Run it from the repo root with stepsfunction's requirements installed:
+    python bench/pdfparse.py
+    python bench/pdfparse.py --pages 200 --runs 9 --json --output pdfparse.json
+    python bench/pdfparse.py --baseline pdfparse.json --tolerance 0.2
+With --baseline, each case's speedup over the baseline's is shown, and
+cases slower than it by more than --tolerance are listed and we exit 1.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import warnings
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STEPSFUNCTION = os.path.join(HERE, '..', 'stepsfunction')
+
+
+def resolve_all(reader):
+    """Read every object in use in a reader's cross-reference table; return how many there were."""
+    from PyPDF2.generic import IndirectObject
+    count = 0
+    for generation, idnums in reader.xref.items():
+        for idnum in idnums:
+            if idnum == 0:  # the head of the free list
+                continue
+            reader.getObject(IndirectObject(idnum, generation, reader))
+            count += 1
+    return count
+
+
+def case_xref(pdf, path):
+    from PyPDF2 import PdfFileReader
+    return sum(len(idnums) for idnums in PdfFileReader(io.BytesIO(pdf)).xref.values())
+
+
+def case_open(pdf, path):
+    from PyPDF2 import PdfFileReader
+    return resolve_all(PdfFileReader(io.BytesIO(pdf)))
+
+
+def case_file(pdf, path):
+    from PyPDF2 import PdfFileReader
+    with open(path, 'rb') as f:
+        return resolve_all(PdfFileReader(f))
+
+
+def case_content(pdf, path):
+    from PyPDF2 import PdfFileReader
+    from PyPDF2.pdf import ContentStream
+    reader = PdfFileReader(io.BytesIO(pdf))
+    return sum(len(ContentStream(reader.getPage(num).getContents(), reader).operations)
+               for num in range(reader.getNumPages()))
+
+
+def case_split(pdf, path):
+    from PyPDF2 import PdfFileReader, PageSplitter
+    splitter = PageSplitter(PdfFileReader(io.BytesIO(pdf)))
+    for num in range(splitter.reader.getNumPages()):
+        splitter.getPageBytes(num)
+    return splitter.reader.getNumPages()
+
+
+# name -> (function, unit of what it returns, whether it parses the scan rather than the text pages)
+CASES = {
+    'xref': (case_xref, 'entries', False),
+    'open': (case_open, 'objects', False),
+    'file': (case_file, 'objects', False),
+    'content': (case_content, 'operations', False),
+    'split': (case_split, 'pages', True),
+}
+
+
+def measure(name, pdf, path, runs):
+    """Median milliseconds of a case over runs, and the units it handled per second."""
+    function, unit, _ = CASES[name]
+    times = []
+    for _ in range(runs):
+        t_0 = perf_counter()
+        count = function(pdf, path)
+        times.append((perf_counter() - t_0) * 1000)
+    ms = statistics.median(times)
+    return {'case': name, 'ms': ms, 'count': count, 'unit': unit, 'per_second': count / ms * 1000}
+
+
+def compare(results, baseline, tolerance):
+    """Add each case's speedup over the baseline's; return a line for each that got slower."""
+    before = {r['case']: r for r in baseline}
+    lines = []
+    for r in results:
+        old = before.get(r['case'])
+        if not old:
+            continue
+        r['speedup'] = old['ms'] / r['ms']
+        if r['ms'] > old['ms'] * (1 + tolerance):
+            lines.append(f'{r["case"]} {old["ms"]:.1f} -> {r["ms"]:.1f} ms')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=100, help='pages of each synthetic PDF')
+    parser.add_argument('--lines', type=int, default=60, help='lines of text on each text page')
+    parser.add_argument('--runs', type=int, default=5, help='runs of each case')
+    parser.add_argument('--only', default='', help='cases whose name contains this')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown allowed over the baseline')
+    args = parser.parse_args()
+
+    sys.path[:0] = [STEPSFUNCTION, HERE]
+    warnings.simplefilter('ignore')
+    from fixtures import scanned_pdf, text_pdf
+    text = text_pdf(args.pages, lines=args.lines)
+    scan = scanned_pdf(args.pages, jpeg_bytes=20 * 1024)
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+        f.write(text)
+        f.flush()
+        results = [measure(name, scan if CASES[name][2] else text, f.name, args.runs)
+                   for name in CASES if args.only in name]
+
+    slower = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'{"case":<8} {"ms":>9} {"count":>7} {"per second":>11} {"":<10} {"speedup":>7}')
+        for r in results:
+            speedup = f'{r["speedup"]:>7.2f}' if 'speedup' in r else ''
+            print(f'{r["case"]:<8} {r["ms"]:>9.1f} {r["count"]:>7} {r["per_second"]:>11.0f} {r["unit"]:<10} {speedup}')
+    for line in slower:
+        print(f'slower: {line}', file=sys.stderr)
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
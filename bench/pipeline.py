@@ -0,0 +1,255 @@
+"""Run documents through the whole pipeline locally, reporting throughput and stage latencies.
+
+Each synthetic scanned PDF is stored under doc_pdf/ in bench/awsstub.py's
+in-memory S3, which invokes Uploaded as the bucket's notification would.
+Its execution then runs the state machine in serverless.yml: StartStateMachine,
+PlanSplit, a SplitRange per chunk at most --map-concurrency at a time, and
+WaitForOcr until the task token it stored comes back, then AssembleText
+and IndexText.
+Every page stored under page_pdf/ invokes OcrPage, and the OcrPage of the
+last page sends the token. All of these are our real handler functions; only AWS is stubbed.
+
+Each Lambda function gets --concurrency threads, as its reserved
+concurrency. An S3-invoked function that raises is retried twice, as Lambda
+retries asynchronous invocations. We report pages and documents per second
+from the first upload to the last document done, each stage's latency
+percentiles, and DynamoDB and S3 calls and write units per page. The
+stages inside the handlers, such as s3_get or ocr_aws, come from their
+metrics, collected with a metrics.LocalSink instead of printed.
+
+Everything runs in this one process: the handlers share their clients,
+router and cache, and CPU-bound stages such as splitting share one core
+through the GIL. Take the latencies at --concurrency 1 as a function's
+duration, and compare throughput between runs rather than with Lambda.
+--s3-ms, --dynamodb-ms and --textract-ms add the latency of the real
+services to every stubbed call. tesseract must be built for the local
+machine, see --tesseract; OCR falls back to the stubbed Textract when it
+fails.
+
+Run it from the repo root with stepsfunction's requirements installed:
+    python bench/pipeline.py --docs 10 --pages 20
+    python bench/pipeline.py --docs 40 --pages 5,50,200 --concurrency 20 --textract-ms 800 --json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from uuid import uuid4
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STEPSFUNCTION = os.path.join(HERE, '..', 'stepsfunction')
+
+# ENV puts the models' tables on localhost, which the stub answers instead
+for name, value in {'ENV': 'bench', 'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'bench',
+                    'AWS_SECRET_ACCESS_KEY': 'bench', 'LD_LIBRARY_PATH': '',
+                    'UPLOAD_BUCKET_NAME': 'bench-bucket',
+                    'STATEMACHINE_ARN': 'arn:aws:states:us-east-1:000000000000:stateMachine:firstSteps'}.items():
+    os.environ.setdefault(name, value)
+
+BUCKET = os.environ['UPLOAD_BUCKET_NAME']
+ASYNC_RETRIES = 2
+DYNAMODB_WRITES = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems')
+
+
+class Pipeline(object):
+    """Our Lambda functions wired together by the stub's notifications and a local state machine."""
+
+    def __init__(self, stub, concurrency, map_concurrency, chunk_pages, timeout):
+        import assemble
+        import callback
+        import ocr
+        import search
+        import split
+        import upload
+        self.stub = stub
+        self.map_concurrency = map_concurrency
+        self.chunk_pages = chunk_pages
+        self.timeout = timeout
+        self.functions = {'Uploaded': upload.uploaded, 'StartStateMachine': upload.start_state_machine,
+                          'SplitPdf': split.split_doc_pdf, 'WaitForOcr': callback.wait_for_ocr,
+                          'OcrPage': ocr.ocr_page, 'AssembleText': assemble.assemble_text,
+                          'IndexText': search.index_text}
+        self.pools = {name: ThreadPoolExecutor(max_workers=concurrency) for name in self.functions}
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)  # stage: [seconds]
+        self.errors = Counter()             # stage: invocations that raised
+        self.uploaded_at = {}               # jid: time
+        self.documents = {}                 # jid: {'pages', 'seconds', 'status'}
+        self.all_done = threading.Event()
+        self.expected = 0
+        stub.on_object_created(lambda event: self.invoke_async('Uploaded', event), prefix='doc_pdf/', suffix='.pdf')
+        stub.on_object_created(lambda event: self.invoke_async('OcrPage', event), prefix='page_pdf/', suffix='.pdf')
+        stub.on_execution(lambda execution: threading.Thread(target=self.execute, args=(execution,),
+                                                             daemon=True).start())
+
+    def _run(self, stage, event):
+        t_0 = time()
+        try:
+            return self.functions[stage.split()[0]](event, None)
+        except Exception:
+            with self.lock:
+                self.errors[stage] += 1
+            raise
+        finally:
+            with self.lock:
+                self.latencies[stage].append(time() - t_0)
+
+    def invoke(self, stage, event):
+        """Invoke a function and wait for its result, as a Task state does."""
+        return self.pools[stage.split()[0]].submit(self._run, stage, event).result()
+
+    def invoke_async(self, stage, event):
+        """Invoke a function for an S3 event, retrying it as Lambda would if it raises."""
+        def attempt(retries):
+            try:
+                self._run(stage, event)
+            except Exception:
+                if retries:
+                    self.pools[stage].submit(attempt, retries - 1)
+        self.pools[stage].submit(attempt, ASYNC_RETRIES)
+
+    def execute(self, execution):
+        """Run the firstSteps state machine for one execution."""
+        sf_input = json.loads(execution['input'])
+        jid = sf_input['jid']
+        status = 'failed'
+        try:
+            state = self.invoke('StartStateMachine', sf_input)
+            plan = self.invoke('SplitPdf plan', dict(state, mode='plan', chunk_pages=self.chunk_pages))
+            with ThreadPoolExecutor(max_workers=self.map_concurrency) as pool:
+                list(pool.map(lambda chunk: self.invoke('SplitPdf', chunk), plan['chunks']))
+            self.invoke('SplitPdf done', {'mode': 'done', 'jid': jid})
+            token = uuid4().hex
+            self.invoke('WaitForOcr', {'jid': jid, 'taskToken': token})
+            result = self.stub.wait_task(token, timeout=self.timeout)
+            status = 'timed out' if result is None else result[0]
+            if status == 'success':
+                self.invoke('AssembleText', {'bucket': state['bucket'], 'jid': jid, 'num_pages': plan['num_pages']})
+                self.invoke('IndexText', {'bucket': state['bucket'], 'jid': jid})
+        except Exception as e:
+            status = f'failed: {e!r}'
+        finally:
+            with self.lock:
+                seconds = time() - self.uploaded_at[jid]
+                self.documents[jid].update(seconds=seconds, status=status)
+                if status == 'success':
+                    self.latencies['Document'].append(seconds)
+                if sum(1 for doc in self.documents.values() if 'status' in doc) == self.expected:
+                    self.all_done.set()
+
+    def upload(self, pdfs):
+        """Upload every (num_pages, pdf) as a user would and wait for them all; return the seconds taken."""
+        self.expected = len(pdfs)
+        t_0 = time()
+        for num_pages, pdf in pdfs:
+            jid = uuid4().hex
+            with self.lock:
+                self.uploaded_at[jid] = time()
+                self.documents[jid] = {'pages': num_pages}
+            self.stub.put(BUCKET, f'doc_pdf/{jid}/doc.pdf', pdf)
+        if not self.all_done.wait(self.timeout * len(pdfs)):
+            print('some documents never finished', file=sys.stderr)
+        wall = time() - t_0
+        for pool in self.pools.values():  # the last OcrPage returns after sending the token
+            pool.shutdown(wait=True)
+        return wall
+
+
+def percentiles(seconds):
+    ordered = sorted(seconds)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return {'n': len(ordered), 'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99), 'max_ms': ordered[-1] * 1000}
+
+
+def report(pipeline, stub, wall, measurements):
+    done = [doc for doc in pipeline.documents.values() if doc.get('status') == 'success']
+    pages = sum(doc['pages'] for doc in done)
+    all_pages = sum(doc['pages'] for doc in pipeline.documents.values()) or 1
+    dynamodb_writes = sum(n for (service, op), n in stub.calls.items()
+                          if service == 'dynamodb' and op in DYNAMODB_WRITES)
+    return {'documents': len(pipeline.documents), 'documents_done': len(done), 'pages_done': pages,
+            'seconds': wall, 'pages_per_second': pages / wall, 'documents_per_second': len(done) / wall,
+            'failed': sorted({doc['status'] for doc in pipeline.documents.values()
+                              if doc.get('status') != 'success'}),
+            'stages': {stage: percentiles(seconds) for stage, seconds in sorted(pipeline.latencies.items())},
+            'errors': dict(pipeline.errors),
+            'measured': {stage: percentiles(seconds) for stage, seconds in sorted(measurements.items())},
+            'dynamodb_writes': dynamodb_writes, 'dynamodb_write_units': stub.write_units,
+            'dynamodb_writes_per_page': dynamodb_writes / all_pages,
+            'dynamodb_write_units_per_page': stub.write_units / all_pages,
+            'aws_calls': {f'{service} {op}': n for (service, op), n in sorted(stub.calls.items())}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=10, help='documents to upload')
+    parser.add_argument('--pages', default='20', help='pages per document, or a comma separated list to cycle')
+    parser.add_argument('--jpeg-kb', type=int, default=200, help='KB of each page scan')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent invocations per function')
+    parser.add_argument('--map-concurrency', type=int, default=40, help="SplitPages' MaxConcurrency")
+    parser.add_argument('--chunk-pages', type=int, default=50, help='pages per SplitRange')
+    parser.add_argument('--timeout', type=float, default=300, help="WaitForOcr's TimeoutSeconds")
+    parser.add_argument('--s3-ms', type=float, default=0, help='latency added to every S3 call')
+    parser.add_argument('--dynamodb-ms', type=float, default=0, help='latency added to every DynamoDB call')
+    parser.add_argument('--textract-ms', type=float, default=0, help='latency added to every Textract call')
+    parser.add_argument('--tesseract', help='tesseract binary to use instead of the Lambda build')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    # TESSERACT_BIN and TESSERACT_DATA are relative to the function's directory
+    os.chdir(STEPSFUNCTION)
+    sys.path[:0] = [STEPSFUNCTION, HERE]
+    import logging
+    from awsstub import AwsStub
+    from fixtures import scanned_pdf
+    import metrics
+    import ocr
+    logging.disable(logging.CRITICAL)
+    if args.tesseract:
+        ocr.TESSERACT_BIN = args.tesseract
+
+    page_counts = [int(n) for n in args.pages.split(',')]
+    pdfs = []
+    for i in range(args.docs):
+        num_pages = page_counts[i % len(page_counts)]
+        pdfs.append((num_pages, scanned_pdf(num_pages, jpeg_bytes=args.jpeg_kb * 1024, label=f'doc {i}')))
+
+    sink = metrics.LocalSink()
+    metrics.use(sink)
+    stub = AwsStub().install()
+    stub.latency.update(s3=args.s3_ms / 1000, dynamodb=args.dynamodb_ms / 1000, textract=args.textract_ms / 1000)
+    pipeline = Pipeline(stub, args.concurrency, args.map_concurrency, args.chunk_pages, args.timeout)
+    wall = pipeline.upload(pdfs)
+    measurements = defaultdict(list)
+    for record in sink:
+        measurements[record['stage']].append(record['seconds'])
+    result = report(pipeline, stub, wall, measurements)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f'{result["documents_done"]}/{result["documents"]} documents, {result["pages_done"]} pages '
+          f'in {wall:.2f}s: {result["pages_per_second"]:.2f} pages/s, {result["documents_per_second"]:.3f} docs/s')
+    for status in result['failed']:
+        print(f'not done: {status}')
+    print(f'{"stage":<18} {"n":>6} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"max ms":>9} {"errors":>6}')
+    for stage, p in result['stages'].items():
+        print(f'{stage:<18} {p["n"]:>6} {p["p50_ms"]:>9.1f} {p["p90_ms"]:>9.1f} {p["p99_ms"]:>9.1f} '
+              f'{p["max_ms"]:>9.1f} {result["errors"].get(stage, 0):>6}')
+    print(f'{"measured":<18} {"n":>6} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    for stage, p in result['measured'].items():
+        print(f'{stage:<18} {p["n"]:>6} {p["p50_ms"]:>9.1f} {p["p90_ms"]:>9.1f} {p["p99_ms"]:>9.1f} '
+              f'{p["max_ms"]:>9.1f}')
+    print(f'DynamoDB: {result["dynamodb_writes"]} writes, {result["dynamodb_write_units"]} write units, '
+          f'{result["dynamodb_writes_per_page"]:.2f} writes and {result["dynamodb_write_units_per_page"]:.2f} '
+          f'units per page')
+    print('calls: ' + ', '.join(f'{call}={n}' for call, n in result['aws_calls'].items()))
+
+
+if __name__ == '__main__':
+    main()
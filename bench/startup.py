@@ -0,0 +1,193 @@
+"""Measure what a cold start pays to import every Lambda handler's module.
+
+Every function in a serverless.yml of the repo is an entry, plus the
+vendored PyPDF2 of each project that has one. Each is imported in a fresh
+interpreter, in its project's directory, as a new Lambda container would,
+and we report the median milliseconds over --runs interpreters and the
+modules the import loaded. botocore is stubbed as it loads: an AWS call made
+at import is counted in aws_calls and answered with an empty response
+instead of reaching AWS, so the number is the import's alone.
+
+Run it from the repo root with the projects' requirements installed:
+    python bench/startup.py
+    python bench/startup.py --only stepsfunction/ --runs 10 --json --output startup.json
+    python bench/startup.py --baseline startup.json --tolerance 0.25
+With --baseline, entries whose import got slower than the baseline's by
+more than --tolerance are listed and we exit 1, so a change's effect on
+cold starts can be checked in review.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# The handlers read these at import; none reach AWS
+ENV = {
+    'ENV': 'bench',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'LD_LIBRARY_PATH': '',
+    'UPLOAD_BUCKET_NAME': 'bench-bucket',
+    'BUCKET_NAME': 'bench-bucket',
+    'STATEMACHINE_ARN': 'arn:aws:states:us-east-1:000000000000:stateMachine:bench',
+    'ACTIVITY_ARN': 'arn:aws:states:us-east-1:000000000000:activity:bench',
+    'ACTIVITY_OCR_DONE_ARN': 'arn:aws:states:us-east-1:000000000000:activity:bench',
+}
+
+# Runs in the fresh interpreter: argv is the module. The finder stubs BaseClient._make_api_call
+# once botocore.client has loaded, without importing anything ahead of the timed import.
+PROBE = '''
+import json, sys
+from importlib.machinery import PathFinder
+from time import perf_counter
+calls = {}
+
+
+def make_api_call(client, operation_name, api_params):
+    call = f'{client.meta.service_model.service_name} {operation_name}'
+    calls[call] = calls.get(call, 0) + 1
+    return {}
+
+
+class StubBotocore(object):
+    def find_spec(self, name, path=None, target=None):
+        if name != 'botocore.client':
+            return None
+        sys.meta_path.remove(self)
+        spec = PathFinder.find_spec(name, path)
+        exec_module = spec.loader.exec_module
+
+        def exec_and_stub(module):
+            exec_module(module)
+            module.BaseClient._make_api_call = make_api_call
+        spec.loader.exec_module = exec_and_stub
+        return spec
+
+
+sys.meta_path.insert(0, StubBotocore())
+modules = len(sys.modules)
+t_0 = perf_counter()
+__import__(sys.argv[1])
+import_ms = (perf_counter() - t_0) * 1000
+print(json.dumps({'import_ms': import_ms, 'modules': len(sys.modules) - modules, 'aws_calls': calls}))
+'''
+
+
+def entries():
+    """Return [(project, Lambda function, module)] from every serverless.yml, and each project's PyPDF2."""
+    found = []
+    for path in sorted(glob.glob(os.path.join(ROOT, '*', 'serverless.yml'))):
+        project = os.path.dirname(path)
+        name = os.path.basename(project)
+        found.extend((name, function, handler.rsplit('.', 1)[0]) for function, handler in _functions(path))
+        if os.path.exists(os.path.join(project, 'PyPDF2', '__init__.py')):
+            found.append((name, 'PyPDF2', 'PyPDF2'))
+    return found
+
+
+def _functions(path):
+    """Return [(name, handler)] of a serverless.yml's functions: block, without needing a YAML parser."""
+    functions = []
+    name = None
+    in_functions = False
+    with open(path) as f:
+        for line in f:
+            if re.match(r'\S', line):
+                in_functions = line.startswith('functions:')
+                continue
+            if not in_functions or line.lstrip().startswith('#'):
+                continue
+            match = re.match(r'  (\w[\w-]*):\s*$', line)
+            if match:
+                name = match.group(1)
+            match = re.match(r'\s+handler:\s*([\w.]+)', line)
+            if match and name:
+                functions.append((name, match.group(1)))
+    return functions
+
+
+def probe(project, module):
+    """Import module in a new interpreter, return its timing."""
+    env = dict(os.environ, **ENV)
+    env['PYTHONPATH'] = ''
+    out = subprocess.run([sys.executable, '-c', PROBE, module], cwd=os.path.join(ROOT, project), env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if out.returncode:
+        return {'failed': out.stderr.decode(errors='replace').strip().splitlines()[-1]}
+    return json.loads(out.stdout.decode().strip().splitlines()[-1])
+
+
+def measure(entry, runs):
+    """Median import time of an entry over runs fresh interpreters."""
+    project, function, module = entry
+    result = {'project': project, 'function': function, 'module': module}
+    probe(project, module)  # compile the modules once, so no run writes bytecode
+    samples = [probe(project, module) for _ in range(runs)]
+    failed = [sample['failed'] for sample in samples if 'failed' in sample]
+    if failed:
+        result['failed'] = failed[0]
+        return result
+    result.update(import_ms=statistics.median(s['import_ms'] for s in samples),
+                  modules=samples[0]['modules'], aws_calls=samples[0]['aws_calls'])
+    return result
+
+
+def regressions(results, baseline, tolerance):
+    """Return a line for each entry whose import got slower than the baseline's."""
+    before = {(r['project'], r['function']): r for r in baseline}
+    lines = []
+    for r in results:
+        old = before.get((r['project'], r['function']))
+        if not old or 'failed' in r or 'failed' in old:
+            continue
+        if r['import_ms'] > old['import_ms'] * (1 + tolerance) and r['import_ms'] - old['import_ms'] > 1.0:
+            lines.append(f'{r["project"]} {r["function"]} import_ms {old["import_ms"]:.1f} -> {r["import_ms"]:.1f}')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per entry')
+    parser.add_argument('--only', default='', help='entries whose project/function contains this')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown allowed over the baseline')
+    args = parser.parse_args()
+
+    selected = [entry for entry in entries() if args.only in f'{entry[0]}/{entry[1]}']
+    results = [measure(entry, args.runs) for entry in selected]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'{"project":<18} {"function":<28} {"module":<18} {"import ms":>9} {"modules":>7}  aws calls')
+        for r in results:
+            if 'failed' in r:
+                print(f'{r["project"]:<18} {r["function"]:<28} {r["module"]:<18} failed: {r["failed"]}')
+                continue
+            calls = ', '.join(f'{call}={n}' for call, n in sorted(r['aws_calls'].items()))
+            print(f'{r["project"]:<18} {r["function"]:<28} {r["module"]:<18} {r["import_ms"]:>9.1f} '
+                  f'{r["modules"]:>7}  {calls}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for line in slower:
+            print(f'slower: {line}', file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,26 @@
+import sys
+
 from .pdf import PdfFileReader, PdfFileWriter
-from .merger import PdfFileMerger
-from .pagerange import PageRange, parse_filename_page_ranges
+from .splitter import PageSplitter
 from ._version import __version__
 __all__ = ["pdf", "PdfFileMerger"]
+
+# Merging is rarely used by readers, so on Python 3.7+ (PEP 562) the merger
+# and page range modules are only imported when first asked for.
+_LAZY = {
+    'PdfFileMerger': '.merger',
+    'PageRange': '.pagerange',
+    'parse_filename_page_ranges': '.pagerange',
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _LAZY:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+else:
+    from .merger import PdfFileMerger
+    from .pagerange import PageRange, parse_filename_page_ranges
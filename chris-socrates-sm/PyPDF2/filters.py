@@ -342,6 +342,10 @@ def decodeStreamData(stream):
     # If there is not data to decode we should not try to decode the data.
     if data:
         for filterType in filters:
+            if isinstance(data, memoryview) and filterType not in ("/FlateDecode", "/Fl"):
+                # zlib reads a slice of the buffer the PDF was read from as
+                # it is; the other filters need bytes
+                data = data.tobytes()
             if filterType == "/FlateDecode" or filterType == "/Fl":
                 data = FlateDecode.decode(data, stream.get("/DecodeParms"))
             elif filterType == "/ASCIIHexDecode" or filterType == "/AHx":
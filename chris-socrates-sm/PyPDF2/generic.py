@@ -35,7 +35,7 @@ __author__ = "Mathieu Fenniak"
 __author_email__ = "biziqe@mathieu.fenniak.net"
 
 import re
-from .utils import readNonWhitespace, RC4_encrypt, skipOverComment
+from .utils import readNonWhitespace, RC4_encrypt
 from .utils import b_, u_, chr_, ord_
 from .utils import PdfStreamError
 import warnings
@@ -52,50 +52,8 @@ IndirectPattern = re.compile(b_(r"(\d+)\s+(\d+)\s+R[^a-zA-Z]"))
 
 
 def readObject(stream, pdf):
-    tok = stream.read(1)
-    stream.seek(-1, 1) # reset to start
-    idx = ObjectPrefix.find(tok)
-    if idx == 0:
-        # name object
-        return NameObject.readFromStream(stream, pdf)
-    elif idx == 1:
-        # hexadecimal string OR dictionary
-        peek = stream.read(2)
-        stream.seek(-2, 1) # reset to start
-        if peek == b_('<<'):
-            return DictionaryObject.readFromStream(stream, pdf)
-        else:
-            return readHexStringFromStream(stream)
-    elif idx == 2:
-        # array object
-        return ArrayObject.readFromStream(stream, pdf)
-    elif idx == 3 or idx == 4:
-        # boolean object
-        return BooleanObject.readFromStream(stream)
-    elif idx == 5:
-        # string object
-        return readStringFromStream(stream)
-    elif idx == 6:
-        # null object
-        return NullObject.readFromStream(stream)
-    elif idx == 7:
-        # comment
-        while tok not in (b_('\r'), b_('\n')):
-            tok = stream.read(1)
-        tok = readNonWhitespace(stream)
-        stream.seek(-1, 1)
-        return readObject(stream, pdf)
-    else:
-        # number object OR indirect reference
-        if tok in NumberSigns:
-            # number
-            return NumberObject.readFromStream(stream)
-        peek = stream.read(20)
-        stream.seek(-len(peek), 1) # reset to start
-        if IndirectPattern.match(peek) != None:
-            return IndirectObject.readFromStream(stream, pdf)
-        else:
-            return NumberObject.readFromStream(stream)
+    with Lexer.fromStream(stream, pdf) as lexer:
+        return lexer.readObject()
 
 
 class PdfObject(object):
@@ -147,24 +105,8 @@ class ArrayObject(list, PdfObject):
         stream.write(b_(" ]"))
 
     def readFromStream(stream, pdf):
-        arr = ArrayObject()
-        tmp = stream.read(1)
-        if tmp != b_("["):
-            raise utils.PdfReadError("Could not read array")
-        while True:
-            # skip leading whitespace
-            tok = stream.read(1)
-            while tok.isspace():
-                tok = stream.read(1)
-            stream.seek(-1, 1)
-            # check for array ending
-            peekahead = stream.read(1)
-            if peekahead == b_("]"):
-                break
-            stream.seek(-1, 1)
-            # read and append obj
-            arr.append(readObject(stream, pdf))
-        return arr
+        with Lexer.fromStream(stream, pdf) as lexer:
+            return lexer.readArray()
     readFromStream = staticmethod(readFromStream)
 
 
@@ -551,93 +493,8 @@ class DictionaryObject(dict, PdfObject):
         stream.write(b_(">>"))
 
     def readFromStream(stream, pdf):
-        debug = False
-        tmp = stream.read(2)
-        if tmp != b_("<<"):
-            raise utils.PdfReadError("Dictionary read error at byte %s: stream must begin with '<<'" % utils.hexStr(stream.tell()))
-        data = {}
-        while True:
-            tok = readNonWhitespace(stream)
-            if tok == b_('\x00'):
-                continue
-            elif tok == b_('%'):
-                stream.seek(-1, 1)
-                skipOverComment(stream)
-                continue
-            if not tok:
-                # stream has truncated prematurely
-                raise PdfStreamError("Stream has ended unexpectedly")
-
-            if debug: print(("Tok:", tok))
-            if tok == b_(">"):
-                stream.read(1)
-                break
-            stream.seek(-1, 1)
-            key = readObject(stream, pdf)
-            tok = readNonWhitespace(stream)
-            stream.seek(-1, 1)
-            value = readObject(stream, pdf)
-            if not data.get(key):
-                data[key] = value
-            elif pdf.strict:
-                # multiple definitions of key not permitted
-                raise utils.PdfReadError("Multiple definitions in dictionary at byte %s for key %s" \
-                                           % (utils.hexStr(stream.tell()), key))
-            else:
-                warnings.warn("Multiple definitions in dictionary at byte %s for key %s" \
-                                           % (utils.hexStr(stream.tell()), key), utils.PdfReadWarning)
-
-        pos = stream.tell()
-        s = readNonWhitespace(stream)
-        if s == b_('s') and stream.read(5) == b_('tream'):
-            eol = stream.read(1)
-            # odd PDF file output has spaces after 'stream' keyword but before EOL.
-            # patch provided by Danial Sandler
-            while eol == b_(' '):
-                eol = stream.read(1)
-            assert eol in (b_("\n"), b_("\r"))
-            if eol == b_("\r"):
-                # read \n after
-                if stream.read(1)  != b_('\n'):
-                    stream.seek(-1, 1)
-            # this is a stream object, not a dictionary
-            assert "/Length" in data
-            length = data["/Length"]
-            if debug: print(data)
-            if isinstance(length, IndirectObject):
-                t = stream.tell()
-                length = pdf.getObject(length)
-                stream.seek(t, 0)
-            data["__streamdata__"] = stream.read(length)
-            if debug: print("here")
-            #if debug: print(binascii.hexlify(data["__streamdata__"]))
-            e = readNonWhitespace(stream)
-            ndstream = stream.read(8)
-            if (e + ndstream) != b_("endstream"):
-                # (sigh) - the odd PDF file has a length that is too long, so
-                # we need to read backwards to find the "endstream" ending.
-                # ReportLab (unknown version) generates files with this bug,
-                # and Python users into PDF files tend to be our audience.
-                # we need to do this to correct the streamdata and chop off
-                # an extra character.
-                pos = stream.tell()
-                stream.seek(-10, 1)
-                end = stream.read(9)
-                if end == b_("endstream"):
-                    # we found it by looking back one character further.
-                    data["__streamdata__"] = data["__streamdata__"][:-1]
-                else:
-                    if debug: print(("E", e, ndstream, debugging.toHex(end)))
-                    stream.seek(pos, 0)
-                    raise utils.PdfReadError("Unable to find 'endstream' marker after stream at byte %s." % utils.hexStr(stream.tell()))
-        else:
-            stream.seek(pos, 0)
-        if "__streamdata__" in data:
-            return StreamObject.initializeFromDictionary(data)
-        else:
-            retval = DictionaryObject()
-            retval.update(data)
-            return retval
+        with Lexer.fromStream(stream, pdf) as lexer:
+            return lexer.readDictionary()
     readFromStream = staticmethod(readFromStream)
 
 
@@ -1171,14 +1028,13 @@ def encode_pdfdocencoding(unicode_string):
 
 
 def decode_pdfdocencoding(byte_array):
-    retval = u_('')
-    for b in byte_array:
-        c = _pdfDocEncoding[ord_(b)]
-        if c == u_('\u0000'):
-            raise UnicodeDecodeError("pdfdocencoding", utils.barray(b), -1, -1,
-                    "does not exist in translation table")
-        retval += c
-    return retval
+    # latin-1 maps each byte to the code point of its value, which the
+    # table then maps to its character, for all of the string at once
+    undefined = _pdfDocEncoding_undefined.search(byte_array)
+    if undefined is not None:
+        raise UnicodeDecodeError("pdfdocencoding", utils.barray(undefined.group()), -1, -1,
+                "does not exist in translation table")
+    return byte_array.decode("latin-1").translate(_pdfDocEncoding_table)
 
 _pdfDocEncoding = (
   u_('\u0000'), u_('\u0000'), u_('\u0000'), u_('\u0000'), u_('\u0000'), u_('\u0000'), u_('\u0000'), u_('\u0000'),
@@ -1224,3 +1080,10 @@ for i in range(256):
         continue
     assert char not in _pdfDocEncoding_rev
     _pdfDocEncoding_rev[char] = i
+
+_pdfDocEncoding_table = dict((i, char) for i, char in enumerate(_pdfDocEncoding) if ord(char) != i)
+_pdfDocEncoding_undefined = re.compile(b_("[%s]" % "".join(
+    "\\x%02x" % i for i, char in enumerate(_pdfDocEncoding) if char == u_("\u0000"))))
+
+
+from .lexer import Lexer  # noqa: E402 -- lexer builds on the classes above
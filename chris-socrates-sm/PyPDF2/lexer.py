@@ -0,0 +1,457 @@
+"""
+Read PDF objects from a buffer with a position cursor.
+
+The readers of :mod:`generic<PyPDF2.generic>` read their stream a byte at a
+time, seeking back after every peek, so a dictionary costs several Python
+calls per byte.  :class:`Lexer` scans a bytes buffer instead: one
+precompiled regular expression skips the whitespace and comments before a
+token and tells which token it is, arrays and dictionaries are read with a
+stack rather than a call per element, and strings and stream data are found
+by searching and slicing.
+
+A ``BytesIO`` is lexed in place, on the bytes its ``getvalue()`` shares with
+it, and so is a :class:`BufferStream<utils.BufferStream>`, on a memoryview
+of its buffer, which makes the data of streams memoryview slices of the
+buffer rather than copies.  Other seekable streams are read into a window
+that grows as tokens need it.  Either way the stream is left just after
+what was read, as the byte-at-a-time readers left it.
+
+This software is available under a BSD license;
+see https://github.com/mstamy2/PyPDF2/blob/master/LICENSE
+"""
+
+import binascii
+import re
+import warnings
+
+from . import utils
+from .generic import (ArrayObject, BooleanObject, DictionaryObject, FloatObject, IndirectObject,
+                      NameObject, NullObject, NumberObject, StreamObject, createStringObject)
+from .utils import PdfReadError, PdfStreamError, b_
+
+_WS = br'\x00\t\n\x0c\r '
+_REGULAR = br'[^\x00\t\n\x0b\x0c\r ()<>\[\]{}/%]'
+
+# Whitespace and comments, then a token, which the number of its last group tells
+_TOKEN = re.compile(
+    br'[' + _WS + br']*(?:%[^\r\n]*(?![^\r\n])[' + _WS + br']*)*(?:'
+    br'(/' + _REGULAR + br'*)'                  # 1 name
+    br'|(\d+)\s+(\d+)\s+R(?![a-zA-Z])'          # 3 indirect reference
+    br'|([+,\-.0-9]+)'                          # 4 number
+    br'|(<<)|(>>)|(\[)|(\])|(\()|(<)'           # 5-10 delimiters
+    br'|(true|false)(?!' + _REGULAR + br')'     # 11 boolean
+    br'|(null)(?!' + _REGULAR + br')'           # 12 null
+    br'|(' + _REGULAR + br'+))')                # 13 operator, in content streams
+(_NAME, _REF, _NUMBER, _DICT, _END_DICT, _ARRAY, _END_ARRAY, _STRING, _HEX,
+ _BOOLEAN, _NULL, _OPERATOR) = (1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13)
+
+_SPACE = re.compile(br'[' + _WS + br']*')
+# Whitespace, then comments each running to its EOL: written (?:[ws]+|%...)*, a
+# run of whitespace or of %s no token follows backtracks exponentially
+_SPACE_COMMENTS = re.compile(br'[' + _WS + br']*(?:%[^\r\n]*(?![^\r\n])[' + _WS + br']*)*')
+# The keyword after a stream's dictionary; odd PDF file output has spaces
+# after it but before the EOL (patch provided by Danial Sandler)
+_STREAM = re.compile(br'[' + _WS + br']*stream *(\r\n|\r|\n)?')
+_STRING_SPECIAL = re.compile(br'[()\\]')
+_HEX_END = re.compile(br'>')
+_IMAGE_END = re.compile(br'EI')
+_OCTAL = re.compile(br'[0-9]{1,3}')
+_HEX_SPACE = re.compile(br'[' + _WS + br']')
+# A cross-reference table entry as the spec has it, 20 bytes with a 2-byte EOL
+_XREF_ROW = re.compile(br'(\d{10}) (\d{5}) [fn](?: \r| \n|\r\n)')
+# An entry as some files have it: after a 1-byte EOL, or a 3-byte one that
+# leaves the next entry starting with an EOL
+_XREF_ENTRY = re.compile(br'[\r\n]*(\d+) (\d+) [fn][ \r\n]{0,2}')
+
+_ESCAPES = dict((ord(k), v) for k, v in [
+    ('n', b'\n'), ('r', b'\r'), ('t', b'\t'), ('b', b'\b'), ('f', b'\f'), ('c', b'\\c'),
+    ('(', b'('), (')', b')'), ('\\', b'\\'),
+    # odd/unnecessary escape sequences we have encountered
+    (' ', b' '), ('/', b'/'), ('%', b'%'), ('<', b'<'), ('>', b'>'), ('[', b'['), (']', b']'),
+    ('#', b'#'), ('_', b'_'), ('&', b'&'), ('$', b'$')])
+
+# Decoded NameObjects by their bytes; names repeat in every object, so they are shared
+_names = {}
+_NAMES_MAX = 4096
+
+
+class _Dictionary(object):
+    # a dictionary being read: its entries so far and the key awaiting a value
+    __slots__ = ("data", "key")
+
+    def __init__(self):
+        self.data = {}
+        self.key = None
+
+
+class Lexer(object):
+    """
+    Reads PDF objects from ``data``, starting at ``pos``.
+
+    :param data: what to read: ``bytes``, or a ``memoryview``, whose
+        slices the data of streams then are.
+    :param int pos: where to start.
+    :param pdf: the :class:`PdfFileReader<pdf.PdfFileReader>` that indirect
+        references and stream lengths resolve against, or ``None``.
+    :param stream: a seekable stream ``data`` was read from at offset
+        ``base``, to read more from as tokens need it, or ``None`` if
+        ``data`` is all there is.
+    """
+
+    #: The fewest bytes read ahead of the cursor from a stream.
+    window = 1024
+    #: How far past its end a token must be buffered to be sure where it
+    #: ends, such as the ``R`` after ``12 0``.
+    lookahead = 64
+
+    def __init__(self, data, pos=0, pdf=None, stream=None, base=0):
+        self.data = data
+        self.pos = pos
+        self.pdf = pdf
+        self.stream = stream
+        self.base = base
+        self.eof = stream is None
+        self._source = stream
+
+    @classmethod
+    def fromStream(cls, stream, pdf=None):
+        """
+        Returns a lexer at the current position of ``stream``.  Use it as a
+        context manager, which leaves the stream just after what was read.
+        """
+        pos = stream.tell()
+        getvalue = getattr(stream, "getvalue", None)
+        if getvalue is not None:
+            lexer = cls(getvalue(), pos, pdf)
+        else:
+            lexer = cls(b_(""), 0, pdf, stream=stream, base=pos)
+        lexer._source = stream
+        return lexer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._source is not None:
+            self._source.seek(self.base + self.pos, 0)
+
+    def tell(self):
+        """Returns the cursor's offset in the stream."""
+        return self.base + self.pos
+
+    def _fill(self, end):
+        # read from the stream until the buffer holds end bytes, or the stream ends
+        while len(self.data) < end and not self.eof:
+            self.stream.seek(self.base + len(self.data), 0)
+            chunk = self.stream.read(max(end - len(self.data), len(self.data), self.window))
+            if chunk:
+                self.data += chunk
+            else:
+                self.eof = True
+
+    def _match(self, regex, pos):
+        # match at pos, reading more while the match could go on past the buffer
+        if not self.eof:
+            self._fill(pos + self.window)
+        m = regex.match(self.data, pos)
+        while m is not None and m.end() + self.lookahead > len(self.data) and not self.eof:
+            self._fill(2 * len(self.data))
+            m = regex.match(self.data, pos)
+        return m
+
+    def _search(self, regex, pos):
+        m = regex.search(self.data, pos)
+        while m is None and not self.eof:
+            self._fill(max(2 * len(self.data), pos + self.window))
+            m = regex.search(self.data, pos)
+        return m
+
+    def skip(self, comments=True):
+        """Moves the cursor past whitespace, and past comments unless ``comments`` is false."""
+        self.pos = self._match(_SPACE_COMMENTS if comments else _SPACE, self.pos).end()
+
+    def peek(self):
+        """Returns the byte at the cursor as an int, or ``None`` at the end."""
+        if self.pos >= len(self.data):
+            self._fill(self.pos + 1)
+            if self.pos >= len(self.data):
+                return None
+        return self.data[self.pos]
+
+    def take(self, size):
+        """Returns the next ``size`` bytes, or fewer at the end, and moves past them."""
+        self._fill(self.pos + size)
+        data = self.data[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def readObject(self):
+        """Reads the object at the cursor, after any whitespace and comments."""
+        return self._read(None)
+
+    def readArray(self):
+        """Reads an array, ``[...]``."""
+        if self.peek() != 0x5B:
+            raise PdfReadError("Could not read array")
+        return self._read(None)
+
+    def readDictionary(self):
+        """
+        Reads a dictionary, ``<<...>>``, or a stream: the dictionary followed
+        by its data between ``stream`` and ``endstream``.
+        """
+        self._fill(self.pos + 2)
+        if self.data[self.pos:self.pos + 2] != b'<<':
+            raise PdfReadError("Dictionary read error at byte %s: stream must begin with '<<'" %
+                               utils.hexStr(self.tell()))
+        return self._read(None)
+
+    def readOperation(self):
+        """
+        Reads a content stream operation: its operands and its operator,
+        such as ``Tj`` or ``BI``.  Returns ``(operands, operator)``, with
+        ``None`` for the operator at the end of the data.
+        """
+        operands = []
+        return operands, self._read(operands)
+
+    def _read(self, operands):
+        # Reads one object or, given a list of operands, objects into it up
+        # to the operator after them, which is returned.
+        pdf = self.pdf
+        containers = []
+        while True:
+            m = _TOKEN.match(self.data, self.pos)
+            if not self.eof and (m is None or m.end() + self.lookahead > len(self.data)):
+                self.skip()
+                m = self._match(_TOKEN, self.pos)
+            if m is None:
+                self._unexpected(operands is not None and not containers)
+                return None
+            kind = m.lastindex
+            self.pos = m.end()
+            if kind == _NAME:
+                obj = _names.get(m.group(1))
+                if obj is None:
+                    obj = self._name(m.group(1))
+            elif kind == _NUMBER:
+                num = m.group(4)
+                obj = FloatObject(num) if b'.' in num else NumberObject(num)
+            elif kind == _REF:
+                obj = IndirectObject(int(m.group(2)), int(m.group(3)), pdf)
+            elif kind == _DICT:
+                containers.append(_Dictionary())
+                continue
+            elif kind == _ARRAY:
+                containers.append(ArrayObject())
+                continue
+            elif kind == _END_DICT:
+                top = containers.pop() if containers else None
+                if top.__class__ is not _Dictionary or top.key is not None:
+                    raise PdfReadError("Unexpected '>>' at byte %s" % utils.hexStr(self.tell() - 2))
+                obj = self._endDictionary(top.data)
+            elif kind == _END_ARRAY:
+                top = containers.pop() if containers else None
+                if top.__class__ is not ArrayObject:
+                    raise PdfReadError("Unexpected ']' at byte %s" % utils.hexStr(self.tell() - 1))
+                obj = top
+            elif kind == _STRING:
+                obj = self._string()
+            elif kind == _HEX:
+                obj = self._hexString()
+            elif kind == _BOOLEAN:
+                obj = BooleanObject(m.end(_BOOLEAN) - m.start(_BOOLEAN) == 4)
+            elif kind == _NULL:
+                obj = NullObject()
+            elif operands is not None and not containers:
+                return m.group(_OPERATOR)
+            else:
+                self.pos = m.start(_OPERATOR)
+                raise PdfReadError("Unexpected %r at byte %s" % (m.group(_OPERATOR)[:20],
+                                                                 utils.hexStr(self.tell())))
+
+            if not containers:
+                if operands is None:
+                    return obj
+                operands.append(obj)
+                continue
+            top = containers[-1]
+            if top.__class__ is ArrayObject:
+                top.append(obj)
+            elif top.key is None:
+                top.key = obj
+            else:
+                if not top.data.get(top.key):
+                    top.data[top.key] = obj
+                elif pdf is not None and pdf.strict:
+                    # multiple definitions of key not permitted
+                    raise PdfReadError("Multiple definitions in dictionary at byte %s for key %s" %
+                                       (utils.hexStr(self.tell()), top.key))
+                else:
+                    warnings.warn("Multiple definitions in dictionary at byte %s for key %s" %
+                                  (utils.hexStr(self.tell()), top.key), utils.PdfReadWarning)
+                top.key = None
+
+    def _unexpected(self, endOk):
+        # no token at the cursor: the end of the data, which is fine if
+        # endOk, or a byte no object starts with
+        self.skip()
+        if self.pos >= len(self.data):
+            if endOk:
+                return
+            # stream has truncated prematurely
+            raise PdfStreamError("Stream has ended unexpectedly")
+        raise PdfReadError("Unexpected %r at byte %s" % (self.data[self.pos:self.pos + 1],
+                                                         utils.hexStr(self.tell())))
+
+    def _name(self, name):
+        try:
+            obj = NameObject(name.decode('utf-8'))
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            # Name objects should represent irregular characters
+            # with a '#' followed by the symbol's hex number
+            if self.pdf is not None and self.pdf.strict:
+                raise PdfReadError("Illegal character in Name Object")
+            warnings.warn("Illegal character in Name Object", utils.PdfReadWarning)
+            return NameObject(name)
+        if len(_names) < _NAMES_MAX:
+            _names[name] = obj
+        return obj
+
+    def _string(self):
+        # a literal string, after its '(': its escapes and balanced parentheses
+        pos = self.pos
+        parens = 1
+        parts = []
+        while True:
+            m = self._search(_STRING_SPECIAL, pos)
+            if m is None:
+                # stream has truncated prematurely
+                raise PdfStreamError("Stream has ended unexpectedly")
+            i = m.start()
+            data = self.data
+            c = data[i]
+            if c == 0x5C:  # backslash
+                parts.append(data[pos:i])
+                self._fill(i + 4)
+                data = self.data
+                if i + 1 >= len(data):
+                    raise PdfStreamError("Stream has ended unexpectedly")
+                e = data[i + 1]
+                pos = i + 2
+                if e in _ESCAPES:
+                    parts.append(_ESCAPES[e])
+                elif 0x30 <= e <= 0x39:
+                    # "The number ddd may consist of one, two, or three
+                    # octal digits; high-order overflow shall be ignored."
+                    # (PDF reference 7.3.4.2, p 16)
+                    digits = _OCTAL.match(data, i + 1)
+                    parts.append(b_(chr(int(digits.group(), 8) & 0xFF)))
+                    pos = digits.end()
+                elif e in (0x0A, 0x0D):
+                    # an escaped line break, which adds nothing; consume the
+                    # second character of a two character EOL
+                    if data[pos:pos + 1] in (b'\n', b'\r'):
+                        pos += 1
+                else:
+                    raise PdfReadError(r"Unexpected escaped string: %s" % data[i + 1:i + 2])
+                continue
+            if c == 0x28:  # (
+                parens += 1
+            else:
+                parens -= 1
+                if parens == 0:
+                    parts.append(data[pos:i])
+                    self.pos = i + 1
+                    return createStringObject(b''.join(parts))
+            parts.append(data[pos:i + 1])
+            pos = i + 1
+
+    def _hexString(self):
+        # a hexadecimal string, after its '<'
+        m = self._search(_HEX_END, self.pos)
+        if m is None:
+            # stream has truncated prematurely
+            raise PdfStreamError("Stream has ended unexpectedly")
+        end = m.start()
+        digits = _HEX_SPACE.sub(b'', self.data[self.pos:end])
+        self.pos = end + 1
+        if len(digits) % 2:
+            digits += b'0'
+        return createStringObject(binascii.unhexlify(digits))
+
+    def _endDictionary(self, data):
+        # the dictionary just read, or the stream whose data follows it
+        m = self._match(_STREAM, self.pos)
+        if m is None:
+            retval = DictionaryObject()
+            retval.update(data)
+            return retval
+        assert m.group(1) is not None
+        start = m.end()
+        # this is a stream object, not a dictionary
+        assert "/Length" in data
+        length = data["/Length"]
+        if isinstance(length, IndirectObject):
+            length = self.pdf.getObject(length)
+        self._fill(start + length)
+        data["__streamdata__"] = self.data[start:start + length]
+        self.pos = start + length
+        self.skip(comments=False)
+        self._fill(self.pos + 9)
+        if self.data[self.pos:self.pos + 9] == b'endstream':
+            self.pos += 9
+        elif self.data[self.pos - 1:self.pos + 8] == b'endstream':
+            # (sigh) - the odd PDF file has a length that is too long, so
+            # the data took the 'e' of 'endstream'; ReportLab (unknown
+            # version) generates files with this bug.
+            data["__streamdata__"] = data["__streamdata__"][:-1]
+            self.pos += 8
+        else:
+            raise PdfReadError("Unable to find 'endstream' marker after stream at byte %s." %
+                               utils.hexStr(self.tell()))
+        return StreamObject.initializeFromDictionary(data)
+
+    def readXrefEntries(self, size):
+        """
+        Reads ``size`` entries of a cross-reference table subsection, after
+        any whitespace, and returns them as ``(offset, generation)`` pairs.
+        A subsection of entries of the spec's fixed 20 bytes is parsed by a
+        single pass of a regular expression; otherwise the entries are read
+        one by one, allowing for CRLF and 1-byte EOLs.
+        """
+        self.skip(comments=False)
+        end = self.pos + 20 * size
+        self._fill(end + 1)
+        rows = _XREF_ROW.findall(self.data, self.pos, end)
+        if len(rows) == size:
+            # size matches of 20 bytes in 20 * size bytes follow one another
+            self.pos = end
+            return [(int(offset), int(generation)) for offset, generation in rows]
+        entries = []
+        for _ in range(size):
+            m = self._match(_XREF_ENTRY, self.pos)
+            if m is None:
+                raise PdfReadError("xref table read error at byte %s" % utils.hexStr(self.tell()))
+            entries.append((int(m.group(1)), int(m.group(2))))
+            self.pos = m.end()
+        return entries
+
+    def readInlineImageData(self):
+        """
+        Reads an inline image's data, from after ``ID`` to the ``EI`` that
+        whitespace and then ``Q`` follow, since the data can contain ``EI``.
+        The cursor is left at the ``Q``.
+        """
+        start = i = self.pos
+        while True:
+            m = self._search(_IMAGE_END, i)
+            if m is None:
+                raise PdfStreamError("Stream has ended unexpectedly")
+            i = m.start()
+            end = self._match(_SPACE, i + 2).end()
+            self._fill(end + 1)
+            if end > i + 2 and self.data[end:end + 1] == b'Q':
+                self.pos = end
+                return self.data[start:i]
+            i = end
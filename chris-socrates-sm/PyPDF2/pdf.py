@@ -44,6 +44,7 @@ __maintainer_email = "PyPDF2@phaseit.net"
 
 import string
 import math
+import mmap
 import struct
 import sys
 import uuid
@@ -63,8 +64,9 @@ from . import utils
 import warnings
 import codecs
 from .generic import *
+from .lexer import Lexer
 from .utils import readNonWhitespace, readUntilWhitespace, ConvertFunctionsToVirtualList
-from .utils import isString, b_, u_, ord_, chr_, str_, formatWarning
+from .utils import isString, isInt, b_, u_, ord_, chr_, str_, formatWarning
 
 if version_info < ( 2, 4 ):
    from sets import ImmutableSet as frozenset
@@ -1048,7 +1050,10 @@ class PdfFileReader(object):
 
     :param stream: A File object or an object that supports the standard read
         and seek methods similar to a File object. Could also be a
-        string representing a path to a PDF file.
+        string representing a path to a PDF file, or the PDF itself as
+        ``bytes``, a ``bytearray``, a ``memoryview`` or an ``mmap``, which
+        is read in place rather than copied: the data of its streams are
+        memoryview slices of it.
     :param bool strict: Determines whether user should be warned of all
         problems and also causes some correctable problems to be fatal.
         Defaults to ``True``.
@@ -1057,8 +1062,21 @@ class PdfFileReader(object):
     :param bool overwriteWarnings: Determines whether to override Python's
         ``warnings.py`` module with a custom implementation (defaults to
         ``True``).
+    :param bool useMmap: Map a path, or a file object with a file
+        descriptor, into memory instead of reading it, so only the pages
+        of it that are read take memory. A file descriptor, an int, is
+        always mapped. Defaults to ``False``.
+    :param bool preloadObjectStreams: Read all the objects of an object
+        stream into the cache the first time any of them is used, in one
+        pass, rather than each as it is used. Defaults to ``False``.
+
+    An object stream's table of the offsets of its objects is parsed once;
+    ``objStmParsedCount`` counts the tables parsed, ``objStmReusedCount``
+    the objects read without parsing their stream's table again, and
+    ``objStmPreloadedCount`` the objects preloaded.
     """
-    def __init__(self, stream, strict=True, warndest = None, overwriteWarnings = True):
+    def __init__(self, stream, strict=True, warndest = None, overwriteWarnings = True, useMmap = False,
+                 preloadObjectStreams = False):
         if overwriteWarnings:
             # have to dynamically override the default showwarning since there are no
             # public methods that specify the 'file' parameter
@@ -1073,14 +1091,24 @@ class PdfFileReader(object):
         self.strict = strict
         self.flattenedPages = None
         self.resolvedObjects = {}
+        self.preloadObjectStreams = preloadObjectStreams
+        self._objStmIndex = {}      # stmnum -> (data, /First, /N, {objnum: (index, offset)})
+        self._objStmPreloaded = set()
+        self.objStmParsedCount = 0
+        self.objStmReusedCount = 0
+        self.objStmPreloadedCount = 0
         self.xrefIndex = 0
         self._pageId2Num = None # map page IndirectRef number to Page Number
         if hasattr(stream, 'mode') and 'b' not in stream.mode:
             warnings.warn("PdfFileReader stream/file object is not in binary mode. It may not be read correctly.", utils.PdfReadWarning)
-        if isString(stream):
+        if isInt(stream) or (useMmap and (isString(stream) or hasattr(stream, 'fileno'))):
+            stream = utils.BufferStream(utils.mapFile(stream))
+        elif isString(stream):
             fileobj = open(stream, 'rb')
             stream = BytesIO(b_(fileobj.read()))
             fileobj.close()
+        elif isinstance(stream, (bytes, bytearray, memoryview, mmap.mmap)):
+            stream = utils.BufferStream(stream)
         self.read(stream)
         self.stream = stream
 
@@ -1528,58 +1556,74 @@ class PdfFileReader(object):
             pageObj.update(pages)
             self.flattenedPages.append(pageObj)
 
+    def _getObjectStreamIndex(self, stmnum):
+        # the decoded data of object stream stmnum, the offset of its first
+        # object, /N and its {objnum: (index, offset)} table, parsed once
+        index = self._objStmIndex.get(stmnum)
+        if index is not None:
+            self.objStmReusedCount += 1
+            return index
+        objStm = IndirectObject(stmnum, 0, self).getObject()
+        # This is an xref to a stream, so its type better be a stream
+        assert objStm['/Type'] == '/ObjStm'
+        data = objStm.getData()
+        lexer = Lexer(data, 0, self)
+        offsets = {}
+        # /N is the number of indirect objects in the stream
+        for i in range(objStm['/N']):
+            objnum = lexer.readObject()
+            offset = lexer.readObject()
+            if objnum not in offsets:
+                offsets[objnum] = (i, offset)
+        index = self._objStmIndex[stmnum] = (data, objStm['/First'], objStm['/N'], offsets)
+        self.objStmParsedCount += 1
+        return index
+
     def _getObjectFromStream(self, indirectReference):
         # indirect reference to object in object stream
         # read the entire object stream into memory
         debug = False
         stmnum, idx = self.xref_objStm[indirectReference.idnum]
         if debug: print(("Here1: %s %s"%(stmnum, idx)))
-        objStm = IndirectObject(stmnum, 0, self).getObject()
-        if debug: print(("Here2: objStm=%s.. stmnum=%s data=%s"%(objStm, stmnum, objStm.getData())))
-        # This is an xref to a stream, so its type better be a stream
-        assert objStm['/Type'] == '/ObjStm'
-        # /N is the number of indirect objects in the stream
-        assert idx < objStm['/N']
-        streamData = BytesIO(b_(objStm.getData()))
-        for i in range(objStm['/N']):
-            readNonWhitespace(streamData)
-            streamData.seek(-1, 1)
-            objnum = NumberObject.readFromStream(streamData)
-            readNonWhitespace(streamData)
-            streamData.seek(-1, 1)
-            offset = NumberObject.readFromStream(streamData)
-            readNonWhitespace(streamData)
-            streamData.seek(-1, 1)
-            if objnum != indirectReference.idnum:
-                # We're only interested in one object
+        data, first, n, offsets = self._getObjectStreamIndex(stmnum)
+        assert idx < n
+        if self.preloadObjectStreams and stmnum not in self._objStmPreloaded:
+            self._preloadObjectStream(stmnum, indirectReference.idnum)
+        if indirectReference.idnum not in offsets:
+            if self.strict: raise utils.PdfReadError("This is a fatal error in strict mode.")
+            return NullObject()
+        i, offset = offsets[indirectReference.idnum]
+        if self.strict and idx != i:
+            raise utils.PdfReadError("Object is in wrong index.")
+        try:
+            return Lexer(data, first + offset, self).readObject()
+        except utils.PdfStreamError as e:
+            # Stream object cannot be read. Normally, a critical error, but
+            # Adobe Reader doesn't complain, so continue (in strict mode?)
+            warnings.warn("Invalid stream (index %d) within object %d %d: %s" % \
+                  (i, indirectReference.idnum, indirectReference.generation, e), utils.PdfReadWarning)
+
+            if self.strict:
+                raise utils.PdfReadError("Can't read object stream: %s"%e)
+            # Replace with null. Hopefully it's nothing important.
+            return NullObject()
+
+    def _preloadObjectStream(self, stmnum, idnum):
+        # read every object of object stream stmnum but idnum, which the
+        # caller reads, into the cache, unless the xref has it elsewhere
+        data, first, n, offsets = self._objStmIndex[stmnum]
+        self._objStmPreloaded.add(stmnum)
+        for objnum, (i, offset) in offsets.items():
+            if objnum == idnum or (0, objnum) in self.resolvedObjects or \
+                    self.xref_objStm.get(objnum) != (stmnum, i):
                 continue
-            if self.strict and idx != i:
-                raise utils.PdfReadError("Object is in wrong index.")
-            streamData.seek(objStm['/First']+offset, 0)
-            if debug:
-                pos = streamData.tell()
-                streamData.seek(0, 0)
-                lines = streamData.readlines()
-                for i in range(0, len(lines)):
-                    print((lines[i]))
-                streamData.seek(pos, 0)
             try:
-                obj = readObject(streamData, self)
-            except utils.PdfStreamError as e:
-                # Stream object cannot be read. Normally, a critical error, but
-                # Adobe Reader doesn't complain, so continue (in strict mode?)
-                e = sys.exc_info()[1]
-                warnings.warn("Invalid stream (index %d) within object %d %d: %s" % \
-                      (i, indirectReference.idnum, indirectReference.generation, e), utils.PdfReadWarning)
-
-                if self.strict:
-                    raise utils.PdfReadError("Can't read object stream: %s"%e)
-                # Replace with null. Hopefully it's nothing important.
-                obj = NullObject()
-            return obj
-
-        if self.strict: raise utils.PdfReadError("This is a fatal error in strict mode.")
-        return NullObject()
+                obj = Lexer(data, first + offset, self).readObject()
+            except utils.PdfReadError:
+                # left for getObject to read, and warn about, if it's used
+                continue
+            self.resolvedObjects[(0, objnum)] = obj
+            self.objStmPreloadedCount += 1
 
     def getObject(self, indirectReference):
         debug = False
@@ -1740,44 +1784,18 @@ class PdfFileReader(object):
                     readNonWhitespace(stream)
                     stream.seek(-1, 1)
                     size = readObject(stream, self)
-                    readNonWhitespace(stream)
-                    stream.seek(-1, 1)
-                    cnt = 0
-                    while cnt < size:
-                        line = stream.read(20)
-
-                        # It's very clear in section 3.4.3 of the PDF spec
-                        # that all cross-reference table lines are a fixed
-                        # 20 bytes (as of PDF 1.7). However, some files have
-                        # 21-byte entries (or more) due to the use of \r\n
-                        # (CRLF) EOL's. Detect that case, and adjust the line
-                        # until it does not begin with a \r (CR) or \n (LF).
-                        while line[0] in b_("\x0D\x0A"):
-                            stream.seek(-20 + 1, 1)
-                            line = stream.read(20)
-
-                        # On the other hand, some malformed PDF files
-                        # use a single character EOL without a preceeding
-                        # space.  Detect that case, and seek the stream
-                        # back one character.  (0-9 means we've bled into
-                        # the next xref entry, t means we've bled into the
-                        # text "trailer"):
-                        if line[-1] in b_("0123456789t"):
-                            stream.seek(-1, 1)
-
-                        offset, generation = line[:16].split(b_(" "))
-                        offset, generation = int(offset), int(generation)
-                        if generation not in self.xref:
-                            self.xref[generation] = {}
-                        if num in self.xref[generation]:
-                            # It really seems like we should allow the last
-                            # xref table in the file to override previous
-                            # ones. Since we read the file backwards, assume
-                            # any existing key is already set correctly.
-                            pass
-                        else:
-                            self.xref[generation][num] = offset
-                        cnt += 1
+                    with Lexer.fromStream(stream, self) as lexer:
+                        entries = lexer.readXrefEntries(size)
+                    for offset, generation in entries:
+                        xref = self.xref.get(generation)
+                        if xref is None:
+                            xref = self.xref[generation] = {}
+                        # It really seems like we should allow the last
+                        # xref table in the file to override previous
+                        # ones. Since we read the file backwards, assume
+                        # any existing key is already set correctly.
+                        if num not in xref:
+                            xref[num] = offset
                         num += 1
                     readNonWhitespace(stream)
                     stream.seek(-1, 1)
@@ -1804,7 +1822,6 @@ class PdfFileReader(object):
                 xrefstream = readObject(stream, self)
                 assert xrefstream["/Type"] == "/XRef"
                 self.cacheIndirectObject(generation, idnum, xrefstream)
-                streamData = BytesIO(b_(xrefstream.getData()))
                 # Index pairs specify the subsections in the dictionary. If
                 # none create one subsection that spans everything.
                 idx_pairs = xrefstream.get("/Index", [0, xrefstream.get("/Size")])
@@ -1813,60 +1830,42 @@ class PdfFileReader(object):
                 assert len(entrySizes) >= 3
                 if self.strict and len(entrySizes) > 3:
                     raise utils.PdfReadError("Too many entry sizes: %s" %entrySizes)
-
-                def getEntry(i):
-                    # Reads the correct number of bytes for each entry. See the
-                    # discussion of the W parameter in PDF spec table 17.
-                    if entrySizes[i] > 0:
-                        d = streamData.read(entrySizes[i])
-                        return convertToInt(d, entrySizes[i])
-
-                    # PDF Spec Table 17: A value of zero for an element in the
-                    # W array indicates...the default value shall be used
-                    if i == 0:  return 1 # First value defaults to 1
-                    else:       return 0
-
-                def used_before(num, generation):
-                    # We move backwards through the xrefs, don't replace any.
-                    return num in self.xref.get(generation, []) or \
-                            num in self.xref_objStm
+                types, fields1, fields2 = decodeXrefStream(xrefstream.getData(), entrySizes)
 
                 # Iterate through each subsection
                 last_end = 0
+                i = 0
+                xref_objStm = self.xref_objStm
                 for start, size in self._pairs(idx_pairs):
                     # The subsections must increase
                     assert start >= last_end
                     last_end = start + size
-                    for num in range(start, start+size):
-                        # The first entry is the type
-                        xref_type = getEntry(0)
-                        # The rest of the elements depend on the xref_type
-                        if xref_type == 0:
-                            # linked list of free objects
-                            next_free_object = getEntry(1)
-                            next_generation = getEntry(2)
-                        elif xref_type == 1:
-                            # objects that are in use but are not compressed
-                            byte_offset = getEntry(1)
-                            generation = getEntry(2)
-                            if generation not in self.xref:
-                                self.xref[generation] = {}
-                            if not used_before(num, generation):
-                                self.xref[generation][num] = byte_offset
+                    for num, xref_type, field1, field2 in zip(range(start, start+size), types[i:i+size],
+                                                              fields1[i:i+size], fields2[i:i+size]):
+                        # The rest of the elements depend on the xref_type;
+                        # we move backwards through the xrefs, don't replace any.
+                        if xref_type == 1:
+                            # objects that are in use but are not compressed:
+                            # byte offset and generation
+                            xref = self.xref.get(field2)
+                            if xref is None:
+                                xref = self.xref[field2] = {}
+                            if num not in xref and num not in xref_objStm:
+                                xref[num] = field1
                                 if debug: print(("XREF Uncompressed: %s %s"%(
-                                                num, generation)))
+                                                num, field2)))
                         elif xref_type == 2:
-                            # compressed objects
-                            objstr_num = getEntry(1)
-                            obstr_idx = getEntry(2)
-                            generation = 0 # PDF spec table 18, generation is 0
-                            if not used_before(num, generation):
+                            # compressed objects: object stream number and index;
+                            # PDF spec table 18, generation is 0
+                            if num not in self.xref.get(0, ()) and num not in xref_objStm:
                                 if debug: print(("XREF Compressed: %s %s %s"%(
-                                        num, objstr_num, obstr_idx)))
-                                self.xref_objStm[num] = (objstr_num, obstr_idx)
-                        elif self.strict:
+                                        num, field1, field2)))
+                                xref_objStm[num] = (field1, field2)
+                        elif xref_type != 0 and self.strict:
+                            # 0 is the linked list of free objects
                             raise utils.PdfReadError("Unknown xref type: %s"%
                                                         xref_type)
+                    i += size
 
                 trailerKeys = "/Root", "/Encrypt", "/Info", "/ID"
                 for key in trailerKeys:
@@ -2665,92 +2664,37 @@ class ContentStream(DecodedStreamObject):
         # multiple StreamObjects to be cat'd together.
         stream = stream.getObject()
         if isinstance(stream, ArrayObject):
-            data = b_("")
-            for s in stream:
-                data += s.getObject().getData()
-            stream = BytesIO(b_(data))
+            data = b_("").join(s.getObject().getData() for s in stream)
         else:
-            stream = BytesIO(b_(stream.getData()))
-        self.__parseContentStream(stream)
+            data = stream.getData()
+        if not isinstance(data, memoryview):
+            data = b_(data)
+        self.__parseContentStream(data)
 
-    def __parseContentStream(self, stream):
-        # file("f:\\tmp.txt", "w").write(stream.read())
-        stream.seek(0, 0)
-        operands = []
+    def __parseContentStream(self, data):
+        lexer = Lexer(data)
         while True:
-            peek = readNonWhitespace(stream)
-            if peek == b_('') or ord_(peek) == 0:
+            operands, operator = lexer.readOperation()
+            if operator is None:
                 break
-            stream.seek(-1, 1)
-            if peek.isalpha() or peek == b_("'") or peek == b_('"'):
-                operator = utils.readUntilRegex(stream,
-                        NameObject.delimiterPattern, True)
-                if operator == b_("BI"):
-                    # begin inline image - a completely different parsing
-                    # mechanism is required, of course... thanks buddy...
-                    assert operands == []
-                    ii = self._readInlineImage(stream)
-                    self.operations.append((ii, b_("INLINE IMAGE")))
-                else:
-                    self.operations.append((operands, operator))
-                    operands = []
-            elif peek == b_('%'):
-                # If we encounter a comment in the content stream, we have to
-                # handle it here.  Typically, readObject will handle
-                # encountering a comment -- but readObject assumes that
-                # following the comment must be the object we're trying to
-                # read.  In this case, it could be an operator instead.
-                while peek not in (b_('\r'), b_('\n')):
-                    peek = stream.read(1)
+            if operator == b_("BI"):
+                # begin inline image - a completely different parsing
+                # mechanism is required, of course... thanks buddy...
+                assert operands == []
+                ii = self._readInlineImage(lexer)
+                self.operations.append((ii, b_("INLINE IMAGE")))
             else:
-                operands.append(readObject(stream, None))
+                self.operations.append((operands, operator))
 
-    def _readInlineImage(self, stream):
+    def _readInlineImage(self, lexer):
         # begin reading just after the "BI" - begin image
-        # first read the dictionary of settings.
-        settings = DictionaryObject()
-        while True:
-            tok = readNonWhitespace(stream)
-            stream.seek(-1, 1)
-            if tok == b_("I"):
-                # "ID" - begin of image data
-                break
-            key = readObject(stream, self.pdf)
-            tok = readNonWhitespace(stream)
-            stream.seek(-1, 1)
-            value = readObject(stream, self.pdf)
-            settings[key] = value
-        # left at beginning of ID
-        tmp = stream.read(3)
-        assert tmp[:2] == b_("ID")
-        data = b_("")
-        while True:
-            # Read the inline image, while checking for EI (End Image) operator.
-            tok = stream.read(1)
-            if tok == b_("E"):
-                # Check for End Image
-                tok2 = stream.read(1)
-                if tok2 == b_("I"):
-                    # Data can contain EI, so check for the Q operator.
-                    tok3 = stream.read(1)
-                    info = tok + tok2
-                    # We need to find whitespace between EI and Q.
-                    has_q_whitespace = False
-                    while tok3 in utils.WHITESPACES:
-                        has_q_whitespace = True
-                        info += tok3
-                        tok3 = stream.read(1)
-                    if tok3 == b_("Q") and has_q_whitespace:
-                        stream.seek(-1, 1)
-                        break
-                    else:
-                        stream.seek(-1,1)
-                        data += info
-                else:
-                    stream.seek(-1, 1)
-                    data += tok
-            else:
-                data += tok
+        # first read the dictionary of settings, the operands of "ID"
+        entries, operator = lexer.readOperation()
+        assert operator == b_("ID")
+        settings = DictionaryObject(zip(entries[::2], entries[1::2]))
+        # the data begins after the whitespace that ends "ID"
+        lexer.take(1)
+        data = lexer.readInlineImageData()
         return {"settings": settings, "data": data}
 
     def _getData(self):
@@ -2773,7 +2717,7 @@ class ContentStream(DecodedStreamObject):
         return newdata.getvalue()
 
     def _setData(self, value):
-        self.__parseContentStream(BytesIO(b_(value)))
+        self.__parseContentStream(b_(value))
 
     _data = property(_getData, _setData)
 
@@ -2849,6 +2793,56 @@ def convertToInt(d, size):
     d = d[-8:]
     return struct.unpack(">q", d)[0]
 
+
+# struct formats of big-endian unsigned integers of 1, 2, 4 and 8 bytes
+_UINT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def decodeXrefStream(data, widths):
+    """
+    Decodes the entries of a cross-reference stream in one pass of
+    ``struct.iter_unpack`` rather than a read per field.  Python 2, which
+    lacks it, unpacks one entry at a time.
+
+    :param data: the decoded data of the stream.
+    :param widths: its ``/W``: the widths in bytes of each entry's fields.
+        Fields past the third are skipped.
+    :return: three lists: the type of each entry and its second and third
+        fields.  A field of width 0 takes its default, per PDF spec table
+        17: type 1 for the first field, 0 for the others.
+    """
+    widths = [int(w) for w in widths]
+    rowSize = sum(widths)
+    if rowSize == 0:
+        raise utils.PdfReadError("Invalid xref stream entry sizes: %s" % widths)
+    # whole entries only; a truncated last entry is dropped
+    count = len(data) // rowSize
+    fmt = ">"
+    for i, width in enumerate(widths):
+        if i >= 3:
+            fmt += "%dx" % width
+        elif width:
+            fmt += _UINT_FORMATS.get(width, "%ds" % width)
+    if hasattr(struct, "iter_unpack"):
+        rows = struct.iter_unpack(fmt, data[:count * rowSize])
+    else:
+        # Python 2 has no iter_unpack: unpack each entry in turn
+        rows = [struct.unpack_from(fmt, data, offset) for offset in range(0, count * rowSize, rowSize)]
+    columns = list(zip(*rows)) or [()] * 3
+    fields = []
+    for i, width in enumerate(widths[:3]):
+        if not width:
+            fields.append([1 if i == 0 else 0] * count)
+            continue
+        column = columns.pop(0)
+        if width in _UINT_FORMATS:
+            fields.append(column)
+        elif hasattr(int, "from_bytes"):
+            fields.append([int.from_bytes(field, "big") for field in column])
+        else:
+            fields.append([convertToInt(field, width) for field in column])
+    return fields
+
 # ref: pdf1.8 spec section 3.5.2 algorithm 3.2
 _encryption_padding = b_('\x28\xbf\x4e\x5e\x4e\x75\x8a\x41\x64\x00\x4e\x56') + \
         b_('\xff\xfa\x01\x08\x2e\x2e\x00\xb6\xd0\x68\x3e\x80\x2f\x0c') + \
@@ -0,0 +1,285 @@
+"""
+Split a PDF into single-page PDF files.
+
+:class:`PdfFileWriter<pdf.PdfFileWriter>` copies and re-serializes every
+object a page uses, so splitting an N page document with one writer per page
+writes the fonts, color spaces and ICC profiles that all the pages share N
+times.  :class:`PageSplitter` serializes each indirect object of the reader
+once, into byte fragments with holes where its indirect references go, and
+assembles every page's file from those fragments, renumbering only the
+references.
+
+This software is available under a BSD license;
+see https://github.com/mstamy2/PyPDF2/blob/master/LICENSE
+"""
+
+from .generic import *
+from .utils import b_
+from . import utils
+from sys import version_info
+
+if version_info < ( 3, 0 ):
+    from cStringIO import StringIO as BytesIO
+else:
+    from io import BytesIO
+
+# Object numbers of the fixed part of every single-page file.
+CATALOG_NUM, PAGES_NUM, PAGE_NUM = 1, 2, 3
+FIRST_NUM = 4
+
+
+class PageSplitter(object):
+    """
+    Writes pages of a :class:`PdfFileReader<pdf.PdfFileReader>` out as
+    single-page PDF files, sharing the serialized form of indirect objects
+    between pages.
+
+    References to other pages or to the page tree (for example from link
+    annotations) are written as ``null``, since the output holds one page.
+
+    :param reader: the :class:`PdfFileReader<pdf.PdfFileReader>` to split.
+        Encrypted files are not supported.
+    :param int cacheStreamLimit: streams with more bytes of data than this
+        are only kept once a second page uses them, so the page's own scan
+        image is not held after its page is written.
+    """
+    def __init__(self, reader, cacheStreamLimit=65536):
+        if reader.isEncrypted:
+            raise utils.PdfReadError("PageSplitter does not support encrypted files")
+        self.reader = reader
+        self.cacheStreamLimit = cacheStreamLimit
+        self._fragments = {}    # (generation, idnum) -> (chunks, refs)
+        self._seen = set()      # large streams serialized once but not cached
+        self._pageOnly = []     # fragments to drop once the current page is written
+        self._skip = {}         # (generation, idnum) -> True for page tree nodes
+        self.serializedCount = 0
+        self.reusedCount = 0
+
+    def getNumPages(self):
+        return self.reader.getNumPages()
+
+    def getPage(self, pageNumber):
+        """
+        Retrieves a page by number, like
+        :meth:`PdfFileReader.getPage()<pdf.PdfFileReader.getPage>`, but by
+        descending the page tree with each node's ``/Count`` instead of
+        flattening it, so only the nodes on the way to the page are read.
+
+        :param int pageNumber: the page to retrieve (pages begin at zero).
+        :return: a :class:`PageObject<pdf.PageObject>` instance.
+        """
+        from .pdf import PageObject
+        if self.reader.flattenedPages is not None:
+            return self.reader.getPage(pageNumber)
+        inheritable = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+        inherit = {}
+        ref = None
+        node = self.reader.trailer["/Root"]["/Pages"]
+        index = pageNumber
+        try:
+            while node.get("/Type", "/Pages") == "/Pages":
+                for attr in inheritable:
+                    if attr in node:
+                        inherit[NameObject(attr)] = node.raw_get(attr)
+                kids = node["/Kids"]
+                if index < 0 or index >= node["/Count"]:
+                    raise IndexError("sequence index out of range")
+                if node["/Count"] == len(kids):
+                    # the common flat tree: every kid is a page
+                    kid = kids[index].getObject()
+                    if kid.get("/Type") == "/Page":
+                        ref, node, index = kids[index], kid, 0
+                        continue
+                for ref in kids:
+                    kid = ref.getObject()
+                    count = kid["/Count"] if kid.get("/Type") == "/Pages" else 1
+                    if index < count:
+                        node = kid
+                        break
+                    index -= count
+                else:
+                    raise utils.PdfReadError("Page tree /Count does not match its /Kids")
+        except (KeyError, AttributeError, utils.PdfReadError):
+            # no usable /Count: fall back to flattening the whole tree
+            return self.reader.getPage(pageNumber)
+        page = PageObject(self.reader, ref if isinstance(ref, IndirectObject) else None)
+        page.update(inherit)
+        page.update(node)
+        return page
+
+    def writePage(self, pageNumber, stream):
+        """
+        Writes one page of the reader to ``stream`` as a complete PDF file.
+
+        :param int pageNumber: the page to write (pages begin at zero).
+        :param stream: an object supporting ``write`` and ``tell``.
+        """
+        page = self.getPage(pageNumber)
+        own = None
+        if page.indirectRef is not None:
+            own = (page.indirectRef.generation, page.indirectRef.idnum)
+
+        pageChunks, pageRefs = self._serializePage(page)
+
+        # Number every object reachable from the page, breadth first.
+        numbers = {}
+        if own is not None:
+            numbers[own] = PAGE_NUM
+        order = []
+        queue = list(pageRefs)
+        i = 0
+        while i < len(queue):
+            ref = queue[i]
+            i += 1
+            if ref in numbers or self._isPageTree(ref):
+                continue
+            numbers[ref] = FIRST_NUM + len(order)
+            chunks, refs = self._getFragments(ref)
+            order.append((numbers[ref], chunks, refs))
+            queue.extend(refs)
+
+        positions = []
+        stream.write(b_("%PDF-1.3\n"))
+        positions.append(stream.tell())
+        stream.write(b_("%d 0 obj\n<<\n/Type /Catalog\n/Pages %d 0 R\n>>\nendobj\n" % (CATALOG_NUM, PAGES_NUM)))
+        positions.append(stream.tell())
+        stream.write(b_("%d 0 obj\n<<\n/Type /Pages\n/Count 1\n/Kids [ %d 0 R ]\n>>\nendobj\n" % (PAGES_NUM, PAGE_NUM)))
+        positions.append(stream.tell())
+        self._writeObject(stream, PAGE_NUM, pageChunks, pageRefs, numbers)
+        for num, chunks, refs in order:
+            positions.append(stream.tell())
+            self._writeObject(stream, num, chunks, refs, numbers)
+        self._forgetPageOnly()
+
+        xref_location = stream.tell()
+        stream.write(b_("xref\n0 %d\n" % (len(positions) + 1)))
+        stream.write(b_("%010d %05d f \n" % (0, 65535)))
+        for offset in positions:
+            stream.write(b_("%010d %05d n \n" % (offset, 0)))
+        stream.write(b_("trailer\n<<\n/Size %d\n/Root %d 0 R\n>>\n" % (len(positions) + 1, CATALOG_NUM)))
+        stream.write(b_("startxref\n%d\n%%%%EOF\n" % xref_location))
+
+    def getPageBytes(self, pageNumber):
+        """
+        Returns one page of the reader as the bytes of a complete PDF file.
+
+        :param int pageNumber: the page to write (pages begin at zero).
+        """
+        out = BytesIO()
+        self.writePage(pageNumber, out)
+        return out.getvalue()
+
+    def _writeObject(self, stream, num, chunks, refs, numbers):
+        stream.write(b_("%d 0 obj\n" % num))
+        stream.write(chunks[0])
+        for i in range(len(refs)):
+            newnum = numbers.get(refs[i])
+            if newnum is None:
+                stream.write(b_("null"))
+            else:
+                stream.write(b_("%d 0 R" % newnum))
+            stream.write(chunks[i + 1])
+        stream.write(b_("\nendobj\n"))
+
+    def _isPageTree(self, ref):
+        # Pages and page tree nodes are never copied: the only page in the
+        # output is the one being written, under a new /Pages node.
+        skip = self._skip.get(ref)
+        if skip is None:
+            obj = self._resolve(ref)
+            skip = isinstance(obj, DictionaryObject) and \
+                obj.get("/Type") in ("/Page", "/Pages")
+            self._skip[ref] = skip
+        return skip
+
+    def _resolve(self, ref):
+        try:
+            return self.reader.getObject(IndirectObject(ref[1], ref[0], self.reader))
+        except utils.PdfReadError:
+            return NullObject()
+
+    def _getFragments(self, ref):
+        fragments = self._fragments.get(ref)
+        if fragments is not None:
+            self.reusedCount += 1
+            return fragments
+        obj = self._resolve(ref)
+        fragments = _Fragments()
+        fragments.add(obj)
+        fragments = fragments.finish()
+        self.serializedCount += 1
+        self._fragments[ref] = fragments
+        if isinstance(obj, StreamObject) and \
+                len(obj._data) > self.cacheStreamLimit and ref not in self._seen:
+            self._seen.add(ref)
+            self._pageOnly.append(ref)
+        return fragments
+
+    def _forgetPageOnly(self):
+        for ref in self._pageOnly:
+            del self._fragments[ref]
+        self._pageOnly = []
+
+    def _serializePage(self, page):
+        fragments = _Fragments()
+        fragments.write(b_("<<\n"))
+        for key, value in list(page.items()):
+            if key == "/Parent":
+                continue
+            fragments.addEntry(key, value)
+        fragments.write(b_("/Parent %d 0 R\n>>" % PAGES_NUM))
+        return fragments.finish()
+
+
+class _Fragments(object):
+    """
+    Serializes a PDF object the way ``writeToStream`` does, but leaves a hole
+    for each indirect reference so the bytes can be reused under any object
+    numbering.  ``finish`` returns ``(chunks, refs)`` with one more chunk than
+    refs: ``chunks[0], refs[0], chunks[1], ...``.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.refs = []
+        self.buf = BytesIO()
+
+    def write(self, data):
+        self.buf.write(data)
+
+    def finish(self):
+        self.chunks.append(self.buf.getvalue())
+        return tuple(self.chunks), tuple(self.refs)
+
+    def addEntry(self, key, value):
+        key.writeToStream(self.buf, None)
+        self.buf.write(b_(" "))
+        self.add(value)
+        self.buf.write(b_("\n"))
+
+    def add(self, obj):
+        if isinstance(obj, IndirectObject):
+            self.chunks.append(self.buf.getvalue())
+            self.refs.append((obj.generation, obj.idnum))
+            self.buf = BytesIO()
+        elif isinstance(obj, StreamObject):
+            self.buf.write(b_("<<\n"))
+            for key, value in list(obj.items()):
+                if key != "/Length":
+                    self.addEntry(key, value)
+            self.buf.write(b_("/Length %d\n>>" % len(obj._data)))
+            self.buf.write(b_("\nstream\n"))
+            self.buf.write(obj._data)
+            self.buf.write(b_("\nendstream"))
+        elif isinstance(obj, DictionaryObject):
+            self.buf.write(b_("<<\n"))
+            for key, value in list(obj.items()):
+                self.addEntry(key, value)
+            self.buf.write(b_(">>"))
+        elif isinstance(obj, ArrayObject):
+            self.buf.write(b_("["))
+            for value in obj:
+                self.buf.write(b_(" "))
+                self.add(value)
+            self.buf.write(b_(" ]"))
+        else:
+            obj.writeToStream(self.buf, None)
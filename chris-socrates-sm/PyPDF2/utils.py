@@ -32,6 +32,8 @@ __author__ = "Mathieu Fenniak"
 __author_email__ = "biziqe@mathieu.fenniak.net"
 
 
+import mmap
+import re
 import sys
 
 try:
@@ -70,30 +72,45 @@ def formatWarning(message, category, filename, lineno, line=None):
     return "%s: %s [%s:%s]\n" % (category.__name__, message, file, lineno)
 
 
+# Bytes the readers below read at a time; they seek back over what they don't use
+SCAN_CHUNK = 64
+_NON_SPACE_RUN = re.compile(br'[^\s]*')
+_WHITESPACE_RUN = re.compile(br'[ \n\r\t\x00]*')
+
+
 def readUntilWhitespace(stream, maxchars=None):
     """
     Reads non-whitespace characters and returns them.
-    Stops upon encountering whitespace or when maxchars is reached.
+    Stops upon encountering whitespace, which is consumed, or when maxchars
+    is reached.
     """
     txt = b_("")
     while True:
-        tok = stream.read(1)
-        if tok.isspace() or not tok:
-            break
-        txt += tok
+        size = SCAN_CHUNK if maxchars is None else min(SCAN_CHUNK, maxchars - len(txt))
+        tok = stream.read(size)
+        if not tok:
+            return txt
+        end = _NON_SPACE_RUN.match(tok).end()
+        txt += tok[:end]
+        if end < len(tok):
+            stream.seek(end + 1 - len(tok), 1)
+            return txt
         if len(txt) == maxchars:
-            break
-    return txt
+            return txt
 
 
 def readNonWhitespace(stream):
     """
     Finds and reads the next non-whitespace character (ignores whitespace).
     """
-    tok = WHITESPACES[0]
-    while tok in WHITESPACES:
-        tok = stream.read(1)
-    return tok
+    while True:
+        tok = stream.read(SCAN_CHUNK)
+        if not tok:
+            return tok
+        end = _WHITESPACE_RUN.match(tok).end()
+        if end < len(tok):
+            stream.seek(end + 1 - len(tok), 1)
+            return tok[end:end + 1]
 
 
 def skipOverWhitespace(stream):
@@ -101,12 +118,16 @@ def skipOverWhitespace(stream):
     Similar to readNonWhitespace, but returns a Boolean if more than
     one whitespace character was read.
     """
-    tok = WHITESPACES[0]
-    cnt = 0;
-    while tok in WHITESPACES:
-        tok = stream.read(1)
-        cnt+=1
-    return (cnt > 1)
+    skipped = False
+    while True:
+        tok = stream.read(SCAN_CHUNK)
+        if not tok:
+            return skipped
+        end = _WHITESPACE_RUN.match(tok).end()
+        skipped = skipped or end > 0
+        if end < len(tok):
+            stream.seek(end + 1 - len(tok), 1)
+            return skipped
 
 
 def skipOverComment(stream):
@@ -141,6 +162,69 @@ def readUntilRegex(stream, regex, ignore_eof=False):
     return name
 
 
+class BufferStream(object):
+    """
+    A read-only, seekable file object over a bytes-like object, such as
+    ``bytes``, a ``memoryview`` or an ``mmap``, which is never copied.
+    :meth:`getvalue` returns a memoryview of it, which the
+    :class:`Lexer<PyPDF2.lexer.Lexer>` reads objects from in place, so the
+    data of the streams read from it are slices of it too.
+
+    :param buffer: the bytes-like object to read.
+    """
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        self.view = view
+        self.pos = 0
+
+    def read(self, size=-1):
+        start = self.pos
+        if size is None or size < 0:
+            end = len(self.view)
+        else:
+            end = min(start + size, len(self.view))
+        self.pos = max(start, end)
+        return self.view[start:end].tobytes()
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError("negative seek value %d" % offset)
+        self.pos = offset
+        return offset
+
+    def tell(self):
+        return self.pos
+
+    def getvalue(self):
+        return self.view
+
+
+def mapFile(file):
+    """
+    Maps a file into memory, read-only, so only the pages of it that are
+    read take memory, and the system can drop them again.
+
+    :param file: a path, a file descriptor or a file object with ``fileno()``.
+    :return: an ``mmap``, or empty bytes for an empty file, which can't be
+        mapped.
+    """
+    if isString(file):
+        with open(file, 'rb') as f:
+            return mapFile(f)
+    fileno = file if isInt(file) else file.fileno()
+    try:
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # "cannot mmap an empty file"
+        return b_("")
+
+
 class ConvertFunctionsToVirtualList(object):
     def __init__(self, lengthFunction, getFunction):
         self.lengthFunction = lengthFunction
@@ -2,24 +2,35 @@
 """All Handlers for initial Socrates, will be split into files later."""
 
 from json import dumps, loads
-import io
 import logging
 import os
 import random
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 
 import boto3
+from botocore.config import Config
 
-from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2 import PdfFileReader, PageSplitter
 
 
 UPLOAD_BUCKET_NAME = os.environ['BUCKET_NAME']
 STATEMACHINE_ARN = os.environ['STATEMACHINE_ARN']
+SPLIT_UPLOAD_WORKERS = int(os.environ.get('SPLIT_UPLOAD_WORKERS', '8'))
+SPLIT_MAX_PENDING = int(os.environ.get('SPLIT_MAX_PENDING', str(2 * SPLIT_UPLOAD_WORKERS)))
+RECORD_WORKERS = int(os.environ.get('RECORD_WORKERS', '8'))  # records of an event handled at once
 
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
-S3 = boto3.client('s3')         # Unneeded: config=boto3.session.Config(signature_version='s3v4'))
+# Shared by the split upload threads, so size its connection pool to match them
+S3_POOL_CONNECTIONS = SPLIT_UPLOAD_WORKERS + 2
+S3 = boto3.client('s3', config=Config(max_pool_connections=S3_POOL_CONNECTIONS,
+                                      retries={'max_attempts': 5}))
+# Shared by the record threads; clients are thread safe, unlike creating them
+SF = boto3.client('stepfunctions', config=Config(max_pool_connections=RECORD_WORKERS + 2))
 
 
 def get_upload_url(event, _context):
@@ -77,23 +88,61 @@ def uploaded(event, context):
     """Handle the S3 ObjectCreated trigger: just start the state machine."""
     LOG.info(f'event: {dumps(event)}')
     LOG.info(f'STATEMACHINE_ARN={STATEMACHINE_ARN}')
-    s3rec = event['Records'][0]['s3']  # only the first, but there should only be one for S3
+    return process_records(event, upload_record)
+
+
+def upload_record(s3rec):
+    """Start the state machine for one uploaded document."""
     bucket = s3rec['bucket']['name']
     key = s3rec['object']['key']
     size = s3rec['object']['size']
     etag = s3rec['object']['eTag']
     _doc_pdf, jid, name_pdf = key.split('/')
     LOG.info(f'bucket={bucket} etag={etag} size={size} key={key} jid={jid} name_pdf={name_pdf}')
-    sf = boto3.client('stepfunctions')
     sf_input = dumps({'bucket': bucket, 'key': key, 'etag': etag, 'size': size, 'jid': jid, 'name_pdf': name_pdf})
-    # For now, suffix jid with UUID so we can submit the same job URL again
-    uid = uuid.uuid4().hex
-    res = sf.start_execution(stateMachineArn=STATEMACHINE_ARN,
-                             name=f'{jid}-{uid}',  # use our JobID as unique SM invocation ID
-                             input=sf_input)  # state needs JSON str input
+    # Suffix jid with the event's sequencer, which is new for each upload of the key, so the
+    # same job URL can be submitted again, but a retried event doesn't start a second execution
+    name = f"{jid}-{s3rec['object'].get('sequencer') or etag}"
+    try:
+        res = SF.start_execution(stateMachineArn=STATEMACHINE_ARN,
+                                 name=name,  # use our JobID as unique SM invocation ID
+                                 input=sf_input)  # state needs JSON str input
+    except SF.exceptions.ExecutionAlreadyExists:
+        LOG.info(f'upload_record jid={jid} execution {name} already started')
+        return
     LOG.info(f'sf.start_execurtion res={res}')
 
 
+def process_records(event, process, workers=RECORD_WORKERS):
+    """Call process(s3) for every S3 record of an S3 or SQS event, concurrently.
+
+    Each record's error is logged and reported without stopping the others,
+    as SQS's ReportBatchItemFailures expects. S3 ignores what we return,
+    so if any record of an S3 event failed we raise once all have run and
+    Lambda retries the event.
+    """
+    records = event.get('Records', [])
+
+    def _process(record):
+        try:
+            if 's3' in record:
+                process(record['s3'])
+            else:  # an SQS message whose body is an S3 event notification
+                for s3_record in loads(record['body']).get('Records', []):
+                    process(s3_record['s3'])
+        except Exception:
+            item = record.get('messageId') or record['s3']['object']['key']
+            LOG.exception(f'process_records failed item={item}')
+            return item
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(records)))) as pool:
+        failed = [item for item in pool.map(_process, records) if item is not None]
+    if failed and not all('messageId' in record for record in records):
+        raise RuntimeError(f'process_records failed {len(failed)} of {len(records)} records: {failed}')
+    return {'batchItemFailures': [{'itemIdentifier': item} for item in failed]}
+
+
 def start_state_machine(event, context):
     """Take input from start of statemachine, enter an event in DDB, pass useful bits to next state."""
     LOG.info(f'event: {dumps(event)}')
@@ -111,20 +160,63 @@ def split_pdf(event, context):
     key = event['key']
     jid = event['jid']
     body_stream = boto3.resource('s3').Object(bucket, key).get()['Body']
-    body = io.BytesIO(body_stream.read())
-    pdf = PdfFileReader(body, strict=False)  # log unexpected stream ends, don't raise
+    body = body_stream.read()
+    # read in place, so page data are slices of body; log unexpected stream ends, don't raise
+    pdf = PdfFileReader(body, strict=False)
     num_pages = pdf.getNumPages()
     LOG.info(f'num_pages={num_pages}')
-    for page_num in range(num_pages):  # 0-based, want 1-based for humans?
-        pdf_writer = PdfFileWriter()
-        pdf_writer.addPage(pdf.getPage(page_num))
+    workers = _upload_workers(event)
+    timings = upload_pages(pdf, bucket, jid, workers=workers)
+    return {'jid': jid, 'num_pages': num_pages,
+            'upload_workers': workers,
+            'serialize_seconds': sum(t['serialize_seconds'] for t in timings),
+            'upload_seconds_max': max((t['upload_seconds'] for t in timings), default=0)}
+
+
+def _upload_workers(event):
+    """The event's upload_workers, default SPLIT_UPLOAD_WORKERS, at most the S3 client's connections.
+
+    Threads beyond S3_POOL_CONNECTIONS would only wait for a connection,
+    and urllib3 would drop the extra ones with "Connection pool is full".
+    """
+    workers = int(event.get('upload_workers', SPLIT_UPLOAD_WORKERS))
+    if workers > S3_POOL_CONNECTIONS:
+        LOG.warning(f'upload_workers={workers} capped at S3_POOL_CONNECTIONS={S3_POOL_CONNECTIONS}')
+    return min(workers, S3_POOL_CONNECTIONS)
+
+
+def upload_pages(pdf, bucket, jid, workers=SPLIT_UPLOAD_WORKERS, max_pending=None):
+    """Write each page to its own PDF and upload it on a bounded thread pool.
+
+    Pages are serialized here one at a time (PyPDF2 isn't thread safe) while
+    `workers` threads do the S3 PUTs; at most `max_pending` pages wait in memory.
+    Returns per-page serialize and upload timings, which are also logged.
+    """
+    max_pending = max_pending or max(SPLIT_MAX_PENDING, workers)
+    splitter = PageSplitter(pdf)  # serializes resources shared by pages only once
+    slots = threading.BoundedSemaphore(max_pending)
+
+    def _upload(page_num, body, serialize_seconds):
         pdf_key = f'page_pdf/{jid}/{page_num:04}.pdf'
-        out = io.BytesIO()
-        pdf_writer.write(out)
-        out.seek(0)
-        S3.upload_fileobj(out, bucket, pdf_key)
-        LOG.info(f'uploaded page_num={page_num}')
-    return {'jid': jid, 'num_pages': num_pages}
+        try:
+            t_0 = time()
+            S3.put_object(Body=body, Bucket=bucket, Key=pdf_key)
+            upload_seconds = time() - t_0
+        finally:
+            slots.release()
+        LOG.info(f'uploaded page_num={page_num} serialize_seconds={serialize_seconds} upload_seconds={upload_seconds}')
+        return {'page_num': page_num,
+                'serialize_seconds': serialize_seconds,
+                'upload_seconds': upload_seconds}
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page_num in range(splitter.getNumPages()):  # 0-based, want 1-based for humans?
+            slots.acquire()     # backpressure: wait for an upload to finish
+            t_0 = time()
+            body = splitter.getPageBytes(page_num)
+            futures.append(pool.submit(_upload, page_num, body, time() - t_0))
+    return [future.result() for future in futures]
 
 
 def ocr_page(event, context):
@@ -141,21 +233,24 @@ def ocr_page(event, context):
     See Callback Pattern at https://console.aws.amazon.com/states/home?region=us-east-1#/sampleProjects
     """
     LOG.debug(f'event: {dumps(event)}')
+    return process_records(event, ocr_page_record)
+
+
+def ocr_page_record(s3rec):
+    """Handle one page of an ocr_page event."""
     ACTIVITY_OCR_DONE_ARN = os.environ['ACTIVITY_OCR_DONE_ARN']
     LOG.info(f'ACTIVITY_OCR_DONE_ARN={ACTIVITY_OCR_DONE_ARN}')
-    s3rec = event['Records'][0]['s3']  # only the first, but there should only be one for S3
     bucket = s3rec['bucket']['name']
     key = s3rec['object']['key']
     _page_pdf, jid, name_pdf = key.split('/')
     LOG.info(f'bucket={bucket} key={key} jid={jid} name_pdf={name_pdf}')
 
     worker_name = "notify_upload_worker"
-    sf = boto3.client('stepfunctions')
     # Pretend we've discovered we've finished all the pages
     if name_pdf == '0000.pdf':
         # This does a long poll and times out after 60 seconds, so not ideal
-        res = sf.get_activity_task(activityArn=ACTIVITY_OCR_DONE_ARN, workerName='OCR_PAGE')  # arbitrary name
+        res = SF.get_activity_task(activityArn=ACTIVITY_OCR_DONE_ARN, workerName='OCR_PAGE')  # arbitrary name
         LOG.info(f'sf_activity={res}')
         sf_input = res['input']  # just copy input to output for now
-        res = sf.send_task_success(taskToken=res['taskToken'], output=sf_input)
+        res = SF.send_task_success(taskToken=res['taskToken'], output=sf_input)
         LOG.info(f'sf.send_task_success={res}')
@@ -66,9 +66,38 @@ def test_uploaded_ok():
 }
 """)
     res = uploaded(event, CONTEXT)
-    assert res == {'bucket': 'chris-socrates-sm-dev-chris',
-                   'key': 'doc_pdf/f4ad351bd2244ee1b2ba3fd96abb2dd8/doc.pdf',
-                   'etag': 'ae83ad4555f58d15329ce849019f5f79',
-                   'size': 15,
-                   'jid': 'f4ad351bd2244ee1b2ba3fd96abb2dd8',
-                   'name_pdf': 'doc.pdf'}
+    assert res == {'batchItemFailures': []}
+
+
+def _s3_record(key, sequencer):
+    return {'eventSource': 'aws:s3', 's3': {'bucket': {'name': 'bucket'}, 'object': {
+        'key': key, 'size': 15, 'eTag': 'ae83ad4555f58d15329ce849019f5f79', 'sequencer': sequencer}}}
+
+
+def test_uploaded_partial_failure_retry_starts_each_once(monkeypatch):
+    import handler
+    started = []
+
+    def start_execution(stateMachineArn, name, input):
+        if name in started:
+            raise handler.SF.exceptions.ExecutionAlreadyExists(
+                {'Error': {'Code': 'ExecutionAlreadyExists', 'Message': name}}, 'StartExecution')
+        started.append(name)
+        return {'executionArn': name}
+
+    monkeypatch.setattr(handler.SF, 'start_execution', start_execution)
+    event = {'Records': [_s3_record('doc_pdf/jid1/doc.pdf', '005D30C78C8885EB41'),
+                         _s3_record('doc_pdf/not-a-job.pdf', '005D30C78C8885EB42'),
+                         _s3_record('doc_pdf/jid2/doc.pdf', '005D30C78C8885EB43')]}
+    for _ in range(2):  # Lambda retries the whole S3 event
+        with pytest.raises(RuntimeError, match=r"failed 1 of 3 records: \['doc_pdf/not-a-job.pdf'\]"):
+            uploaded(event, CONTEXT)
+    assert sorted(started) == ['jid1-005D30C78C8885EB41', 'jid2-005D30C78C8885EB43']
+
+
+def test_split_upload_workers_fit_the_s3_pool(monkeypatch):
+    import handler
+    monkeypatch.setattr(handler, 'S3_POOL_CONNECTIONS', 20)
+    assert handler._upload_workers({}) == handler.SPLIT_UPLOAD_WORKERS
+    assert handler._upload_workers({'upload_workers': '12'}) == 12
+    assert handler._upload_workers({'upload_workers': 64}) == 20
@@ -0,0 +1,242 @@
+import io
+import mmap
+import time
+
+from PyPDF2 import PdfFileReader, PdfFileWriter, PageSplitter
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject,
+                            NameObject, NullObject, NumberObject, readObject)
+from PyPDF2.lexer import Lexer
+from PyPDF2.pdf import ContentStream, decodeXrefStream
+from PyPDF2.utils import PdfReadError
+
+OBJECTS = (b'<< /Type /Page % a comment\n /Kids [1 0 R 2 0 R] /Rect [0 -1.5 +3 .25]'
+           b' /T (a \\(b\\) (c) \\101\\n\\\nd) /H <48 65 6C6C 6>'
+           b' /Ok true /No false /None null /N#20 /A#42 >>'
+           b' << /Length 8 >>\nstream\n(binary)\nendstream 42 ')
+
+
+def make_pdf(num_pages=3):
+    """Return bytes of a scan-like PDF: a JPEG per page plus a font and ICC profile all pages share."""
+    writer = PdfFileWriter()
+    font = DictionaryObject({NameObject('/Type'): NameObject('/Font'),
+                             NameObject('/Subtype'): NameObject('/Type1'),
+                             NameObject('/BaseFont'): NameObject('/Helvetica')})
+    font_ref = writer._addObject(font)
+    icc = DecodedStreamObject()
+    icc.setData(b'ICC' * 300)
+    icc[NameObject('/N')] = NumberObject(3)
+    icc_ref = writer._addObject(icc)
+    for num in range(num_pages):
+        image = DecodedStreamObject()
+        image.setData(b'\xff\xd8' + bytes([num % 256]) * 100 + b'\xff\xd9')
+        image.update({NameObject('/Type'): NameObject('/XObject'),
+                      NameObject('/Subtype'): NameObject('/Image'),
+                      NameObject('/Width'): NumberObject(10),
+                      NameObject('/Height'): NumberObject(20),
+                      NameObject('/BitsPerComponent'): NumberObject(8),
+                      NameObject('/Filter'): NameObject('/DCTDecode'),
+                      NameObject('/ColorSpace'): ArrayObject([NameObject('/ICCBased'), icc_ref])})
+        content = DecodedStreamObject()
+        content.setData(b'q 612 0 0 792 0 0 cm /Im0 Do Q BT /F1 12 Tf (page %d) Tj ET' % num)
+        page = writer.addBlankPage(612, 792)
+        page[NameObject('/Contents')] = writer._addObject(content)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font_ref}),
+            NameObject('/XObject'): DictionaryObject({NameObject('/Im0'): writer._addObject(image)})})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def test_page_splitter_pages():
+    reader = PdfFileReader(io.BytesIO(make_pdf(3)))
+    splitter = PageSplitter(reader)
+    for num in range(3):
+        page_pdf = PdfFileReader(io.BytesIO(splitter.getPageBytes(num)))
+        assert page_pdf.getNumPages() == 1
+        page = page_pdf.getPage(0)
+        assert page.getContents().getData().endswith(b'(page %d) Tj ET' % num)
+        assert page['/Resources']['/Font']['/F1']['/BaseFont'] == '/Helvetica'
+        image = page['/Resources']['/XObject']['/Im0']
+        assert image._data == b'\xff\xd8' + bytes([num % 256]) * 100 + b'\xff\xd9'
+        assert image['/ColorSpace'][1].getObject().getData() == b'ICC' * 300
+
+
+def test_page_splitter_serializes_shared_objects_once():
+    reader = PdfFileReader(io.BytesIO(make_pdf(5)))
+    splitter = PageSplitter(reader)
+    for num in range(5):
+        splitter.getPageBytes(num)
+    # font and ICC profile once, then each page's content and image
+    assert splitter.serializedCount == 2 + 2 * 5
+    assert splitter.reusedCount == 2 * 4
+
+
+def test_page_splitter_get_page_without_flattening():
+    reader = PdfFileReader(io.BytesIO(make_pdf(4)))
+    splitter = PageSplitter(reader)
+    page = splitter.getPage(2)
+    assert reader.flattenedPages is None
+    assert page.indirectRef == reader.getPage(2).indirectRef
+    assert page['/MediaBox'] == reader.getPage(2)['/MediaBox']
+
+
+def _check_objects(stream):
+    page = readObject(stream, None)
+    assert page['/Type'] == '/Page'
+    assert page['/Kids'] == [IndirectObject(1, 0, None), IndirectObject(2, 0, None)]
+    assert [str(num) for num in page['/Rect']] == ['0', '-1.5', '3', '0.25']
+    assert page['/T'].original_bytes == b'a (b) (c) A\nd'
+    assert page['/H'] == 'Hell`'
+    assert (page['/Ok'].value, page['/No'].value, type(page['/None'])) == (True, False, NullObject)
+    assert page['/N#20'] == '/A#42'
+    stream_obj = readObject(stream, None)
+    assert stream_obj._data == b'(binary)'
+    assert readObject(stream, None) == 42
+    assert stream.read() == b' '
+
+
+def test_lexer_reads_objects_in_place():
+    _check_objects(io.BytesIO(OBJECTS))
+
+
+def test_lexer_reads_objects_through_window(monkeypatch):
+    monkeypatch.setattr(Lexer, 'window', 4)
+    _check_objects(io.BufferedReader(io.BytesIO(OBJECTS)))
+
+
+def test_xref_table_entry_layouts():
+    pdf = make_pdf(3)
+    expected = PdfFileReader(io.BytesIO(pdf)).xref
+    start = pdf.rindex(b'\nxref\n0 15\n') + len(b'\nxref\n0 15\n')
+    end = pdf.index(b'trailer', start)
+    rows = pdf[start:end].split(b' \n')[:-1]
+    # in two subsections, with the spec's 20-byte entries and with CRLF after a space, 1-byte and CRLF EOLs
+    for eol in (b' \n', b' \r\n', b'\n', b'\r', b'\r\n'):
+        table = b'0 5\n' + b''.join(row + eol for row in rows[:5]) + b'5 10\n' + b''.join(row + eol for row in rows[5:])
+        assert PdfFileReader(io.BytesIO(pdf[:start - len(b'0 15\n')] + table + pdf[end:])).xref == expected
+
+
+def test_lexer_reads_xref_entries():
+    rows = b'0000000000 65535 f \n0000000015 00000 n \n0000000123 00002 n\r\ntrailer'
+    assert Lexer(b'\n' + rows).readXrefEntries(3) == [(0, 65535), (15, 0), (123, 2)]
+    lexer = Lexer(rows.replace(b' \n', b'\n'))
+    assert lexer.readXrefEntries(3) == [(0, 65535), (15, 0), (123, 2)]
+    assert lexer.data[lexer.pos:] == b'trailer'
+
+
+def xref_stream_pdf(pdf, widths):
+    """Return pdf with its xref table replaced by an xref stream of fields widths bytes wide."""
+    reader = PdfFileReader(io.BytesIO(pdf))
+    start = pdf.rindex(b'\nxref\n') + 1
+    size = reader.trailer['/Size']
+    rows = [(0, 0, 0)] + [(1, reader.xref[0][num], 0) for num in range(1, size)] + [(1, start, 0)]
+    data = b''.join(b''.join(field.to_bytes(width, 'big') for field, width in zip(row + (0,), widths))
+                    for row in rows)
+    return (pdf[:start] + b'%d 0 obj\n<< /Type /XRef /Size %d /W [%s] /Root %d 0 R /Length %d >>\nstream\n' % (
+        size, size + 1, ' '.join(map(str, widths)).encode(), reader.trailer.raw_get('/Root').idnum, len(data)) +
+        data + b'\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % start)
+
+
+def test_xref_stream():
+    pdf = make_pdf(3)
+    expected = PdfFileReader(io.BytesIO(pdf)).xref[0]
+    expected[len(expected) + 1] = pdf.rindex(b'\nxref\n') + 1  # the xref stream itself
+    for widths in ([1, 2, 1], [1, 3, 2], [1, 4, 1, 2]):
+        reader = PdfFileReader(io.BytesIO(xref_stream_pdf(pdf, widths)), strict=False)
+        assert reader.xref[0] == expected
+        assert reader.getPage(2).getContents().getData().endswith(b'(page 2) Tj ET')
+
+
+def test_decode_xref_stream():
+    data = b'\x02\x00\x00\x07\x03' b'\x01\x01\x00\x00\x00' b'\x00\x00\x00\x00\x01' b'\x01\x00'
+    assert decodeXrefStream(data, [1, 3, 1]) == [(2, 1, 0), [7, 65536, 0], (3, 0, 1)]
+    assert decodeXrefStream(data[5:10], [0, 2, 2, 1]) == [[1], (257,), (0,)]
+
+
+def test_decode_xref_stream_without_iter_unpack(monkeypatch):
+    import struct
+    data = b'\x02\x00\x00\x07\x03' b'\x01\x01\x00\x00\x00' b'\x00\x00\x00\x00\x01' b'\x01\x00'
+    monkeypatch.delattr(struct, 'iter_unpack')
+    assert decodeXrefStream(data, [1, 3, 1]) == [(2, 1, 0), [7, 65536, 0], (3, 0, 1)]
+    assert decodeXrefStream(data[5:10], [0, 2, 2, 1]) == [[1], (257,), (0,)]
+
+
+def object_stream_pdf(num_pages):
+    """Return a PDF whose catalog, page tree and pages are in an object stream, with an xref stream."""
+    kids = b' '.join(b'%d 0 R' % (3 + num) for num in range(num_pages))
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, num_pages)]
+    objects += [b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R >>' % (3 + num_pages)
+                for _ in range(num_pages)]
+    offsets, body = [], b''
+    for obj in objects:
+        offsets.append(len(body))
+        body += obj + b' '
+    header = b' '.join(b'%d %d' % (1 + i, offset) for i, offset in enumerate(offsets)) + b' '
+    stm, xref = 3 + num_pages + 1, 3 + num_pages + 2
+    pdf = b'%PDF-1.5\n'
+    content_offset = len(pdf)
+    pdf += b'%d 0 obj\n<< /Length 10 >>\nstream\nBT (x) Tj\nendstream\nendobj\n' % (stm - 1)
+    stm_offset = len(pdf)
+    pdf += (b'%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Length %d >>\nstream\n' % (
+        stm, len(objects), len(header), len(header + body)) + header + body + b'\nendstream\nendobj\n')
+    rows = [(0, 0, 0)] + [(2, stm, i) for i in range(len(objects))] + [(1, content_offset, 0),
+                                                                       (1, stm_offset, 0), (1, len(pdf), 0)]
+    data = b''.join(bytes([kind]) + field.to_bytes(4, 'big') + bytes([index]) for kind, field, index in rows)
+    return pdf + (b'%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 1] /Root 1 0 R /Length %d >>\nstream\n' % (
+        xref, xref + 1, len(data)) + data + b'\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % len(pdf))
+
+
+def test_object_stream_index_parsed_once():
+    pdf = object_stream_pdf(5)
+    reader = PdfFileReader(io.BytesIO(pdf))
+    assert [reader.getPage(num)['/MediaBox'][2] for num in range(5)] == [612] * 5
+    assert (reader.objStmParsedCount, reader.objStmReusedCount, reader.objStmPreloadedCount) == (1, 6, 0)
+
+    reader = PdfFileReader(io.BytesIO(pdf), preloadObjectStreams=True)
+    assert [reader.getPage(num)['/MediaBox'][2] for num in range(5)] == [612] * 5
+    assert (reader.objStmParsedCount, reader.objStmReusedCount, reader.objStmPreloadedCount) == (1, 0, 6)
+    assert reader.getPage(4).getContents().getData() == b'BT (x) Tj\n'
+
+
+def test_content_stream_operations():
+    content = DecodedStreamObject()
+    content.setData(b'q 1 0 0 1 0 0 cm % comment\nBT /F1 12 Tf (EI) Tj ET'
+                    b' BI /W 2 /H 1 ID \x00EI\x01 EI Q')
+    operations = ContentStream(content, None).operations
+    assert [operator for _, operator in operations] == [b'q', b'cm', b'BT', b'Tf', b'Tj', b'ET',
+                                                        b'INLINE IMAGE', b'Q']
+    assert operations[1][0] == [1, 0, 0, 1, 0, 0]
+    assert operations[4][0] == ['EI']
+    assert operations[6][0] == {'settings': {'/W': 2, '/H': 1}, 'data': b'\x00EI\x01 '}
+
+
+def test_lexer_padding_is_linear():
+    # whitespace and %s no token follows used to backtrack exponentially: 24 spaces took seconds
+    padding = b'\n\x00 ' * 2000
+    t_0 = time.perf_counter()
+    content = DecodedStreamObject()
+    content.setData(b'q 612 0 0 792 0 0 cm /Im0 Do Q' + padding)
+    assert [operator for _, operator in ContentStream(content, None).operations] == [b'q', b'cm', b'Do', b'Q']
+    assert Lexer(b'<< /A' + padding + b'1' + padding + b'>>' + padding).readObject() == {'/A': 1}
+    for data in (padding + b'}', b'%a' * 2000 + b'\n' + padding + b'}'):
+        try:
+            Lexer(data).readObject()
+        except PdfReadError:
+            pass
+    assert time.perf_counter() - t_0 < 1
+
+
+def test_reader_reads_buffers_in_place(tmpdir):
+    pdf = make_pdf(3)
+    expected = PageSplitter(PdfFileReader(io.BytesIO(pdf))).getPageBytes(1)
+    path = tmpdir.join('scan.pdf')
+    path.write_binary(pdf)
+    with open(str(path), 'rb') as f:
+        for source, buffer_type in [(pdf, bytes), (memoryview(pdf), bytes), (bytearray(pdf), bytearray),
+                                    (str(path), mmap.mmap), (f.fileno(), mmap.mmap)]:
+            reader = PdfFileReader(source, useMmap=True)
+            image = reader.getPage(1)['/Resources']['/XObject']['/Im0']
+            assert isinstance(image._data, memoryview) and type(image._data.obj) is buffer_type
+            assert image._data == b'\xff\xd8' + b'\x01' * 100 + b'\xff\xd9'
+            assert PageSplitter(reader).getPageBytes(1) == expected
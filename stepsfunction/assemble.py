@@ -0,0 +1,174 @@
+"""AssembleText: join a document's page texts, in page order, into one text object with a page index.
+
+OCR leaves one page_pdf/jid/0000_<engine>.txt per page. Once WaitForOcr
+returns, we stream them into doc_txt/jid/doc.txt, each page followed by a
+form feed, as tesseract ends its pages. ASSEMBLE_WORKERS GETs run ahead of
+the page being written, in page order, and the text goes out as a
+multipart upload of ASSEMBLE_PART_BYTES parts, so memory holds no more
+than the pages in flight and one part, whatever the page count.
+
+doc_txt/jid/doc.idx holds num_pages + 1 big-endian unsigned 64 bit offsets:
+page i's text is bytes offsets[i] to offsets[i + 1] - 2 of doc.txt, without
+its form feed. read_page_text reads the two offsets of a page, then its
+text, with one range GET each.
+"""
+from json import dumps
+import logging
+import os
+import re
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import clients
+from metrics import measure, tagged, timed
+
+# Page texts fetched ahead of the one being written, and the multipart upload's part size
+ASSEMBLE_WORKERS = int(os.environ.get('ASSEMBLE_WORKERS', '16'))
+ASSEMBLE_PART_BYTES = int(os.environ.get('ASSEMBLE_PART_BYTES', str(8 * 1024 * 1024)))
+MIN_PART_BYTES = 5 * 1024 * 1024  # S3's minimum for every part but the last
+
+PAGE_TEXT_RE = re.compile(r'/(\d{4})_\w+\.txt$')
+PAGE_END = b'\f'
+OFFSET = struct.Struct('>Q')
+
+LOG = logging.getLogger()
+
+
+@timed
+def assemble_text(event, context):
+    """Write the page texts of event's jid to doc_txt/jid/doc.txt and its page index to doc.idx."""
+    LOG.info(f'event: {dumps(event)}')
+    bucket = event['bucket']
+    jid = event['jid']
+    num_pages = event['num_pages']
+    with tagged(jid=jid):
+        keys = page_text_keys(bucket, jid, num_pages)
+        text_key, index_key = text_keys(jid)
+        offsets = write_text(bucket, text_key, fetch_texts(bucket, keys))
+        with measure('s3_put'):
+            clients.s3().put_object(Bucket=bucket, Key=index_key,
+                                    Body=b''.join(OFFSET.pack(offset) for offset in offsets))
+    LOG.info(f'assemble_text jid={jid} num_pages={num_pages} text_bytes={offsets[-1]}')
+    return {'bucket': bucket, 'text_key': text_key, 'index_key': index_key,
+            'num_pages': num_pages, 'text_bytes': offsets[-1]}
+
+
+def text_keys(jid):
+    """Return the keys of a document's text and its page index."""
+    return f'doc_txt/{jid}/doc.txt', f'doc_txt/{jid}/doc.idx'
+
+
+def page_text_keys(bucket, jid, num_pages):
+    """Return the key of every page's text in page order, listing page_pdf/jid/ once.
+
+    A page OCRed twice, say by another engine on a retry, may have two
+    texts; we take the newest.
+    """
+    newest = {}  # page_num -> (LastModified, key)
+    paginator = clients.s3().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f'page_pdf/{jid}/'):
+        for obj in page.get('Contents', []):
+            match = PAGE_TEXT_RE.search(obj['Key'])
+            if match:
+                page_num = int(match.group(1))
+                newest[page_num] = max(newest.get(page_num, (obj['LastModified'], obj['Key'])),
+                                       (obj['LastModified'], obj['Key']))
+    missing = [page_num for page_num in range(num_pages) if page_num not in newest]
+    if missing:
+        raise RuntimeError(f'page_text_keys jid={jid} has no text for pages {missing[:10]}')
+    return [newest[page_num][1] for page_num in range(num_pages)]
+
+
+def fetch_texts(bucket, keys, workers=None):
+    """Yield the body of each key in order, GETting up to `workers` of them ahead concurrently."""
+    workers = workers or ASSEMBLE_WORKERS
+
+    def _get(page_num, key):
+        with measure('s3_get', page=page_num) as measurement:
+            body = clients.s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+            measurement.set(bytes=len(body))
+        return body
+
+    keys = iter(enumerate(keys))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(_get, *page) for _, page in zip(range(workers), keys))
+        while pending:
+            body = pending.popleft().result()
+            page = next(keys, None)
+            if page is not None:
+                pending.append(pool.submit(_get, *page))
+            yield body
+
+
+def write_text(bucket, key, texts, part_bytes=None):
+    """Write texts to key, each followed by PAGE_END; return each one's offset, then the length.
+
+    Parts of part_bytes are uploaded as they fill; a text that fits in one
+    part is one PutObject instead.
+    """
+    part_bytes = max(part_bytes or ASSEMBLE_PART_BYTES, MIN_PART_BYTES)
+    s3 = clients.s3()
+    offsets = [0]
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+    try:
+        for text in texts:
+            buffer += text
+            buffer += PAGE_END
+            offsets.append(offsets[-1] + len(text) + len(PAGE_END))
+            if len(buffer) >= part_bytes:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key,
+                                                           ContentType='text/plain; charset=utf-8')['UploadId']
+                parts.append(_upload_part(s3, bucket, key, upload_id, len(parts) + 1, buffer))
+                buffer = bytearray()
+        if upload_id is None:
+            with measure('s3_put', bytes=len(buffer)):
+                s3.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), ContentType='text/plain; charset=utf-8')
+            return offsets
+        if buffer:
+            parts.append(_upload_part(s3, bucket, key, upload_id, len(parts) + 1, buffer))
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                     MultipartUpload={'Parts': parts})
+    except Exception:
+        if upload_id is not None:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return offsets
+
+
+def _upload_part(s3, bucket, key, upload_id, number, data):
+    with measure('s3_put', bytes=len(data)):
+        etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number,
+                              Body=bytes(data))['ETag']
+    return {'ETag': etag, 'PartNumber': number}
+
+
+def iter_page_texts(bucket, jid):
+    """Yield the text of every page of an assembled document in order, streaming doc.txt."""
+    text_key, index_key = text_keys(jid)
+    s3 = clients.s3()
+    index = s3.get_object(Bucket=bucket, Key=index_key)['Body'].read()
+    offsets = [offset for offset, in OFFSET.iter_unpack(index)]
+    body = s3.get_object(Bucket=bucket, Key=text_key)['Body']
+    for first, end in zip(offsets, offsets[1:]):
+        yield body.read(end - first)[:-len(PAGE_END)].decode('utf-8')
+
+
+def read_page_text(bucket, jid, page_num):
+    """Return the text of one page of an assembled document, reading only its bytes."""
+    text_key, index_key = text_keys(jid)
+    s3 = clients.s3()
+    start = page_num * OFFSET.size
+    index = s3.get_object(Bucket=bucket, Key=index_key,
+                          Range=f'bytes={start}-{start + 2 * OFFSET.size - 1}')['Body'].read()
+    if len(index) < 2 * OFFSET.size:
+        raise IndexError(f'read_page_text jid={jid} has no page {page_num}')
+    first, end = OFFSET.unpack_from(index, 0)[0], OFFSET.unpack_from(index, OFFSET.size)[0]
+    if end - first <= len(PAGE_END):
+        return ''
+    text = s3.get_object(Bucket=bucket, Key=text_key,
+                         Range=f'bytes={first}-{end - 1 - len(PAGE_END)}')['Body'].read()
+    return text.decode('utf-8')
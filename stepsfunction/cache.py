@@ -0,0 +1,162 @@
+"""Cache OCR text by a hash of the page's image bytes, so re-uploaded scans skip OCR.
+
+The text lives in S3 under a prefix, ocr_cache/<sha256>.txt, indexed by
+the OCRCache table, which says which engine read it and how big it is.
+Every lookup counts as a hit, a miss, or stale: indexed, but its text is
+gone. The counts are logged with each lookup as ocr_cache result=...
+so a metric filter can chart the hit rate.
+
+Eviction is by age and size. Index entries expire by the table's TTL after
+max_age_days; evict, run daily, deletes texts older than that and then the
+oldest texts until the prefix holds no more than max_bytes. A text larger
+than max_text_bytes is not cached at all. Caching never fails OCR: errors
+are logged and the page is OCRed as if the cache were empty.
+"""
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from time import time
+
+from botocore.exceptions import ClientError
+
+import clients
+from metrics import timed
+from models import OcrCacheEntry
+
+LOG = logging.getLogger()
+
+
+class OcrCache(object):
+    """OCR text in S3 by page image digest, indexed in DynamoDB."""
+
+    def __init__(self, s3, bucket, prefix='ocr_cache/', max_age_days=30, max_bytes=10 * 1024 ** 3,
+                 max_text_bytes=1024 ** 2, entry_model=OcrCacheEntry):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.max_text_bytes = max_text_bytes
+        self.entry_model = entry_model
+        self.counts = {'hit': 0, 'miss': 0, 'stale': 0, 'put': 0, 'too_big': 0, 'error': 0}
+        self._lock = threading.Lock()  # pages of an event are OCRed on several threads
+
+    @staticmethod
+    def digest(images):
+        """Return the hex SHA-256 of a page's image bytes, see images.PageImage."""
+        sha = hashlib.sha256()
+        for image in images:
+            sha.update(image.data)
+        return sha.hexdigest()
+
+    def get(self, digest):
+        """Return the cached (engine, text) for an image digest, or None."""
+        try:
+            entry = self.entry_model.get(digest)
+        except self.entry_model.DoesNotExist:
+            return self._count('miss', digest)
+        except Exception as e:
+            LOG.warning(f'ocr_cache get digest={digest} e={e}')
+            return self._count('error', digest)
+        if entry.expires < time():  # TTL deletes lag
+            return self._count('miss', digest)
+        try:
+            text = self.s3.get_object(Bucket=self.bucket, Key=entry.s3_key)['Body'].read().decode('utf-8')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                LOG.warning(f'ocr_cache get digest={digest} e={e}')
+                return self._count('error', digest)
+            self._forget(entry)  # evicted from S3 before the index expired
+            return self._count('stale', digest)
+        try:
+            entry.update(actions=[self.entry_model.hits.add(1),
+                                  self.entry_model.lastHitAt.set(datetime.now())])
+        except Exception as e:
+            LOG.warning(f'ocr_cache hits digest={digest} e={e}')
+        self._count('hit', digest)
+        return entry.engine, text
+
+    def put(self, digest, engine, text):
+        """Cache the text an engine read from images with digest."""
+        body = text.encode('utf-8')
+        if len(body) > self.max_text_bytes:
+            self._count('too_big', digest)
+            return
+        key = f'{self.prefix}{digest}.txt'
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+            self.entry_model(digest, s3_key=key, engine=engine, size=len(body),
+                             expires=int(time()) + self.max_age_days * 86400).save()
+        except Exception as e:
+            LOG.warning(f'ocr_cache put digest={digest} e={e}')
+            self._count('error', digest)
+            return
+        self._count('put', digest)
+
+    def evict(self, now=None):
+        """Delete texts older than max_age_days, then the oldest until the cache fits max_bytes.
+
+        :returns: dict of counts and bytes kept and evicted
+        """
+        now = now or datetime.now(timezone.utc)
+        oldest = now - timedelta(days=self.max_age_days)
+        objects = []
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            objects.extend(page.get('Contents', []))
+        objects.sort(key=lambda obj: obj['LastModified'], reverse=True)  # newest first
+        keep, evict, kept_bytes = [], [], 0
+        for obj in objects:
+            if obj['LastModified'] >= oldest and kept_bytes + obj['Size'] <= self.max_bytes:
+                keep.append(obj)
+                kept_bytes += obj['Size']
+            else:
+                evict.append(obj)
+        for i in range(0, len(evict), 1000):  # DeleteObjects' limit
+            self.s3.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': obj['Key']} for obj in evict[i:i + 1000]], 'Quiet': True})
+        with self.entry_model.batch_write() as batch:
+            for obj in evict:
+                digest = obj['Key'][len(self.prefix):-len('.txt')]
+                batch.delete(self.entry_model(digest))
+        result = {'kept': len(keep), 'kept_bytes': kept_bytes,
+                  'evicted': len(evict), 'evicted_bytes': sum(obj['Size'] for obj in evict)}
+        LOG.info(f'ocr_cache evict {result}')
+        return result
+
+    def _forget(self, entry):
+        try:
+            entry.delete()
+        except Exception as e:
+            LOG.warning(f'ocr_cache forget digest={entry.digest} e={e}')
+
+    def _count(self, result, digest):
+        with self._lock:
+            self.counts[result] += 1
+            counts = dict(self.counts)
+        LOG.info(f'ocr_cache result={result} digest={digest} counts={counts}')
+        return None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def ocr_cache():
+    """The OcrCache configured by our environment, made on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = OcrCache(clients.s3(),
+                                bucket=os.environ.get('OCR_CACHE_BUCKET', os.environ.get('UPLOAD_BUCKET_NAME', '')),
+                                prefix=os.environ.get('OCR_CACHE_PREFIX', 'ocr_cache/'),
+                                max_age_days=int(os.environ.get('OCR_CACHE_DAYS', '30')),
+                                max_bytes=int(os.environ.get('OCR_CACHE_MAX_BYTES', str(10 * 1024 ** 3))))
+    return _default
+
+
+@timed
+def evict_ocr_cache(event, context):
+    """Evict old OCR cache texts, then the oldest until the cache fits OCR_CACHE_MAX_BYTES."""
+    return ocr_cache().evict()
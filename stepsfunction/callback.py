@@ -0,0 +1,56 @@
+"""WaitForOcr: hand the state's task token to the page OCR that finishes the document."""
+from json import dumps
+import logging
+
+import clients
+from metrics import tagged, timed
+from models import PDFUpload
+
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+
+@timed
+def wait_for_ocr(event, context):
+    """Store the WaitForOcr state's task token on the PDFUpload for the last OCRed page to return.
+
+    The state invokes us with .waitForTaskToken and waits until something
+    calls SendTaskSuccess with this token; the ocr_page that finishes the last
+    page does, without polling. If every page was OCRed before we got here,
+    nobody would find the token, so we send it ourselves.
+    Storing the token and setting status "ocred" are each one UpdateItem
+    returning the new item, so exactly one side sees both and sends.
+    """
+    LOG.info(f'event: {dumps(event)}')
+    with tagged(jid=event['jid']):
+        pdf_upload = PDFUpload.get(hash_key=event['jid'])
+        pdf_upload.update_with_log(
+            actions=[
+                PDFUpload.task_token.set(event['taskToken'])
+            ])
+        if pdf_upload.status == 'ocred':
+            LOG.info(f'jid={pdf_upload.uuid} was OCRed before WaitForOcr stored its token')
+            send_task_ocr_done(pdf_upload)
+
+
+def send_task_ocr_done(pdf_upload):
+    """After ocr's done, send task success with the token WaitForOcr stored on the PDFUpload."""
+    if not pdf_upload.task_token:
+        LOG.info(f'jid={pdf_upload.uuid} WaitForOcr has not stored its token yet, it will send success')
+        return
+    sf = clients.stepfunctions()
+    try:
+        res = sf.send_task_success(
+            taskToken=pdf_upload.task_token,
+            output=dumps({'jid': pdf_upload.uuid, 'num_pages': pdf_upload.num_pages,
+                          'status': pdf_upload.status})
+        )
+        LOG.info(f'sf.send_task_success={res}')
+    except Exception as e:
+        LOG.error(e)
+        # Go to FailTask here
+        sf.send_task_failure(taskToken=pdf_upload.task_token,
+                             error='CannotRecover',
+                             cause=f'We coud not recover')
+
@@ -0,0 +1,53 @@
+"""AWS clients, made the first time a function needs them rather than at import.
+
+A cold start then pays only for the clients its function calls: GetUploadUrl
+never builds Textract or Step Functions clients. Each is made once per
+container and shared by every thread; boto3 does not make clients safely
+from several threads at once, so making them is serialized.
+"""
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Shared by the split upload and batch OCR threads, so its connection pool should cover them
+S3_POOL_CONNECTIONS = int(os.environ.get('S3_POOL_CONNECTIONS', '50'))
+
+# DynamoDB Local when testing, where the models' Meta.host points
+DYNAMODB_ENDPOINT = 'http://localhost:8000' if 'ENV' in os.environ else None
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def _client(name, make):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = make()
+    return client
+
+
+def s3():
+    return _client('s3', lambda: boto3.client(
+        's3', config=Config(max_pool_connections=S3_POOL_CONNECTIONS, retries={'max_attempts': 5})))
+
+
+def textract():
+    return _client('textract', lambda: boto3.client(
+        service_name='textract',
+        region_name='us-east-1',
+        endpoint_url='https://textract.us-east-1.amazonaws.com',
+    ))
+
+
+def stepfunctions():
+    return _client('stepfunctions', lambda: boto3.client('stepfunctions'))
+
+
+def dynamodb():
+    return _client('dynamodb', lambda: boto3.client(
+        'dynamodb', region_name=os.environ.get('REGION'), endpoint_url=DYNAMODB_ENDPOINT))
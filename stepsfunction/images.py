@@ -0,0 +1,109 @@
+"""Find the JPEG images of a PDF page scan through its XObjects."""
+from collections import OrderedDict, namedtuple
+
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import ArrayObject, StreamObject
+from PyPDF2.pdf import ContentStream
+
+from metrics import measure
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+# An image on a page: data is a memoryview of its JPEG bytes, placement a matrix or None
+PageImage = namedtuple('PageImage', ['data', 'width', 'height', 'placement'])
+
+
+def extract_images_from_pdf(pdf, page_num=0):
+    """Return the JPEG images of a PDF page scan, in the order the page draws them.
+
+    Instead of scanning the bytes for JPEG markers, read the page's
+    /XObject resources with PdfFileReader, so every DCTDecode image is found,
+    such as a scan stored as several strips, and nothing else is mistaken
+    for one. Each image's data is a memoryview slice of pdf, not a copy;
+    its placement is the transformation matrix (a, b, c, d, e, f) the
+    content stream draws it with, mapping the unit square to the page in
+    points, or None if the page never draws it.
+    No coversion involved so faster than GhostScript or ImageMagick,
+    and also no loss due to conversion.
+
+    Measured as image_extract, of which reading the page is pdf_parse.
+
+    :params: pdf bytes of the PDF, page_num the page to look at
+    :returns: list of PageImage
+    """
+    with measure('image_extract', bytes=len(pdf)):
+        with measure('pdf_parse'):
+            reader = PdfFileReader(pdf, strict=False)  # read in place, streams are slices of pdf
+            page = reader.getPage(page_num)
+        images = OrderedDict()  # ref -> PageImage
+        placements = []         # (ref, matrix) in drawing order
+        _find_images(reader, page, page.get('/Resources'), IDENTITY, images, placements, set())
+    drawn = []
+    for ref, matrix in placements:
+        drawn.append(images[ref]._replace(placement=matrix))
+    drawn_refs = set(ref for ref, _matrix in placements)
+    drawn.extend(image for ref, image in images.items() if ref not in drawn_refs)
+    if not drawn:
+        raise Exception(f"Could not find a JPEG image in PDF of {len(pdf)} bytes")
+    return drawn
+
+
+def _find_images(reader, content, resources, ctm, images, placements, forms):
+    """Walk a page or form XObject's content stream, collecting the DCTDecode images it draws."""
+    xobjects = resources.getObject().get('/XObject') if resources else None
+    xobjects = xobjects.getObject() if xobjects else {}
+    for name in xobjects:
+        ref = xobjects.raw_get(name)
+        key = (ref.idnum, ref.generation)  # XObjects are streams, so always indirect
+        if key not in images:
+            image = _jpeg_image(ref)
+            if image is not None:
+                images[key] = image
+    contents = content if isinstance(content, StreamObject) else content.get('/Contents')
+    if contents is None:
+        return
+    stack = []
+    for operands, operator in ContentStream(contents, reader).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q' and stack:
+            ctm = stack.pop()
+        elif operator == b'cm':
+            ctm = _multiply([float(n) for n in operands], ctm)
+        elif operator == b'Do' and operands and operands[0] in xobjects:
+            ref = xobjects.raw_get(operands[0])
+            key = (ref.idnum, ref.generation)
+            if key in images:
+                placements.append((key, ctm))
+                continue
+            xobject = ref.getObject()
+            if xobject.get('/Subtype') == '/Form' and key not in forms:
+                forms.add(key)  # a form drawing itself would never end
+                matrix = [float(n) for n in xobject.get('/Matrix', IDENTITY)]
+                _find_images(reader, xobject, xobject.get('/Resources', resources),
+                             _multiply(matrix, ctm), images, placements, forms)
+
+
+def _jpeg_image(ref):
+    """Return a PageImage of the XObject if it's a JPEG image, else None."""
+    xobject = ref.getObject()
+    if xobject.get('/Subtype') != '/Image':
+        return None
+    filters = xobject.get('/Filter')
+    if isinstance(filters, ArrayObject):
+        filters = filters[0] if len(filters) == 1 else None
+    if filters != '/DCTDecode':
+        return None
+    # a slice of the PDF, unless decrypting made it a copy
+    data = memoryview(xobject._data)
+    return PageImage(data=data, width=int(xobject['/Width']), height=int(xobject['/Height']),
+                     placement=None)
+
+
+def _multiply(m, n):
+    """Multiply PDF transformation matrices, m then n."""
+    return (m[0] * n[0] + m[1] * n[2],
+            m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2],
+            m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4],
+            m[4] * n[1] + m[5] * n[3] + n[5])
@@ -0,0 +1,134 @@
+"""Time the stages of our handlers, emitting CloudWatch embedded metric format (EMF) lines.
+
+Each measurement is one JSON line on stdout, which CloudWatch Logs turns
+into a `seconds` metric of our NAMESPACE with the dimensions function and
+stage, without any PutMetricData calls. The jid and page it was for are
+properties of the line, not dimensions, so they can be searched with Logs
+Insights without making a metric per document:
+    {"_aws": {...}, "function": "OcrPage", "stage": "s3_get", "seconds": 0.08, "jid": "...", "page": 3}
+
+Handlers are wrapped with @timed, and stages inside them with
+`with measure('s3_get', jid=jid, page=page_num):`. tagged(jid=..., page=...)
+tags every measurement its thread makes inside it, so helpers need not be
+passed the jid; threads of a pool don't inherit tags.
+METRICS=off disables measuring: measure returns a shared object that does
+nothing and @timed calls straight through. Tests collect the records with
+use(LocalSink()) instead of printing them.
+"""
+from json import dumps
+import os
+import sys
+import threading
+from functools import wraps
+from time import time
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'stepsfunction')
+FUNCTION = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+_tags = threading.local()
+
+
+def emf_sink(record):
+    """Print a measurement as an EMF line."""
+    sys.stdout.write(dumps(record) + '\n')
+
+
+class LocalSink(list):
+    """Keep measurements in a list rather than print them, for tests and benchmarks."""
+
+    def __call__(self, record):
+        self.append(record)
+
+    def stages(self):
+        return [record['stage'] for record in self]
+
+
+_sink = emf_sink if os.environ.get('METRICS', 'emf') != 'off' else None
+
+
+def use(sink):
+    """Send measurements to sink(record), or nowhere if None; return the sink used before."""
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+class _Measurement(object):
+
+    def __init__(self, stage, tags):
+        self.stage = stage
+        self.tags = tags
+
+    def set(self, **properties):
+        """Add properties, such as a size in bytes, to the measurement's line."""
+        self.tags.update(properties)
+
+    def __enter__(self):
+        self.t_0 = time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time() - self.t_0
+        sink = _sink
+        if sink is None:
+            return
+        record = dict(getattr(_tags, 'tags', {}), **self.tags)
+        record.update({
+            '_aws': {'Timestamp': int(self.t_0 * 1000),
+                     'CloudWatchMetrics': [{'Namespace': NAMESPACE,
+                                            'Dimensions': [['function', 'stage']],
+                                            'Metrics': [{'Name': 'seconds', 'Unit': 'Seconds'}]}]},
+            'function': FUNCTION, 'stage': self.stage, 'seconds': seconds})
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        sink(record)
+
+
+class _Disabled(object):
+
+    def set(self, **properties):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_DISABLED = _Disabled()
+
+
+def measure(stage, **tags):
+    """Context manager timing a stage, tagged with tags and those of the thread's tagged()."""
+    if _sink is None:
+        return _DISABLED
+    return _Measurement(stage, tags)
+
+
+class tagged(object):
+    """Context manager adding tags, such as jid and page, to the measurements of this thread."""
+
+    def __init__(self, **tags):
+        self.tags = tags
+
+    def __enter__(self):
+        self.outer = getattr(_tags, 'tags', {})
+        _tags.tags = dict(self.outer, **self.tags)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _tags.tags = self.outer
+
+
+def timed(function):
+    """Decorator measuring every call of a handler as the stage named after it."""
+    stage = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if _sink is None:
+            return function(*args, **kwargs)
+        with _Measurement(stage, {}):
+            return function(*args, **kwargs)
+    return wrapper
@@ -1,20 +1,33 @@
 """Use PynamoDB lib to define DynamoDB's tables."""
 
 import os
+import random
+import time
 from datetime import datetime
 
+from botocore.exceptions import ClientError
 from pynamodb.attributes import (
-    ListAttribute,
-    MapAttribute,
     NumberAttribute,
     UTCDateTimeAttribute,
     UnicodeAttribute
 )
 
+from pynamodb.constants import ATTR_TYPE_MAP
+from pynamodb.exceptions import PutError
+from pynamodb.expressions.update import Update
 from pynamodb.models import Model
 
 import logging
 
+import clients
+from metrics import measure
+
+# Pages counted per TransactWriteItems, each with the PDFUpload's counter in the same transaction
+TRANSACT_PAGES = int(os.environ.get('TRANSACT_PAGES', '24'))
+# Tries of a write that conflicts with another transaction on the same item, backing off with jitter
+CONFLICT_TRIES = int(os.environ.get('CONFLICT_TRIES', '8'))
+CONFLICT_BACKOFF = float(os.environ.get('CONFLICT_BACKOFF', '0.05'))
+
 
 class MVPDateTime(UTCDateTimeAttribute):
     """Handle when UTCDateTimeAttribute's value is empty.
@@ -31,15 +44,22 @@ class MVPDateTime(UTCDateTimeAttribute):
         return super(MVPDateTime, self).deserialize(value)
 
 
-class SinglePage(MapAttribute):
-    """Page."""
+class PDFUpload(Model):
+    """Mapping to DynamoDB - PDFUpload table.
 
-    page_id = UnicodeAttribute()
-    file_path = UnicodeAttribute()
+    One item per document, holding only its summary and counters: the pages
+    are PDFPage items, so the item, and the cost of writing it, stays the
+    same size whatever the page count.
 
+    Changes go through queue() and commit(): one UpdateItem per commit,
+    conditional on the version we read, so concurrent writers can't
+    silently overwrite each other. Only OCR's ADDs to pages_done skip it,
+    they don't depend on what was there.
 
-class PDFUpload(Model):
-    """Mapping to DynamoDB - PDFUpload table."""
+    PynamoDB 3 has no transactions, so counting pages and the commits that
+    race with it are made with the boto3 DynamoDB client (clients.dynamodb),
+    their expressions serialized by PynamoDB, see _update_item.
+    """
 
     class Meta:
         """Describe PDFUpload's meta data."""
@@ -56,10 +76,18 @@ class PDFUpload(Model):
     status = UnicodeAttribute(null=True)
     desired_filename = UnicodeAttribute(null=False)
     num_pages = NumberAttribute(null=True)
-    pages = ListAttribute(of=SinglePage)
+    pages_done = NumberAttribute(null=True)
+    task_token = UnicodeAttribute(null=True)  # WaitForOcr's, for SendTaskSuccess
+    source_jid = UnicodeAttribute(null=True)  # same bytes as this earlier upload, whose page text we use
     filename = UnicodeAttribute(null=True)
     createdAt = UTCDateTimeAttribute(null=False, default=datetime.now())
     updatedAt = MVPDateTime(null=True)
+    version = NumberAttribute(null=True)  # ADDed 1 by every commit, which is conditional on it
+
+    def __init__(self, hash_key=None, range_key=None, **attributes):
+        """Start with no queued actions."""
+        super(PDFUpload, self).__init__(hash_key, range_key, **attributes)
+        self._pending = []
 
     def __iter__(self):
         """Iterator method."""
@@ -76,16 +104,164 @@ class PDFUpload(Model):
         else:
             return result
 
+    def save_if_new(self):
+        """Save unless an item with our uuid exists; return True if we saved."""
+        try:
+            self.save(condition=PDFUpload.uuid.does_not_exist())
+        except PutError as exc:
+            if _is_condition_failure(exc):
+                return False
+            logging.error("Saving PDFUpload|PDFUpload: {}|Error: {}".format(self, exc))
+            raise
+        return True
+
     def update_with_log(self, actions=None):
-        """Function update with logging."""
+        """Commit actions, with anything queued before, with logging."""
         try:
-            result = self.update(actions=actions)
+            return self.queue(*(actions or [])).commit()
         except Exception as exc:
             logging.error("Updating PDFUpload|PDFUpload: {}|Updates: {}|Error: {}".format(
                 self, actions, exc))
             raise
-        else:
-            return result
+
+    def queue(self, *actions):
+        """Hold update actions for the next commit(), so an invocation's changes are one UpdateItem."""
+        self._pending.extend(actions)
+        return self
+
+    def commit(self, check=None):
+        """Send the queued actions in one UpdateItem, on condition nobody committed since we read the item.
+
+        The UpdateItem ADDs 1 to version and sets updatedAt too. If another
+        commit got in first, we read the item again and retry after a
+        jittered backoff; check(self), called with what we read before each
+        try, can return False to drop the actions instead, say when the
+        status moved on. A transaction counting pages on the item at the same
+        time is retried the same way. Returns True if the actions were written;
+        raises PDFUpload.DoesNotExist if there is no item to write them to.
+        """
+        for attempt in range(CONFLICT_TRIES):
+            if check is not None and not check(self):
+                self._pending = []
+                return False
+            if not self._pending:
+                return False
+            # the item must exist too: an UpdateItem alone would create one with no num_pages
+            read = PDFUpload.uuid.exists() & (
+                PDFUpload.version.does_not_exist() if self.version is None else PDFUpload.version == self.version)
+            try:
+                with measure('dynamodb_update', jid=self.uuid):
+                    item = clients.dynamodb().update_item(ReturnValues='ALL_NEW', **_update_item(
+                        PDFUpload, {'uuid': self.uuid},
+                        self._pending + [PDFUpload.version.add(1), PDFUpload.updatedAt.set(datetime.now())],
+                        condition=read))['Attributes']
+                self._set_item(item)
+                self._pending = []
+                return True
+            except ClientError as exc:
+                code = _error_code(exc)
+                if code not in ('ConditionalCheckFailedException', 'TransactionConflictException') or \
+                        attempt == CONFLICT_TRIES - 1:
+                    raise
+            logging.info("Commit conflict|PDFUpload: {}|version: {}|code: {}".format(self.uuid, self.version, code))
+            if code == 'ConditionalCheckFailedException':
+                self.reread()
+            _backoff(attempt)
+
+    def reread(self):
+        """Read our item again, consistently; unlike refresh() it works on a PDFUpload(jid) too."""
+        item = clients.dynamodb().get_item(TableName=PDFUpload.Meta.table_name, ConsistentRead=True,
+                                           Key=_key(PDFUpload, {'uuid': self.uuid})).get('Item')
+        if item is None:
+            raise PDFUpload.DoesNotExist()
+        self._set_item(item)
+
+    def _set_item(self, item):
+        """Set our attributes to those of an item as DynamoDB returns it."""
+        item = PDFUpload.from_raw_data(dict(item))
+        for name in self.get_attributes():
+            setattr(self, name, getattr(item, name))
+
+    def mark_page_done(self, page_num, text_path=None):
+        """Count page_num as OCRed, atomically; return True if we finished the document.
+
+        One transaction sets the PDFPage's status to ocred, on condition it
+        wasn't yet, and ADDs 1 to our pages_done: S3 and Lambda deliver at
+        least once, so a retried page is rejected instead of counted twice.
+        Both items are the same size for every page, so is the write.
+        """
+        return self.mark_pages_done([page_num], {page_num: text_path} if text_path else None)
+
+    def mark_pages_done(self, page_nums, text_paths=None):
+        """Count a batch of pages as OCRed; return True if we finished the document.
+
+        Pages go TRANSACT_PAGES to a transaction, like mark_page_done. If a
+        transaction is cancelled because some of its pages were already
+        counted, a redelivered batch, we count its pages one at a time so the
+        new ones still count once.
+        Then, counted or not, we check if every page is: a caller that
+        counted the last page and died before finishing the document gets
+        another chance when its page is retried.
+        """
+        page_nums = sorted(set(page_nums))
+        text_paths = text_paths or {}
+        for i in range(0, len(page_nums), TRANSACT_PAGES):
+            batch = page_nums[i:i + TRANSACT_PAGES]
+            if not self._count_pages(batch, text_paths) and len(batch) > 1:
+                logging.warning("Pages partly done|PDFUpload: {}|page_nums: {}".format(self.uuid, batch))
+                for page_num in batch:
+                    self._count_pages([page_num], text_paths)
+        return self._finish_if_done()
+
+    def _count_pages(self, page_nums, text_paths):
+        """Mark pages ocred and ADD them to pages_done in one transaction; return False if one was done.
+
+        Every transaction updates our item, so concurrent ones conflict and
+        are cancelled. The error doesn't say which item failed why, so we
+        read the pages back: if none was done we try again after a jittered
+        backoff.
+        """
+        now = datetime.now()
+        items = []
+        for page_num in page_nums:
+            actions = [PDFPage.status.set('ocred'), PDFPage.updatedAt.set(now)]
+            if text_paths.get(page_num):
+                actions.append(PDFPage.text_path.set(text_paths[page_num]))
+            # the page must exist: split writes it, and an Update alone would create it without its file_path
+            items.append({'Update': _update_item(
+                PDFPage, {'uuid': self.uuid, 'page_id': page_num}, actions,
+                condition=PDFPage.uuid.exists() & (PDFPage.status.does_not_exist() | (PDFPage.status != 'ocred')))})
+        items.append({'Update': _update_item(
+            PDFUpload, {'uuid': self.uuid}, [PDFUpload.pages_done.add(len(page_nums)), PDFUpload.updatedAt.set(now)])})
+        for attempt in range(CONFLICT_TRIES):
+            try:
+                with measure('dynamodb_update', jid=self.uuid, pages=len(page_nums)):
+                    clients.dynamodb().transact_write_items(TransactItems=items)
+                return True
+            except ClientError as exc:
+                if _error_code(exc) != 'TransactionCanceledException' or attempt == CONFLICT_TRIES - 1:
+                    logging.error("Marking pages done|PDFUpload: {}|page_nums: {}|Error: {}".format(
+                        self.uuid, page_nums, exc))
+                    raise
+            statuses = PDFPage.statuses(self.uuid, page_nums)
+            missing = [page_num for page_num in page_nums if page_num not in statuses]
+            if missing:
+                logging.error("Pages missing|PDFUpload: {}|page_nums: {}".format(self.uuid, missing))
+                raise PDFPage.DoesNotExist("PDFPage {} {} does not exist".format(self.uuid, missing))
+            if 'ocred' in statuses.values():
+                if len(page_nums) == 1:
+                    logging.warning("Page already done|PDFUpload: {}|page_num: {}".format(self.uuid, page_nums[0]))
+                return False
+            _backoff(attempt)
+
+    def _finish_if_done(self):
+        """Commit status ocred if every page is counted and it wasn't ocred; return True if we did.
+
+        However many callers see the last count, only one commit changes the
+        status: the others conflict, read it again and drop theirs.
+        """
+        self.reread()
+        return self.queue(PDFUpload.status.set('ocred')).commit(check=_all_pages_done)
 
     @classmethod
     def get_with_log(cls, hash_key, range_key=None):
@@ -100,3 +276,236 @@ class PDFUpload(Model):
             raise
         else:
             return result
+
+
+class PDFPage(Model):
+    """Mapping to DynamoDB - PDFPage table, one item per page of a PDFUpload.
+
+    SplitPdf writes a document's pages with BatchWriteItem before their
+    PDFs go to S3, and OCR sets each one ocred as it counts it (see
+    PDFUpload.mark_pages_done). Query a document's pages in page order
+    with PDFPage.query(jid), which pages through any number of them.
+    """
+
+    class Meta:
+        """Describe PDFPage's meta data."""
+
+        if 'ENV' in os.environ:
+            table_name = 'PDFPage'
+            host = 'http://localhost:8000'
+        else:  # pragma: no cover
+            table_name = os.environ['PDFPAGE_TABLE']
+            region = os.environ['REGION']
+            host = 'https://dynamodb.' + region + '.amazonaws.com'
+
+    uuid = UnicodeAttribute(hash_key=True)  # the PDFUpload's
+    page_id = NumberAttribute(range_key=True)  # 0-based page number
+    file_path = UnicodeAttribute()  # page_pdf/jid/0000.pdf
+    status = UnicodeAttribute(default='split')  # split, then ocred
+    text_path = UnicodeAttribute(null=True)  # page_pdf/jid/0000_<engine>.txt
+    createdAt = UTCDateTimeAttribute(null=False, default=datetime.now)
+    updatedAt = MVPDateTime(null=True)
+
+    @classmethod
+    def save_pages(cls, jid, page_nums, file_paths):
+        """Write the items of a document's pages that don't exist yet; return how many we wrote.
+
+        BatchWriteItem can't be conditional, so we first Query the pages' range
+        for those a previous try wrote, which OCR may have set ocred since.
+        """
+        page_nums = sorted(page_nums)
+        if not page_nums:
+            return 0
+        existing = {page.page_id for page in cls.query(
+            jid, range_key_condition=cls.page_id.between(page_nums[0], page_nums[-1]),
+            consistent_read=True, attributes_to_get=['uuid', 'page_id'])}
+        new = [page_num for page_num in page_nums if page_num not in existing]
+        with cls.batch_write() as batch:
+            for page_num in new:
+                batch.save(cls(jid, page_num, file_path=file_paths[page_num]))
+        return len(new)
+
+    @classmethod
+    def statuses(cls, jid, page_nums):
+        """Return {page_num: status} of those of a document's pages that exist, reading them consistently."""
+        page_nums = set(page_nums)
+        return {page.page_id: page.status for page in cls.query(
+            jid, range_key_condition=cls.page_id.between(min(page_nums), max(page_nums)),
+            consistent_read=True, attributes_to_get=['uuid', 'page_id', 'status'])
+            if page.page_id in page_nums}
+
+
+class OcrEngineStats(Model):
+    """Mapping to DynamoDB - OCREngineStats table.
+
+    One item per OCR engine per UTC hour, holding sums that containers ADD
+    their observations to, so any container can total the last hours
+    and fit the engine's latency (see router.OcrRouter).
+    The sums are for a least squares fit of seconds on x1, megapixels,
+    and x2, JPEG megabytes.
+    """
+
+    class Meta:
+        """Describe OcrEngineStats' meta data."""
+
+        if 'ENV' in os.environ:
+            table_name = 'OCREngineStats'
+            host = 'http://localhost:8000'
+        else:  # pragma: no cover
+            table_name = os.environ['OCR_STATS_TABLE']
+            region = os.environ['REGION']
+            host = 'https://dynamodb.' + region + '.amazonaws.com'
+
+    engine = UnicodeAttribute(hash_key=True)
+    window = UnicodeAttribute(range_key=True)  # UTC hour, 2019-08-23T14
+    n = NumberAttribute(default=0)
+    errors = NumberAttribute(default=0)
+    cost = NumberAttribute(default=0)
+    x1 = NumberAttribute(default=0)
+    x2 = NumberAttribute(default=0)
+    y = NumberAttribute(default=0)
+    x1x1 = NumberAttribute(default=0)
+    x1x2 = NumberAttribute(default=0)
+    x2x2 = NumberAttribute(default=0)
+    x1y = NumberAttribute(default=0)
+    x2y = NumberAttribute(default=0)
+    expires = NumberAttribute(null=True)  # epoch seconds, the table's TTL attribute
+    updatedAt = MVPDateTime(null=True)
+
+    SUMS = ('n', 'errors', 'cost', 'x1', 'x2', 'y', 'x1x1', 'x1x2', 'x2x2', 'x1y', 'x2y')
+
+    def add_sums(self, sums, expires):
+        """ADD sums, {name: number}, to this window's item, creating it if need be."""
+        actions = [getattr(OcrEngineStats, name).add(value) for name, value in sums.items() if value]
+        actions.append(OcrEngineStats.expires.set(expires))
+        actions.append(OcrEngineStats.updatedAt.set(datetime.now()))
+        try:
+            return self.update(actions=actions)
+        except Exception as exc:
+            logging.error("Adding OcrEngineStats|engine: {}|window: {}|Error: {}".format(
+                self.engine, self.window, exc))
+            raise
+
+    @classmethod
+    def get_sums(cls, engine, since):
+        """Return the sums of an engine's windows since a window, {name: number}."""
+        totals = dict.fromkeys(cls.SUMS, 0)
+        for stats in cls.query(engine, range_key_condition=cls.window >= since):
+            for name in cls.SUMS:
+                totals[name] += getattr(stats, name) or 0
+        return totals
+
+
+class OcrCacheEntry(Model):
+    """Mapping to DynamoDB - OCRCache table, the index of OCR text cached in S3 (see cache.OcrCache)."""
+
+    class Meta:
+        """Describe OcrCacheEntry's meta data."""
+
+        if 'ENV' in os.environ:
+            table_name = 'OCRCache'
+            host = 'http://localhost:8000'
+        else:  # pragma: no cover
+            table_name = os.environ['OCR_CACHE_TABLE']
+            region = os.environ['REGION']
+            host = 'https://dynamodb.' + region + '.amazonaws.com'
+
+    digest = UnicodeAttribute(hash_key=True)  # SHA-256 of the page's image bytes
+    s3_key = UnicodeAttribute()
+    engine = UnicodeAttribute()
+    size = NumberAttribute()
+    hits = NumberAttribute(default=0)
+    expires = NumberAttribute()  # epoch seconds, the table's TTL attribute
+    createdAt = UTCDateTimeAttribute(null=False, default=datetime.now)
+    lastHitAt = MVPDateTime(null=True)
+
+
+class DocDigest(Model):
+    """Mapping to DynamoDB - DocDigest table, the upload that first brought in a document's bytes.
+
+    Each document has an item keyed by its streamed SHA-256, sha256:<hex>,
+    and one per S3 ETag and size it was uploaded with, etag:<etag>:<size>,
+    which lets uploaded() skip hashing bytes it has seen before.
+    """
+
+    class Meta:
+        """Describe DocDigest's meta data."""
+
+        if 'ENV' in os.environ:
+            table_name = 'DocDigest'
+            host = 'http://localhost:8000'
+        else:  # pragma: no cover
+            table_name = os.environ['DOC_DIGEST_TABLE']
+            region = os.environ['REGION']
+            host = 'https://dynamodb.' + region + '.amazonaws.com'
+
+    digest = UnicodeAttribute(hash_key=True)
+    jid = UnicodeAttribute()
+    sha256 = UnicodeAttribute()
+    size = NumberAttribute()
+    createdAt = UTCDateTimeAttribute(null=False, default=datetime.now)
+
+    @classmethod
+    def get_or_none(cls, digest):
+        """Return the DocDigest for digest, or None if there is none."""
+        try:
+            return cls.get(digest)
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def claim(cls, digest, jid, sha256, size):
+        """Save a DocDigest for jid unless digest has one; return the one that was there, or None."""
+        doc_digest = cls(digest, jid=jid, sha256=sha256, size=size)
+        try:
+            doc_digest.save(condition=cls.digest.does_not_exist())
+        except PutError as exc:
+            if not _is_condition_failure(exc):
+                logging.error("Claiming DocDigest|digest: {}|jid: {}|Error: {}".format(digest, jid, exc))
+                raise
+            return cls.get(digest, consistent_read=True)
+        return None
+
+
+def _all_pages_done(upload):
+    return upload.num_pages is not None and (upload.pages_done or 0) >= upload.num_pages and \
+        upload.status != 'ocred'
+
+
+def _key(model, key):
+    """Return the Key of a model's item, {attribute name: value}, as DynamoDB takes it."""
+    attributes = [(getattr(model, name), value) for name, value in key.items()]
+    return {attribute.attr_name: {ATTR_TYPE_MAP[attribute.attr_type]: attribute.serialize(value)}
+            for attribute, value in attributes}
+
+
+def _update_item(model, key, actions, condition=None):
+    """Return the arguments of an UpdateItem, or a TransactWriteItems Update, of a model's item.
+
+    The actions and condition are serialized with PynamoDB's expressions,
+    for the boto3 client.
+    """
+    names, values = {}, {}
+    update = {'TableName': model.Meta.table_name,
+              'Key': _key(model, key),
+              'UpdateExpression': Update(*actions).serialize(names, values)}
+    if condition is not None:
+        update['ConditionExpression'] = condition.serialize(names, values)
+    update['ExpressionAttributeNames'] = {placeholder: name for name, placeholder in names.items()}
+    update['ExpressionAttributeValues'] = values
+    return update
+
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, CONFLICT_BACKOFF * 2 ** attempt))
+
+
+def _error_code(exc):
+    """Return the DynamoDB error code of a botocore or PynamoDB error."""
+    response = getattr(getattr(exc, 'cause', None) or exc, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+
+def _is_condition_failure(exc):
+    """Tell if a PynamoDB error was caused by the request's condition being false."""
+    return _error_code(exc) == 'ConditionalCheckFailedException'
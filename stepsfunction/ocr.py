@@ -0,0 +1,276 @@
+"""OcrPage and OcrPages: OCR single-page PDFs and count them done."""
+from json import dumps, loads
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import boto3
+import botocore
+from botocore.exceptions import ClientError
+
+import clients
+from cache import OcrCache, ocr_cache
+from callback import send_task_ocr_done
+from images import extract_images_from_pdf
+from metrics import measure, tagged, timed
+from models import PDFUpload
+from records import process_records
+from router import default_router
+
+
+def _vcpus():
+    """Number of CPUs we may run on; Lambda gives more of them to bigger memory sizes."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+# Batch OCR runs one single-threaded tesseract process per vCPU
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', '0')) or _vcpus()
+
+# setting for tesseract
+TESSERACT_BIN = './tesseract/bin/tesseract'
+TESSERACT_DATA = './tesseract/share/tessdata'
+TESSERACT_LIB = './tesseract/lib'
+os.environ['LD_LIBRARY_PATH'] = ':'.join([os.environ.get('LD_LIBRARY_PATH', ''), TESSERACT_LIB])
+
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+
+@timed
+def ocr_page(event, context):
+    """Get PDF pages from S3, convert to image and tesseract txt to page_txt/jid/0000.txt.
+
+    Every record of the event is a page, OCRed concurrently, see process_records.
+    A page whose images we have OCRed before gets its text from ocr_cache().
+
+    After saving each page, we count it as done in DynamoDB with an atomic,
+    conditional transaction (PDFUpload.mark_page_done), which tells exactly
+    one invocation that it finished the last page. That one sends a notification
+    to the WaitForOcr state to release it.
+    The notification returns the task token WaitForOcr stored on the PDFUpload,
+    see wait_for_ocr.
+    """
+    LOG.info(f'event: {dumps(event)}')
+    LOG.info(f'boto3 version: {boto3.__version__} botocore version: {botocore.__version__}')
+    return process_records(event, ocr_page_record, workers=OCR_WORKERS)
+
+
+def ocr_page_record(s3rec):
+    """OCR one page of an ocr_page event, see ocr_page; safe to run again for the same page."""
+    bucket = s3rec['bucket']['name']
+    key = s3rec['object']['key']
+    _doc_pdf, jid, name_pdf = key.split('/')
+    page_num = int(name_pdf[:4])
+    LOG.info(f'bucket={bucket} key={key} jid={jid} name_pdf={name_pdf}')
+
+    with tagged(jid=jid, page=page_num):
+        # Everything stays in memory, nothing in /tmp, so pages can be OCRed concurrently
+        images = extract_images_from_pdf(get_s3_bytes(bucket, key))
+        type, detected_text = ocr_cached(images, ocr_routed)
+
+        s3_ocred_file_path = write_textract_to_s3(detected_text, bucket, key, type=type)
+        LOG.info(f'ocr_page wrote {s3_ocred_file_path}')
+        pdf_upload = PDFUpload(jid)
+        if pdf_upload.mark_page_done(page_num, text_path=s3_ocred_file_path):
+            # we finished the document, and only one invocation sees that
+            send_task_ocr_done(pdf_upload)
+
+
+@timed
+def ocr_pages(event, context):
+    """OCR a batch of page_pdf/jid/0000.pdf pages with the engine the router picks, and check for all-done.
+
+    Unlike ocr_page, which pays Lambda and tesseract startup for every page,
+    this takes many pages per invocation, either as an SQS batch whose
+    message bodies are S3 event notifications, or as a Map state ItemBatcher
+    batch: {"Items": [{"bucket": ..., "key": ...}, ...]}.
+    The pages are OCRed on OCR_WORKERS threads with the engine the router
+    picks, tesseract pages each in its own single-threaded process, and each
+    document's pages are counted with a DynamoDB transaction per TRANSACT_PAGES
+    instead of one per page.
+    If pages fail we count the others first. From SQS we then return the
+    messages of the failed pages as batchItemFailures, so only those are
+    delivered again; a Map state batch raises, and is retried whole. Pages
+    already counted are ignored the second time.
+    """
+    LOG.info(f'event: {dumps(event)}')
+    pages = batch_page_keys(event)
+    LOG.info(f'ocr_pages pages={len(pages)} workers={OCR_WORKERS}')
+    t_0 = time()
+    results = ocr_batch([(bucket, key) for bucket, key, _message_id in pages])
+    LOG.info(f'ocr_pages pages={len(pages)} ocr_seconds={time() - t_0}')
+
+    done = {}
+    failed = []
+    for (bucket, key, message_id), result in zip(pages, results):
+        if isinstance(result, Exception):
+            failed.append((key, message_id))
+            continue
+        _doc_pdf, jid, name_pdf = key.split('/')
+        done.setdefault(jid, {})[int(name_pdf[:4])] = result
+    for jid, text_paths in done.items():
+        pdf_upload = PDFUpload(jid)
+        if pdf_upload.mark_pages_done(list(text_paths), text_paths):
+            send_task_ocr_done(pdf_upload)
+    if failed and not all(message_id for _key, message_id in failed):
+        raise RuntimeError(f'ocr_pages failed pages={[key for key, _message_id in failed]}')
+    if failed:
+        LOG.error(f'ocr_pages failed pages={[key for key, _message_id in failed]}')
+    return {'pages': len(pages), 'jids': sorted(done),
+            'batchItemFailures': [{'itemIdentifier': message_id}
+                                  for message_id in sorted({message_id for _key, message_id in failed})]}
+
+
+def batch_page_keys(event):
+    """Return (bucket, key, SQS messageId or None) of every page in an SQS or Map state batch event."""
+    if 'Items' in event:
+        return [(item['bucket'], item['key'], None) for item in event['Items']]
+    pages = []
+    for record in event['Records']:
+        if 's3' not in record:
+            # an SQS message whose body is an S3 event notification; s3:TestEvent has no Records
+            message_id = record['messageId']
+            pages.extend((r['s3']['bucket']['name'], r['s3']['object']['key'], message_id)
+                         for r in loads(record['body']).get('Records', []))
+        else:
+            pages.append((record['s3']['bucket']['name'], record['s3']['object']['key'], None))
+    return pages
+
+
+def ocr_batch(pages, workers=None):
+    """OCR (bucket, key) page PDFs concurrently with tesseract, write each page's text to S3.
+
+    :params: pages list of (bucket, key), workers default OCR_WORKERS, each OCRing with ocr_routed
+    :returns: a list parallel to pages, the text key written for each page done or the exception it raised
+    """
+    # tesseract's OpenMP threads would fight each other for the vCPUs
+    env = dict(os.environ, OMP_THREAD_LIMIT='1')
+
+    def _ocr(page):
+        bucket, key = page
+        _doc_pdf, jid, name_pdf = key.split('/')
+        try:
+            with tagged(jid=jid, page=int(name_pdf[:4])):
+                images = extract_images_from_pdf(get_s3_bytes(bucket, key))
+                type, text = ocr_cached(images, lambda images: ocr_routed(images, env=env))
+                return write_textract_to_s3(text, bucket, key, type=type)
+        except Exception as e:
+            LOG.exception(f'ocr_batch bucket={bucket} key={key}')
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers or OCR_WORKERS) as pool:
+        return list(pool.map(_ocr, pages))
+
+
+def get_s3_bytes(bucket, key):
+    """Read an object from S3 into memory, return as bytes."""
+    LOG.info(f'get_s3_bytes bucket={bucket} key={key}')
+    try:
+        with measure('s3_get') as measurement:
+            body = clients.s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+            measurement.set(bytes=len(body))
+        return body
+    except ClientError as e:
+        LOG.error(f'get_s3_bytes bucket={bucket} key={key} e.response={e.response}')
+        raise
+
+
+def ocr_cached(images, ocr):
+    """Return (type, text) of a page from the OCR cache, or from ocr(images), caching its result."""
+    digest = OcrCache.digest(images)
+    cached = ocr_cache().get(digest)
+    if cached is not None:
+        return cached
+    type, text = ocr(images)
+    ocr_cache().put(digest, type, text)
+    return type, text
+
+
+def ocr_routed(images, router=None, env=None):
+    """OCR a page's images with the best engine the router ranks, falling back to the next on errors.
+
+    :returns: (type, text), type being the engine that read the page
+    """
+    router = router or default_router()
+    engines = router.rank(images)
+    for i, type in enumerate(engines):
+        t_0 = time()
+        try:
+            text = ocr_images(images, type=type, env=env)
+        except Exception:
+            router.record(type, images, time() - t_0, error=True)
+            if i == len(engines) - 1:
+                raise
+            LOG.exception(f'ocr_routed type={type} failed, trying {engines[i + 1]}')
+            continue
+        router.record(type, images, time() - t_0)
+        return type, text
+
+
+def ocr_images(images, type='tesseract', env=None):
+    """OCR a page's images with tesseract or Textract, return their text joined in drawing order."""
+    with measure(f'ocr_{type}'):
+        if type == 'aws':
+            return '\n'.join(get_textract_data(bytes(image.data)) for image in images)
+        return '\n'.join(ocr_by_tesseract(image.data, env=env) for image in images)
+
+
+def get_textract_data(jpg):
+    """Using AWS textract."""
+    LOG.info(f'Loading get_textract_data jpg_bytes={len(jpg)}')
+    response = clients.textract().detect_document_text(
+        Document={
+            'Bytes': jpg
+        })
+    detected_text = ''
+
+    # Print detected text
+    for item in response['Blocks']:
+        if item['BlockType'] == 'LINE':
+            detected_text += item['Text'] + '\n'
+    return detected_text
+
+
+def write_textract_to_s3(textract_data, bucket, key, type=''):
+    """Save detected text to S3."""
+    LOG.info(f'Loading write_textract_to_s3 bucket:{bucket}, key:{key}')
+    generate_path = os.path.splitext(key)[0] + '_' + type + '.txt'
+    with measure('s3_put'):
+        clients.s3().put_object(Body=textract_data, Bucket=bucket, Key=generate_path)
+    LOG.info(f'generateFilePath: {generate_path}')
+    return generate_path
+
+
+def ocr_by_tesseract(jpg, env=None):
+    """OCR a JPG with tesseract, piping it in on stdin and reading text from stdout.
+
+    :params: JPG bytes of the page scan, env for the tesseract process
+    :returns: extracted text as a str
+    """
+    LOG.info(f'ocr_by_tesseract jpg_bytes={len(jpg)}')
+    txt = run([TESSERACT_BIN, '--tessdata-dir', TESSERACT_DATA, 'stdin', 'stdout'], input=jpg, env=env)
+    return txt.decode('utf-8')
+
+
+def run(cmd, input=None, env=None):
+    """Run a command as a subprocess, feeding it input bytes, return output, log output or errors."""
+    LOG.debug('RUN {}')
+    if isinstance(cmd, str):
+        cmd = cmd.split()
+    t_0 = time()
+    res = subprocess.run(cmd, input=input, env=env, check=False,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    t_run = time() - t_0
+    if res.returncode == 0:
+        LOG.info('run run_seconds=%s cmd="%s"', t_run, cmd)
+        return res.stdout
+    else:
+        msg = 'run: {}'.format(res)
+        LOG.error(msg)
+        raise RuntimeError(msg)
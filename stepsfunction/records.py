@@ -0,0 +1,46 @@
+"""Run a function for every record of an S3 or SQS event."""
+from json import loads
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Records of an S3 or SQS event handled at once, see process_records
+RECORD_WORKERS = int(os.environ.get('RECORD_WORKERS', '8'))
+
+LOG = logging.getLogger()
+
+
+def process_records(event, process, workers=None):
+    """Call process(s3) for every S3 record of an S3 or SQS event, concurrently.
+
+    Records run on a pool of at most `workers` threads (default
+    RECORD_WORKERS). An SQS message body may be an S3 event notification
+    holding several records; they share the message's fate. Each record's
+    error is logged and reported without stopping the others, in the
+    batchItemFailures form of SQS's ReportBatchItemFailures.
+    S3 invokes us asynchronously and ignores what we return, so if any
+    record of an S3 event failed we raise once all have run, and Lambda
+    retries the event; process must be safe to run again for a record.
+    """
+    records = event.get('Records', [])
+
+    def _process(record):
+        try:
+            if 's3' in record:
+                process(record['s3'])
+            else:
+                for s3_record in loads(record['body']).get('Records', []):
+                    process(s3_record['s3'])
+        except Exception:
+            item = record.get('messageId') or record['s3']['object']['key']
+            LOG.exception(f'process_records failed item={item}')
+            return item
+        return None
+
+    workers = max(1, min(workers or RECORD_WORKERS, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        failed = [item for item in pool.map(_process, records) if item is not None]
+    LOG.info(f'process_records records={len(records)} workers={workers} failed={failed}')
+    if failed and not all('messageId' in record for record in records):
+        raise RuntimeError(f'process_records failed {len(failed)} of {len(records)} records: {failed}')
+    return {'batchItemFailures': [{'itemIdentifier': item} for item in failed]}
@@ -0,0 +1,202 @@
+"""Route each page to the OCR engine that best meets our latency or cost objective.
+
+Instead of picking Textract or tesseract at random, OcrRouter keeps each
+engine's page count, error count, cost and the sums for a least squares fit
+of OCR seconds on the page's megapixels and JPEG megabytes. It predicts each
+engine's seconds and cost for a page from those and ranks the engines by the
+objective, each divided by the engine's success rate, since a failed page is
+OCRed again by the next engine.
+
+Observations collect in process and are flushed to the OCREngineStats table
+every flush_seconds: ADDed to the current hour's item, then the last hours
+of every engine are read back, so warm containers share what they learn.
+An engine with fewer than min_samples pages in the window, OCRed or
+failed, is tried first, and explore is the fraction of pages sent to a
+random engine, so the statistics of an engine we stopped using stay current.
+"""
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from time import time
+
+from models import OcrEngineStats
+
+LOG = logging.getLogger()
+
+ENGINES = ('tesseract', 'aws')
+OBJECTIVES = ('latency', 'cost')
+GB_SECOND_PRICE = 0.0000166667
+TEXTRACT_PAGE_PRICE = 0.0015  # DetectDocumentText, per image we send
+RIDGE = 1e-6                  # keeps the fit solvable while every page is the same size
+
+
+class OcrRouter(object):
+    """Rank OCR engines for a page from rolling, shared per-engine statistics."""
+
+    def __init__(self, objective='latency', memory_mb=1024, textract_price=TEXTRACT_PAGE_PRICE,
+                 flush_seconds=60, window_hours=3, min_samples=5, explore=0.05, stats_model=OcrEngineStats):
+        if objective not in OBJECTIVES:
+            raise ValueError(f'objective={objective} not one of {OBJECTIVES}')
+        self.objective = objective
+        self.memory_mb = memory_mb
+        self.textract_price = textract_price
+        self.flush_seconds = flush_seconds
+        self.window_hours = window_hours
+        self.min_samples = min_samples
+        self.explore = explore
+        self.stats_model = stats_model
+        self._lock = threading.Lock()
+        self._shared = {engine: dict.fromkeys(stats_model.SUMS, 0) for engine in ENGINES}
+        self._pending = {engine: dict.fromkeys(stats_model.SUMS, 0) for engine in ENGINES}
+        self._flushed = None  # a new container starts from what the others learned
+
+    def rank(self, images):
+        """Return ENGINES ordered best first for a page's images, see images.PageImage."""
+        if self._flushed is None:
+            self.flush()
+        features = page_features(images)
+        with self._lock:
+            sums = {engine: self._sums(engine) for engine in ENGINES}
+        # failures count as tries, or an engine that always fails would stay untried, and first, forever
+        tries = {engine: sums[engine]['n'] + sums[engine]['errors'] for engine in ENGINES}
+        untried = [engine for engine in ENGINES if tries[engine] < self.min_samples]
+        if untried:
+            first = min(untried, key=lambda engine: tries[engine])
+        elif random.random() < self.explore:
+            first = random.choice(ENGINES)
+        else:
+            first = min(ENGINES, key=lambda engine: self.score(engine, sums[engine], features, len(images)))
+        return [first] + [engine for engine in ENGINES if engine != first]
+
+    def score(self, engine, sums, features, num_images):
+        """Predicted seconds or dollars of OCRing a page, allowing for the engine's errors.
+
+        An engine that only ever failed predicts nothing, so it scores infinite: only explore tries it.
+        """
+        if sums['n'] == 0:
+            return float('inf')
+        seconds = predict_seconds(sums, features)
+        if self.objective == 'latency':
+            value = seconds
+        else:
+            value = self.cost(engine, seconds, num_images)
+        success = (sums['n'] + 1.0) / (sums['n'] + sums['errors'] + 1.0)
+        return value / success
+
+    def cost(self, engine, seconds, num_images):
+        """Dollars of OCRing a page: our Lambda's time, plus Textract's price per image."""
+        cost = seconds * self.memory_mb / 1024 * GB_SECOND_PRICE
+        if engine == 'aws':
+            cost += self.textract_price * num_images
+        return cost
+
+    def record(self, engine, images, seconds, error=False):
+        """Count a page OCRed by engine in seconds, or failed, and flush if it's time."""
+        x1, x2 = page_features(images)
+        with self._lock:
+            pending = self._pending[engine]
+            if error:
+                pending['errors'] += 1
+            else:
+                pending['n'] += 1
+                pending['cost'] += self.cost(engine, seconds, len(images))
+                pending['x1'] += x1
+                pending['x2'] += x2
+                pending['y'] += seconds
+                pending['x1x1'] += x1 * x1
+                pending['x1x2'] += x1 * x2
+                pending['x2x2'] += x2 * x2
+                pending['x1y'] += x1 * seconds
+                pending['x2y'] += x2 * seconds
+            due = self._flushed is None or time() - self._flushed >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """ADD pending observations to this hour's items, then read back every engine's window.
+
+        A failed flush keeps the observations to try again with the next one:
+        OCR must not fail because the statistics could not be saved.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {
+                engine: dict.fromkeys(self.stats_model.SUMS, 0) for engine in ENGINES}
+            self._flushed = time()
+        now = datetime.utcnow()
+        window = now.strftime('%Y-%m-%dT%H')
+        since = (now - timedelta(hours=self.window_hours - 1)).strftime('%Y-%m-%dT%H')
+        expires = int(time()) + (self.window_hours + 1) * 3600
+        shared = {}
+        for engine in ENGINES:
+            try:
+                if any(pending[engine].values()):
+                    self.stats_model(engine, window).add_sums(pending[engine], expires)
+                    pending[engine] = dict.fromkeys(self.stats_model.SUMS, 0)
+                shared[engine] = self.stats_model.get_sums(engine, since)
+            except Exception as e:
+                LOG.warning(f'OcrRouter.flush engine={engine} kept pending={pending[engine]} e={e}')
+        with self._lock:
+            for engine in ENGINES:
+                for name, value in pending[engine].items():
+                    self._pending[engine][name] += value
+            self._shared.update(shared)
+        LOG.info(f'OcrRouter.flush window={window} shared={shared}')
+
+    def _sums(self, engine):
+        shared, pending = self._shared[engine], self._pending[engine]
+        return {name: shared[name] + pending[name] for name in shared}
+
+
+def page_features(images):
+    """Return a page's (megapixels, JPEG megabytes) over all its images."""
+    return (sum(image.width * image.height for image in images) / 1e6,
+            sum(len(image.data) for image in images) / 1e6)
+
+
+def predict_seconds(sums, features):
+    """Predict OCR seconds for a page's features from an engine's least squares sums.
+
+    Solves the normal equations for seconds = b0 + b1 * x1 + b2 * x2, which
+    needs no more than the running sums, so fits from any number of
+    containers just add up. With no pages, predict 0 so the engine is tried.
+    """
+    n = sums['n']
+    if n == 0:
+        return 0.0
+    a = [[n, sums['x1'], sums['x2'], sums['y']],
+         [sums['x1'], sums['x1x1'] + RIDGE, sums['x1x2'], sums['x1y']],
+         [sums['x2'], sums['x1x2'], sums['x2x2'] + RIDGE, sums['x2y']]]
+    # Gaussian elimination with partial pivoting on the 3x4 augmented matrix
+    for col in range(3):
+        pivot = max(range(col, 3), key=lambda row: abs(a[row][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        if abs(a[col][col]) < 1e-12:
+            return sums['y'] / n
+        for row in range(col + 1, 3):
+            factor = a[row][col] / a[col][col]
+            a[row] = [value - factor * top for value, top in zip(a[row], a[col])]
+    b = [0.0, 0.0, 0.0]
+    for row in (2, 1, 0):
+        b[row] = (a[row][3] - sum(a[row][col] * b[col] for col in range(row + 1, 3))) / a[row][row]
+    return max(0.0, b[0] + b[1] * features[0] + b[2] * features[1])
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_router():
+    """The OcrRouter ocr_page uses, configured by our environment and made on first use.
+
+    OCR_OBJECTIVE is latency or cost; the memory size prices our own time.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = OcrRouter(objective=os.environ.get('OCR_OBJECTIVE', 'latency'),
+                                 memory_mb=int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024')),
+                                 flush_seconds=int(os.environ.get('OCR_STATS_FLUSH_SECONDS', '60')),
+                                 explore=float(os.environ.get('OCR_EXPLORE', '0.05')))
+    return _default
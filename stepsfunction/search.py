@@ -0,0 +1,394 @@
+"""IndexText and MergeIndex: an inverted index of OCR text, searched with a few range reads.
+
+The index is a set of immutable segment files under INDEX_PREFIX in S3.
+IndexText writes one per document, from its assembled text; MergeIndex,
+run on a schedule, merges small segments into one so a search reads few.
+search() ANDs the terms of a query over every segment and returns the
+(jid, page) pairs whose text has them all.
+
+A segment, little-endian throughout:
+    header   HEADER: magic, counts, and where each section below starts
+    docs     the segment's jids joined by newlines; a doc's number is its line
+    index    per block of BLOCK_TERMS terms: its offset and length in blocks,
+             where its postings start, and its first term
+    blocks   the sorted terms, front coded: varints of the bytes shared with
+             the previous term and of the rest's length, the rest, then the
+             term's page count and its postings' length
+    postings per term, ascending keys doc << PAGE_BITS | page as varint deltas
+The header, docs and index come first and are read in one go, HEAD_BYTES
+from the start of the segment. Looking a term up then reads the one block
+it can be in and its postings: two range GETs in S3, or two slices of a
+mmap of a local copy, see Segment.
+"""
+from json import dumps
+import heapq
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+from uuid import uuid4
+
+import clients
+from assemble import iter_page_texts
+from metrics import measure, tagged, timed
+
+INDEX_PREFIX = os.environ.get('INDEX_PREFIX', 'index/segments/')
+# MergeIndex merges once there are this many segments smaller than INDEX_MERGE_MAX_BYTES, at most MAX at a time
+INDEX_MERGE_MIN_SEGMENTS = int(os.environ.get('INDEX_MERGE_MIN_SEGMENTS', '10'))
+INDEX_MERGE_MAX_SEGMENTS = int(os.environ.get('INDEX_MERGE_MAX_SEGMENTS', '100'))
+INDEX_MERGE_MAX_BYTES = int(os.environ.get('INDEX_MERGE_MAX_BYTES', str(64 * 1024 * 1024)))
+# A merge holds its input segments, their postings as 8 byte keys rather than 1 or 2 byte varints,
+# and the merged segment: about this many times the inputs' bytes of memory
+INDEX_MERGE_MEMORY_FACTOR = 10
+# so it takes at most this many bytes of segments, by default what our memory size allows
+INDEX_MERGE_BUDGET_BYTES = int(os.environ.get('INDEX_MERGE_BUDGET_BYTES', '0')) or (
+    int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024')) * 1024 * 1024 // INDEX_MERGE_MEMORY_FACTOR)
+
+MAGIC = b'OCRIDX01'
+HEADER = struct.Struct('<8sIIII6Q')  # magic, docs, terms, blocks, unused, then offset and length of each section
+INDEX_ENTRY = struct.Struct('<QIQH')  # block offset, block length, postings offset, first term length
+BLOCK_TERMS = 128
+PAGE_BITS = 20
+PAGE_MASK = (1 << PAGE_BITS) - 1
+HEAD_BYTES = 64 * 1024
+TOKEN_RE = re.compile(r'\w{2,64}')
+
+LOG = logging.getLogger()
+
+
+def tokenize(text):
+    """Return the terms of a text: runs of 2 to 64 word characters, case folded."""
+    return TOKEN_RE.findall(text.casefold())
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _decode_keys(data, count):
+    keys = array('Q')
+    key = pos = 0
+    for _ in range(count):
+        delta, pos = _get_varint(data, pos)
+        key += delta
+        keys.append(key)
+    return keys
+
+
+class SegmentWriter(object):
+    """Collect the terms of pages, a document's pages together, and write them as a segment."""
+
+    def __init__(self):
+        self.jids = []
+        self.postings = {}  # term -> array of ascending keys
+
+    def add_doc(self, jid):
+        """Start a document, returning its number in the segment."""
+        self.jids.append(jid)
+        return len(self.jids) - 1
+
+    def add_page(self, doc, page_num, text):
+        """Index the text of a page of document number doc; pages must come in order."""
+        key = doc << PAGE_BITS | page_num
+        for term in set(tokenize(text)):
+            keys = self.postings.get(term)
+            if keys is None:
+                self.postings[term] = array('Q', [key])
+            elif keys[-1] < key:
+                keys.append(key)
+
+    def to_bytes(self):
+        docs = '\n'.join(self.jids).encode('utf-8')
+        index = bytearray()
+        blocks = bytearray()
+        postings = bytearray()
+        terms = sorted(self.postings)
+        for i in range(0, len(terms), BLOCK_TERMS):
+            block_start = len(blocks)
+            postings_start = len(postings)
+            previous = b''
+            for term in terms[i:i + BLOCK_TERMS]:
+                keys = self.postings[term]
+                term_postings_start = len(postings)
+                last = 0
+                for key in keys:
+                    _put_varint(postings, key - last)
+                    last = key
+                encoded = term.encode('utf-8')
+                shared = 0
+                while shared < min(len(encoded), len(previous)) and encoded[shared] == previous[shared]:
+                    shared += 1
+                _put_varint(blocks, shared)
+                _put_varint(blocks, len(encoded) - shared)
+                blocks += encoded[shared:]
+                _put_varint(blocks, len(keys))
+                _put_varint(blocks, len(postings) - term_postings_start)
+                previous = encoded
+            first = terms[i].encode('utf-8')
+            index += INDEX_ENTRY.pack(block_start, len(blocks) - block_start, postings_start, len(first)) + first
+        offset = HEADER.size
+        sections = []
+        for section in (docs, index, blocks, postings):
+            sections += [offset, len(section)]
+            offset += len(section)
+        header = HEADER.pack(MAGIC, len(self.jids), len(terms), -(-len(terms) // BLOCK_TERMS), 0, *sections[:4],
+                             sections[4], sections[6])
+        return b''.join([header, docs, bytes(index), bytes(blocks), bytes(postings)])
+
+
+class Segment(object):
+    """A segment read lazily through read(offset, length), from memory, a mmap or S3.
+
+    Only the header, docs and block index are read when the segment is
+    opened; blocks and postings as terms are looked up, the most recent
+    `max_blocks` blocks being kept.
+    """
+
+    def __init__(self, read, head=b'', max_blocks=256):
+        self._read_range = read
+        self._head = head
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        (magic, self.num_docs, self.num_terms, num_blocks, _unused, docs_offset, docs_length,
+         index_offset, index_length, self._blocks_offset, self._postings_offset) = HEADER.unpack(
+            bytes(self._read(0, HEADER.size)))
+        if magic != MAGIC:
+            raise ValueError(f'not an index segment: {magic!r}')
+        docs = bytes(self._read(docs_offset, docs_length)).decode('utf-8')
+        self.jids = docs.split('\n') if docs else []
+        index = self._read(index_offset, index_length)
+        self._index = []  # (first term, block offset, block length, postings offset)
+        pos = 0
+        for _ in range(num_blocks):
+            block_offset, block_length, postings_offset, first_length = INDEX_ENTRY.unpack_from(index, pos)
+            pos += INDEX_ENTRY.size
+            self._index.append((bytes(index[pos:pos + first_length]), block_offset, block_length, postings_offset))
+            pos += first_length
+        self._firsts = [entry[0] for entry in self._index]
+
+    def _read(self, offset, length):
+        if offset + length <= len(self._head) or not length:
+            return self._head[offset:offset + length]
+        return self._read_range(offset, length)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """A segment in memory, bytes or a mmap."""
+        return cls(lambda offset, length: data[offset:offset + length], head=data)
+
+    @classmethod
+    def from_file(cls, path):
+        """A segment in a local file, mapped rather than read."""
+        with open(path, 'rb') as f:
+            return cls.from_bytes(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_s3(cls, bucket, key):
+        """A segment in S3, read with range GETs."""
+        def read(offset, length):
+            with measure('s3_get', bytes=length):
+                return clients.s3().get_object(Bucket=bucket, Key=key,
+                                               Range=f'bytes={offset}-{offset + length - 1}')['Body'].read()
+        return cls(read, head=read(0, HEAD_BYTES))
+
+    def _block(self, i):
+        with self._lock:
+            block = self._blocks.get(i)
+            if block is not None:
+                self._blocks.move_to_end(i)
+                return block
+        _first, offset, length, _postings = self._index[i]
+        block = self._read(self._blocks_offset + offset, length)
+        with self._lock:
+            self._blocks[i] = block
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+    def _entries(self, i):
+        """Yield (term, count, postings offset, postings length) of block i."""
+        block = self._block(i)
+        postings = self._index[i][3]
+        term = b''
+        pos = 0
+        while pos < len(block):
+            shared, pos = _get_varint(block, pos)
+            rest, pos = _get_varint(block, pos)
+            term = term[:shared] + bytes(block[pos:pos + rest])
+            pos += rest
+            count, pos = _get_varint(block, pos)
+            length, pos = _get_varint(block, pos)
+            yield term, count, postings, length
+            postings += length
+
+    def _keys(self, count, offset, length):
+        return _decode_keys(self._read(self._postings_offset + offset, length), count)
+
+    def keys(self, term):
+        """Return the ascending keys, doc << PAGE_BITS | page, of the pages with term."""
+        encoded = term.encode('utf-8')
+        i = bisect_right(self._firsts, encoded) - 1
+        if i < 0:
+            return array('Q')
+        for entry_term, count, offset, length in self._entries(i):
+            if entry_term == encoded:
+                return self._keys(count, offset, length)
+            if entry_term > encoded:
+                break
+        return array('Q')
+
+    def terms(self):
+        """Yield (term, keys) of every term in order, reading the whole segment."""
+        for i in range(len(self._index)):
+            for term, count, offset, length in self._entries(i):
+                yield term.decode('utf-8'), self._keys(count, offset, length)
+
+    def search(self, terms):
+        """Return the set of (jid, page) whose text has every term."""
+        found = None
+        for keys in sorted((self.keys(term) for term in terms), key=len):
+            found = set(keys) if found is None else found.intersection(keys)
+            if not found:
+                return set()
+        return set((self.jids[key >> PAGE_BITS], key & PAGE_MASK) for key in found or ())
+
+
+def merge_segments(segments):
+    """Return a SegmentWriter of all the segments' documents, a document in several from the last one."""
+    last = {}
+    for i, segment in enumerate(segments):
+        for jid in segment.jids:
+            last[jid] = i
+    writer = SegmentWriter()
+    remaps = []  # per segment, its doc numbers -> ours, for the docs we take from it
+    for i, segment in enumerate(segments):
+        remaps.append({doc: writer.add_doc(jid) for doc, jid in enumerate(segment.jids) if last[jid] == i})
+
+    def _terms(i, segment):
+        for term, keys in segment.terms():
+            yield term, i, keys
+    merged = heapq.merge(*[_terms(i, segment) for i, segment in enumerate(segments)])
+    for term, group in groupby(merged, key=itemgetter(0)):
+        out = array('Q')
+        for _term, i, keys in group:  # segments in order, so their docs' keys ascend
+            remap = remaps[i]
+            for key in keys:
+                doc = remap.get(key >> PAGE_BITS)
+                if doc is not None:
+                    out.append(doc << PAGE_BITS | key & PAGE_MASK)
+        if out:
+            writer.postings[term] = out
+    return writer
+
+
+@timed
+def index_text(event, context):
+    """Index the assembled text of event's jid as its own segment."""
+    LOG.info(f'event: {dumps(event)}')
+    bucket = event['bucket']
+    jid = event['jid']
+    with tagged(jid=jid):
+        writer = SegmentWriter()
+        doc = writer.add_doc(jid)
+        for page_num, text in enumerate(iter_page_texts(bucket, jid)):
+            writer.add_page(doc, page_num, text)
+        key = f'{INDEX_PREFIX}{jid}.seg'
+        segment = writer.to_bytes()
+        with measure('s3_put', bytes=len(segment)):
+            clients.s3().put_object(Bucket=bucket, Key=key, Body=segment)
+    LOG.info(f'index_text jid={jid} terms={len(writer.postings)} segment_bytes={len(segment)}')
+    return {'segment_key': key, 'terms': len(writer.postings), 'segment_bytes': len(segment)}
+
+
+def segment_objects(bucket):
+    """Return the S3 listing of the index's segments, oldest first."""
+    objects = []
+    paginator = clients.s3().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=INDEX_PREFIX):
+        objects.extend(obj for obj in page.get('Contents', []) if obj['Key'].endswith('.seg'))
+    return sorted(objects, key=itemgetter('LastModified', 'Key'))
+
+
+def merge_inputs(objects):
+    """Return the oldest of the segment objects smaller than INDEX_MERGE_MAX_BYTES that one merge can take.
+
+    That is at most INDEX_MERGE_MAX_SEGMENTS of them, and INDEX_MERGE_BUDGET_BYTES in all.
+    """
+    selected = []
+    total = 0
+    for obj in objects:
+        if obj['Size'] >= INDEX_MERGE_MAX_BYTES:
+            continue
+        if len(selected) == INDEX_MERGE_MAX_SEGMENTS or total + obj['Size'] > INDEX_MERGE_BUDGET_BYTES:
+            break
+        selected.append(obj)
+        total += obj['Size']
+    return selected
+
+
+@timed
+def merge_index(event, context):
+    """Merge the segments smaller than INDEX_MERGE_MAX_BYTES into one, once there are enough of them.
+
+    A merge takes what fits our memory, see merge_inputs; the rest wait for the next one.
+
+    The merged segment is written before its inputs are deleted, so a search
+    meanwhile finds pages twice rather than not at all; search() dedups.
+    """
+    bucket = event.get('bucket') or os.environ.get('INDEX_BUCKET', os.environ.get('UPLOAD_BUCKET_NAME', ''))
+    small = merge_inputs(segment_objects(bucket))
+    if len(small) < INDEX_MERGE_MIN_SEGMENTS:
+        LOG.info(f'merge_index segments={len(small)} bytes={sum(obj["Size"] for obj in small)} too few to merge')
+        return {'merged': 0}
+    s3 = clients.s3()
+    segments = [Segment.from_bytes(s3.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read()) for obj in small]
+    data = merge_segments(segments).to_bytes()
+    key = f'{INDEX_PREFIX}merged-{uuid4().hex}.seg'
+    s3.put_object(Bucket=bucket, Key=key, Body=data)
+    for i in range(0, len(small), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': obj['Key']} for obj in small[i:i + 1000]]})
+    LOG.info(f'merge_index segments={len(small)} into {key} segment_bytes={len(data)}')
+    return {'merged': len(small), 'segment_key': key, 'segment_bytes': len(data)}
+
+
+_segments = {}  # (bucket, key) -> Segment, segments being immutable
+
+
+def search(bucket, query):
+    """Return the sorted (jid, page) of every page whose text has all the terms of query."""
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    found = set()
+    keys = [(bucket, obj['Key']) for obj in segment_objects(bucket)]
+    for key in set(_segments) - set(keys):
+        if key[0] == bucket:  # merged away
+            del _segments[key]
+    for key in keys:
+        segment = _segments.get(key)
+        if segment is None:
+            segment = _segments[key] = Segment.from_s3(*key)
+        found |= segment.search(terms)
+    return sorted(found)
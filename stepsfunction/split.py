@@ -0,0 +1,280 @@
+"""SplitPdf: plan page-range chunks of a document, or split a chunk into single-page PDFs."""
+from json import dumps
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from PyPDF2 import PdfFileReader, PageSplitter
+
+import clients
+from metrics import measure, tagged, timed
+from models import PDFPage, PDFUpload
+
+# Split uploads pages on a thread pool; each pending page holds its PDF bytes in memory
+SPLIT_UPLOAD_WORKERS = int(os.environ.get('SPLIT_UPLOAD_WORKERS', '8'))
+SPLIT_MAX_PENDING = int(os.environ.get('SPLIT_MAX_PENDING', str(2 * SPLIT_UPLOAD_WORKERS)))
+# Pages per SplitPages Map item, and the S3 range GET block size for reading the source
+SPLIT_CHUNK_PAGES = int(os.environ.get('SPLIT_CHUNK_PAGES', '50'))
+S3_RANGE_BLOCK = int(os.environ.get('S3_RANGE_BLOCK', str(256 * 1024)))
+
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+
+@timed
+def split_doc_pdf(event, context):
+    """Split the uploaded doc_pdf into one PDF per page at page_pdf/jid/0000.pdf.
+
+    The event "mode" picks what this invocation does:
+    - "plan": read only the page count and return a manifest of page-range
+      chunks for the SplitPages Map state to fan out;
+    - "range": split only pages page_start to page_end-1 of one chunk;
+    - "done": after the Map state split every chunk, set the status split;
+    - none: split the whole document here, which times out on very large docs.
+    Plan and range read the source with S3 range GETs rather than downloading it.
+    The status is splitting until every page exists, then split, see _mark_split.
+    """
+    LOG.info(f'event: {dumps(event)}')
+    with tagged(jid=event['jid']):
+        mode = event.get('mode')
+        if mode == 'plan':
+            return plan_split(event)
+        if mode == 'range':
+            return split_range(event)
+        if mode == 'done':
+            return finish_split(event)
+        return split_whole(event)
+
+
+def split_whole(event):
+    """Split every page of the document in this invocation.
+
+    Like plan_split, we record num_pages before any page exists.
+    """
+    bucket = event['bucket']
+    key = event['key']
+    jid = event['jid']
+    with measure('s3_get') as measurement:
+        body = clients.s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+        measurement.set(bytes=len(body))
+    with measure('pdf_parse'):
+        # read in place, so page data are slices of body; log unexpected stream ends, don't raise;
+        # we split every page, so read each object stream's objects in one pass
+        pdf = PdfFileReader(body, strict=False, preloadObjectStreams=True)
+        num_pages = pdf.getNumPages()
+    LOG.info(f'num_pages={num_pages}')
+    pdf_upload = PDFUpload.get(hash_key=jid)
+    pdf_upload.update_with_log(
+        actions=[
+            PDFUpload.status.set("splitting"),
+            PDFUpload.num_pages.set(num_pages)
+        ])
+    workers = _upload_workers(event)
+    timings = upload_pages(pdf, bucket, jid, workers=workers)
+    _mark_split(pdf_upload)
+    LOG.info(f'object streams parsed={pdf.objStmParsedCount} objects preloaded={pdf.objStmPreloadedCount} '
+             f'reused={pdf.objStmReusedCount}')
+    return _split_result(jid, num_pages, workers, timings)
+
+
+def plan_split(event):
+    """Read the page count from the trailer and return chunks of pages to split.
+
+    We record num_pages now, before any page exists, so the OCR of the last
+    page can always tell that it was the last one.
+    """
+    bucket = event['bucket']
+    key = event['key']
+    jid = event['jid']
+    chunk_pages = int(event.get('chunk_pages', SPLIT_CHUNK_PAGES))
+    source = S3RangeFile(bucket, key)
+    with measure('pdf_parse'):
+        pdf = PdfFileReader(source, strict=False)
+        num_pages = pdf.trailer['/Root']['/Pages']['/Count']  # don't walk the page tree
+    LOG.info(f'num_pages={num_pages} chunk_pages={chunk_pages} get_count={source.get_count}')
+    pdf_upload = PDFUpload.get(hash_key=jid)
+    pdf_upload.update_with_log(
+        actions=[
+            PDFUpload.status.set("splitting"),
+            PDFUpload.num_pages.set(num_pages)
+        ])
+    chunks = [{'mode': 'range', 'bucket': bucket, 'key': key, 'jid': jid, 'size': source.size,
+               'page_start': page_start, 'page_end': min(page_start + chunk_pages, num_pages)}
+              for page_start in range(0, num_pages, chunk_pages)]
+    return {'bucket': bucket, 'key': key, 'jid': jid, 'num_pages': num_pages, 'chunks': chunks}
+
+
+def split_range(event):
+    """Split one chunk from plan_split, reading only the parts of the source its pages use."""
+    bucket = event['bucket']
+    key = event['key']
+    jid = event['jid']
+    page_start = event['page_start']
+    page_end = event['page_end']
+    source = S3RangeFile(bucket, key, size=event.get('size'))
+    with measure('pdf_parse'):
+        pdf = PdfFileReader(source, strict=False)
+    workers = _upload_workers(event)
+    timings = upload_pages(pdf, bucket, jid, pages=range(page_start, page_end), workers=workers)
+    LOG.info(f'split pages {page_start}-{page_end - 1} get_count={source.get_count} get_bytes={source.get_bytes}')
+    return _split_result(jid, page_end - page_start, workers, timings)
+
+
+def finish_split(event):
+    """Set the status split once the SplitPages Map state has split every chunk."""
+    pdf_upload = PDFUpload(event['jid'])
+    pdf_upload.reread()
+    _mark_split(pdf_upload)
+    return {'jid': event['jid'], 'status': pdf_upload.status}
+
+
+def _mark_split(pdf_upload):
+    """Set status split, after every page exists, unless the last page's OCR already set it ocred."""
+    pdf_upload.queue(PDFUpload.status.set('split')).commit(check=lambda upload: upload.status == 'splitting')
+
+
+def _upload_workers(event):
+    """The event's upload_workers, default SPLIT_UPLOAD_WORKERS, at most the S3 client's connections.
+
+    Threads beyond clients.S3_POOL_CONNECTIONS would only wait for a connection,
+    and urllib3 would drop the extra ones with "Connection pool is full".
+    """
+    workers = int(event.get('upload_workers', SPLIT_UPLOAD_WORKERS))
+    if workers > clients.S3_POOL_CONNECTIONS:
+        LOG.warning(f'upload_workers={workers} capped at S3_POOL_CONNECTIONS={clients.S3_POOL_CONNECTIONS}')
+    return min(workers, clients.S3_POOL_CONNECTIONS)
+
+
+def _split_result(jid, num_pages, workers, timings):
+    return {'jid': jid, 'num_pages': num_pages,
+            'upload_workers': workers,
+            'serialize_seconds': sum(t['serialize_seconds'] for t in timings),
+            'upload_seconds_max': max((t['upload_seconds'] for t in timings), default=0)}
+
+
+class S3RangeFile(object):
+    """Read-only, seekable file object over an S3 object, fetched with range GETs.
+
+    PyPDF2 seeks all over the file but a split worker needs only the xref,
+    the page tree and its own pages, so we fetch S3_RANGE_BLOCK sized blocks
+    as they are read and keep the most recent `max_blocks` of them.
+    """
+
+    def __init__(self, bucket, key, size=None, block_size=S3_RANGE_BLOCK, max_blocks=64):
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.pos = 0
+        self.get_count = 0
+        self.get_bytes = 0
+        if size is None:
+            size = clients.s3().head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.size = size
+        self.mode = 'rb'
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError(f'seek before start of s3://{self.bucket}/{self.key}')
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.pos + size, self.size)
+        if end <= self.pos:
+            return b''
+        first = self.pos // self.block_size
+        last = (end - 1) // self.block_size
+        self._fetch(first, last)
+        data = b''.join(self.blocks[i] for i in range(first, last + 1))
+        start = self.pos - first * self.block_size
+        data = data[start:start + end - self.pos]
+        self.pos = end
+        return data
+
+    def _fetch(self, first, last):
+        """Get the missing blocks from first to last, one GET per contiguous run."""
+        i = first
+        while i <= last:
+            if i in self.blocks:
+                self.blocks.move_to_end(i)
+                i += 1
+                continue
+            run_end = i
+            while run_end < last and run_end + 1 not in self.blocks:
+                run_end += 1
+            start = i * self.block_size
+            end = min((run_end + 1) * self.block_size, self.size) - 1
+            with measure('s3_get', bytes=end + 1 - start):
+                body = clients.s3().get_object(Bucket=self.bucket, Key=self.key,
+                                                Range=f'bytes={start}-{end}')['Body'].read()
+            self.get_count += 1
+            self.get_bytes += len(body)
+            for j in range(i, run_end + 1):
+                offset = (j - i) * self.block_size
+                self.blocks[j] = body[offset:offset + self.block_size]
+            i = run_end + 1
+        while len(self.blocks) > max(self.max_blocks, last - first + 1):
+            self.blocks.popitem(last=False)
+
+
+def upload_pages(pdf, bucket, jid, pages=None, workers=SPLIT_UPLOAD_WORKERS, max_pending=None):
+    """Write each page of the PDF, or those numbered in `pages`, to its own PDF at page_pdf/jid/0000.pdf.
+
+    Their PDFPage items are written first, so every page OCR counts has one.
+
+    PyPDF2 objects are not thread safe, so pages are serialized here one at a time;
+    the S3 PUTs, which dominate, run on a pool of `workers` threads sharing clients.s3().
+    At most `max_pending` serialized pages wait for upload: when S3 falls behind
+    the writer blocks instead of filling the Lambda's memory.
+    Returns a list of per-page timings, also logged so we can tune the pool width.
+    """
+    max_pending = max_pending or max(SPLIT_MAX_PENDING, workers)
+    splitter = PageSplitter(pdf)  # serializes resources shared by pages only once
+    slots = threading.BoundedSemaphore(max_pending)
+
+    def _upload(page_num, body, serialize_seconds):
+        pdf_key = page_key(jid, page_num)
+        try:
+            t_0 = time()
+            with measure('s3_put', jid=jid, page=page_num, bytes=len(body)):  # tags don't cross threads
+                clients.s3().put_object(Body=body, Bucket=bucket, Key=pdf_key)
+            upload_seconds = time() - t_0
+        finally:
+            slots.release()
+        LOG.info('uploaded page_num=%s serialize_seconds=%s upload_seconds=%s',
+                 page_num, serialize_seconds, upload_seconds)
+        return {'page_num': page_num,
+                'serialize_seconds': serialize_seconds,
+                'upload_seconds': upload_seconds}
+
+    if pages is None:
+        pages = range(splitter.getNumPages())
+    with measure('page_items', jid=jid, pages=len(pages)):
+        PDFPage.save_pages(jid, pages, {page_num: page_key(jid, page_num) for page_num in pages})
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page_num in pages:  # 0-based, want 1-based for humans?
+            slots.acquire()  # backpressure: wait for an upload to finish
+            t_0 = time()
+            with measure('page_write', page=page_num):
+                body = splitter.getPageBytes(page_num)
+            futures.append(pool.submit(_upload, page_num, body, time() - t_0))
+    return [future.result() for future in futures]
+
+
+def page_key(jid, page_num):
+    """Return the key of a page's PDF."""
+    return f'page_pdf/{jid}/{page_num:04}.pdf'
@@ -0,0 +1,108 @@
+import io
+import os
+import re
+from datetime import datetime, timedelta
+
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import pytest  # noqa: E402
+
+import clients  # noqa: E402
+from assemble import assemble_text, read_page_text, write_text  # noqa: E402
+
+NOW = datetime(2019, 8, 23)
+
+
+class S3(object):
+    """The S3 client calls assemble makes, on a dict."""
+
+    def __init__(self):
+        self.objects = {}  # key -> (body, LastModified)
+        self.uploads = {}  # upload id -> {part number: body}
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body, modified=NOW, **_kwargs):
+        self.calls.append('put_object')
+        self.objects[Key] = (bytes(Body), modified)
+
+    def get_object(self, Bucket, Key, Range=None):
+        body = self.objects[Key][0]
+        if Range:
+            start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+            body = body[start:end + 1]
+        return {'Body': io.BytesIO(body)}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': key, 'LastModified': modified}
+                            for key, (body, modified) in sorted(self.objects.items()) if key.startswith(Prefix)]}
+
+    def create_multipart_upload(self, Bucket, Key, **_kwargs):
+        self.uploads[Key] = {}
+        return {'UploadId': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = (b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts']), NOW)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = S3()
+    monkeypatch.setitem(clients._clients, 's3', s3)
+    return s3
+
+
+def test_assemble_text(s3):
+    texts = ['first page\n', '', 'ünïcode third\n']
+    for page_num, text in enumerate(texts):
+        s3.put_object('b', f'page_pdf/j1/{page_num:04}_aws.txt', text.encode())
+        s3.put_object('b', f'page_pdf/j1/{page_num:04}.pdf', b'%PDF')
+    # a retry OCRed page 0 again with tesseract
+    s3.put_object('b', 'page_pdf/j1/0000_tesseract.txt', b'newer first page\n', modified=NOW + timedelta(1))
+
+    result = assemble_text({'bucket': 'b', 'jid': 'j1', 'num_pages': 3}, None)
+
+    text = b'newer first page\n\f\f' + 'ünïcode third\n\f'.encode()
+    assert s3.objects['doc_txt/j1/doc.txt'][0] == text
+    assert result['text_bytes'] == len(text)
+    assert len(s3.objects['doc_txt/j1/doc.idx'][0]) == 4 * 8
+    assert [read_page_text('b', 'j1', page_num) for page_num in range(3)] == \
+        ['newer first page\n', '', 'ünïcode third\n']
+    with pytest.raises(IndexError):
+        read_page_text('b', 'j1', 3)
+
+
+def test_assemble_text_missing_page(s3):
+    s3.put_object('b', 'page_pdf/j1/0001_aws.txt', b'second')
+    with pytest.raises(RuntimeError, match=r'\[0\]'):
+        assemble_text({'bucket': 'b', 'jid': 'j1', 'num_pages': 2}, None)
+
+
+def test_write_text_multipart(s3):
+    page = b'x' * (2 * 1024 * 1024)
+    offsets = write_text('b', 'doc.txt', iter([page] * 7), part_bytes=1)  # parts are at least 5 MiB
+    assert s3.calls == ['upload_part'] * 3
+    assert s3.objects['doc.txt'][0] == (page + b'\f') * 7
+    assert offsets == [i * (len(page) + 1) for i in range(8)]
+
+
+def test_write_text_aborts(s3):
+    def texts():
+        yield b'x' * (5 * 1024 * 1024)
+        raise IOError('GET failed')
+
+    with pytest.raises(IOError):
+        write_text('b', 'doc.txt', texts())
+    assert s3.uploads == {} and 'doc.txt' not in s3.objects
@@ -0,0 +1,139 @@
+import io
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from cache import OcrCache  # noqa: E402
+
+Image = namedtuple('Image', ['data', 'width', 'height', 'placement'])
+NOW = datetime(2019, 8, 23, tzinfo=timezone.utc)
+
+
+class S3(object):
+    """The S3 client calls OcrCache makes, on a dict."""
+
+    def __init__(self):
+        self.objects = {}  # key -> (body, LastModified)
+
+    def put_object(self, Bucket, Key, Body, modified=NOW):
+        self.objects[Key] = (Body, modified)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key][0])}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': key, 'Size': len(body), 'LastModified': modified}
+                            for key, (body, modified) in self.objects.items() if key.startswith(Prefix)]}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            del self.objects[obj['Key']]
+
+
+class Attr(object):
+    def __init__(self, name):
+        self.name = name
+
+    def add(self, value):
+        return (self.name, value)
+
+    def set(self, value):
+        return None
+
+
+class Entry(object):
+    """OcrCacheEntry kept in a dict, standing in for the table."""
+
+    items = {}
+    hits = Attr('hits')
+    lastHitAt = Attr('lastHitAt')
+
+    class DoesNotExist(Exception):
+        pass
+
+    def __init__(self, digest, **attrs):
+        self.digest = digest
+        self.hits = 0
+        self.__dict__.update(attrs)
+
+    @classmethod
+    def get(cls, digest):
+        if digest not in cls.items:
+            raise cls.DoesNotExist()
+        return cls.items[digest]
+
+    def save(self):
+        Entry.items[self.digest] = self
+
+    def update(self, actions):
+        for action in filter(None, actions):
+            setattr(self, action[0], getattr(self, action[0]) + action[1])
+
+    def delete(self):
+        Entry.items.pop(self.digest, None)
+
+    @classmethod
+    def batch_write(cls):
+        return _Batch()
+
+
+class _Batch(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def delete(self, entry):
+        entry.delete()
+
+
+def _cache(**kwargs):
+    Entry.items = {}
+    return OcrCache(S3(), 'bucket', entry_model=Entry, **kwargs)
+
+
+def _digest(data):
+    return OcrCache.digest([Image(data=memoryview(data), width=1, height=1, placement=None)])
+
+
+def test_cache_miss_put_hit():
+    cache = _cache()
+    digest = _digest(b'\xff\xd8scan\xff\xd9')
+    assert cache.get(digest) is None
+    cache.put(digest, 'tesseract', 'some text')
+    assert cache.get(digest) == ('tesseract', 'some text')
+    assert Entry.items[digest].hits == 1
+    assert (cache.counts['hit'], cache.counts['miss'], cache.counts['put']) == (1, 1, 1)
+
+
+def test_cache_stale_and_too_big():
+    cache = _cache(max_text_bytes=10)
+    cache.put('big', 'aws', 'more than ten bytes')
+    assert cache.counts['too_big'] == 1 and 'big' not in Entry.items
+    cache.put('gone', 'aws', 'text')
+    del cache.s3.objects['ocr_cache/gone.txt']
+    assert cache.get('gone') is None
+    assert cache.counts['stale'] == 1 and 'gone' not in Entry.items
+
+
+def test_cache_evict_by_age_then_size():
+    cache = _cache(max_age_days=30, max_bytes=25)
+    for num, days in enumerate([40, 3, 2, 1]):
+        cache.put(str(num), 'tesseract', 'x')
+        cache.s3.put_object('bucket', f'ocr_cache/{num}.txt', b'x' * 10, modified=NOW - timedelta(days=days))
+    result = cache.evict(now=NOW)
+    # 0 is too old, 1 is the oldest of the rest and doesn't fit
+    assert sorted(cache.s3.objects) == ['ocr_cache/2.txt', 'ocr_cache/3.txt']
+    assert sorted(Entry.items) == ['2', '3']
+    assert result == {'kept': 2, 'kept_bytes': 20, 'evicted': 2, 'evicted_bytes': 20}
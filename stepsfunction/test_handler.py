@@ -0,0 +1,164 @@
+import io
+import json
+import os
+
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LD_LIBRARY_PATH', '')
+
+import pytest  # noqa: E402
+from PyPDF2 import PdfFileWriter  # noqa: E402
+from PyPDF2.generic import (DecodedStreamObject, DictionaryObject, NameObject,  # noqa: E402
+                            NumberObject)
+
+from images import extract_images_from_pdf  # noqa: E402
+from records import process_records  # noqa: E402
+
+
+def _image(writer, data, subtype='/Image', filter='/DCTDecode'):
+    image = DecodedStreamObject()
+    image.setData(data)
+    image.update({NameObject('/Type'): NameObject('/XObject'),
+                  NameObject('/Subtype'): NameObject(subtype),
+                  NameObject('/Width'): NumberObject(600),
+                  NameObject('/Height'): NumberObject(100),
+                  NameObject('/BitsPerComponent'): NumberObject(8),
+                  NameObject('/Filter'): NameObject(filter)})
+    return writer._addObject(image)
+
+
+def make_page_pdf(contents, xobjects):
+    """Return bytes of a one page PDF drawing xobjects, {name: writer -> ref}, with contents."""
+    writer = PdfFileWriter()
+    content = DecodedStreamObject()
+    content.setData(contents)
+    page = writer.addBlankPage(612, 792)
+    page[NameObject('/Contents')] = writer._addObject(content)
+    page[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): DictionaryObject(
+        {NameObject(name): make(writer) for name, make in xobjects.items()})})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def test_handler_imports_every_function():
+    import handler
+    assert handler.extract_images_from_pdf is extract_images_from_pdf
+    assert handler.process_records is process_records
+
+
+def test_extract_images_strips():
+    pdf = make_page_pdf(
+        b'q 612 0 0 396 0 396 cm /Top Do Q q 612 0 0 396 0 0 cm /Bottom Do Q /Flate Do',
+        {'/Bottom': lambda w: _image(w, b'\xff\xd8bottom\xff\xd9'),
+         '/Top': lambda w: _image(w, b'\xff\xd8top\xff\xd9'),
+         '/Flate': lambda w: _image(w, b'x\x9c', filter='/FlateDecode')})
+    images = extract_images_from_pdf(pdf)
+    assert [bytes(image.data) for image in images] == [b'\xff\xd8top\xff\xd9', b'\xff\xd8bottom\xff\xd9']
+    assert images[0].placement == (612, 0, 0, 396, 0, 396)
+    assert images[1].placement == (612, 0, 0, 396, 0, 0)
+    assert (images[0].width, images[0].height) == (600, 100)
+    assert all(image.data.obj is pdf for image in images)
+
+
+def test_extract_images_in_form():
+    def form(writer):
+        xobject = DecodedStreamObject()
+        xobject.setData(b'q 100 0 0 50 0 0 cm /Im0 Do Q')
+        xobject.update({NameObject('/Type'): NameObject('/XObject'),
+                        NameObject('/Subtype'): NameObject('/Form'),
+                        NameObject('/Resources'): DictionaryObject({NameObject('/XObject'): DictionaryObject(
+                            {NameObject('/Im0'): _image(writer, b'\xff\xd8form\xff\xd9')})})})
+        return writer._addObject(xobject)
+    pdf = make_page_pdf(b'q 2 0 0 2 10 20 cm /Fm0 Do Q', {'/Fm0': form})
+    images = extract_images_from_pdf(pdf)
+    assert [bytes(image.data) for image in images] == [b'\xff\xd8form\xff\xd9']
+    assert images[0].placement == (200, 0, 0, 100, 10, 20)
+
+
+def test_extract_images_undrawn():
+    pdf = make_page_pdf(b'BT ET', {'/Im0': lambda w: _image(w, b'\xff\xd8scan\xff\xd9')})
+    images = extract_images_from_pdf(pdf)
+    assert [(bytes(image.data), image.placement) for image in images] == [(b'\xff\xd8scan\xff\xd9', None)]
+
+
+def _s3_record(key):
+    return {'s3': {'bucket': {'name': 'bucket'}, 'object': {'key': key}}}
+
+
+def test_process_records_every_record():
+    seen = []
+    event = {'Records': [_s3_record(f'page_pdf/jid/{num:04}.pdf') for num in range(20)]}
+    assert process_records(event, lambda s3: seen.append(s3['object']['key']), workers=4) == \
+        {'batchItemFailures': []}
+    assert sorted(seen) == [f'page_pdf/jid/{num:04}.pdf' for num in range(20)]
+
+
+def test_process_records_partial_failure():
+    def process(s3):
+        if s3['object']['key'].endswith('1.pdf'):
+            raise ValueError('bad page')
+    sqs = {'Records': [{'messageId': f'm{num}', 'body': json.dumps({'Records': [_s3_record(f'{num}.pdf')]})}
+                       for num in range(3)]}
+    assert process_records(sqs, process) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    s3 = {'Records': [_s3_record(f'{num}.pdf') for num in range(3)]}
+    with pytest.raises(RuntimeError, match=r"failed 1 of 3 records: \['1.pdf'\]"):
+        process_records(s3, process)
+
+
+def test_ocr_pages_counts_each_document_once(monkeypatch):
+    import ocr
+    marked = []
+
+    class Upload(object):
+        def __init__(self, jid):
+            self.jid = jid
+
+        def mark_pages_done(self, page_nums, text_paths=None):
+            marked.append((self.jid, page_nums, text_paths))
+            return False
+
+    monkeypatch.setattr(ocr, 'PDFUpload', Upload)
+    monkeypatch.setattr(ocr, 'ocr_batch', lambda pages: [key.replace('.pdf', '_tesseract.txt') for _, key in pages])
+    sqs = {'Records': [{'messageId': f'm{num}', 'body': json.dumps({'Records': [
+        _s3_record(f'page_pdf/{jid}/{num:04}.pdf')]})} for num, jid in enumerate(['a', 'b', 'a'])]}
+    assert ocr.ocr_pages(sqs, None) == {'pages': 3, 'jids': ['a', 'b'], 'batchItemFailures': []}
+    assert sorted(marked) == [
+        ('a', [0, 2], {0: 'page_pdf/a/0000_tesseract.txt', 2: 'page_pdf/a/0002_tesseract.txt'}),
+        ('b', [1], {1: 'page_pdf/b/0001_tesseract.txt'})]
+
+
+def test_ocr_pages_redelivers_only_failed_messages(monkeypatch):
+    import ocr
+    marked = []
+
+    class Upload(object):
+        def __init__(self, jid):
+            self.jid = jid
+
+        def mark_pages_done(self, page_nums, text_paths=None):
+            marked.extend((self.jid, page_num) for page_num in page_nums)
+            return False
+
+    def ocr_batch(pages):
+        return [ValueError('poison page') if key.endswith('0001.pdf') else key.replace('.pdf', '_aws.txt')
+                for _, key in pages]
+
+    monkeypatch.setattr(ocr, 'PDFUpload', Upload)
+    monkeypatch.setattr(ocr, 'ocr_batch', ocr_batch)
+    sqs = {'Records': [{'messageId': f'm{num}', 'body': json.dumps({'Records': [
+        _s3_record(f'page_pdf/a/{num:04}.pdf')]})} for num in range(3)]}
+    assert ocr.ocr_pages(sqs, None)['batchItemFailures'] == [{'itemIdentifier': 'm1'}]
+    assert sorted(marked) == [('a', 0), ('a', 2)]
+    items = {'Items': [{'bucket': 'b', 'key': f'page_pdf/a/{num:04}.pdf'} for num in range(3)]}
+    with pytest.raises(RuntimeError, match='page_pdf/a/0001.pdf'):
+        ocr.ocr_pages(items, None)
+
+
+def test_split_upload_workers_fit_the_s3_pool(monkeypatch):
+    import clients
+    import split
+    monkeypatch.setattr(clients, 'S3_POOL_CONNECTIONS', 20)
+    assert split._upload_workers({}) == split.SPLIT_UPLOAD_WORKERS
+    assert split._upload_workers({'upload_workers': '12'}) == 12
+    assert split._upload_workers({'upload_workers': 64}) == 20
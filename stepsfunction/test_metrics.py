@@ -0,0 +1,79 @@
+import os
+import threading
+
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LD_LIBRARY_PATH', '')
+
+import pytest  # noqa: E402
+
+import metrics  # noqa: E402
+from metrics import LocalSink, measure, tagged, timed  # noqa: E402
+
+
+@pytest.fixture
+def sink():
+    sink = LocalSink()
+    previous = metrics.use(sink)
+    yield sink
+    metrics.use(previous)
+
+
+def test_measure_emits_emf(sink):
+    with measure('s3_get', page=3) as measurement:
+        measurement.set(bytes=10)
+    record, = sink
+    assert record['stage'] == 's3_get'
+    assert record['page'] == 3 and record['bytes'] == 10
+    assert record['seconds'] >= 0
+    emf, = record['_aws']['CloudWatchMetrics']
+    assert emf['Dimensions'] == [['function', 'stage']]
+    assert emf['Metrics'] == [{'Name': 'seconds', 'Unit': 'Seconds'}]
+    assert all(name in record for name in emf['Dimensions'][0])
+
+
+def test_tagged_nests_and_stays_in_its_thread(sink):
+    def put():
+        with measure('s3_put'):
+            pass
+
+    with tagged(jid='j1'):
+        with tagged(page=2):
+            with measure('pdf_parse'):
+                thread = threading.Thread(target=put)
+                thread.start()
+                thread.join()
+        with measure('dynamodb_update'):
+            pass
+    with measure('ocr_aws'):
+        pass
+    tags = {record['stage']: (record.get('jid'), record.get('page')) for record in sink}
+    assert tags == {'s3_put': (None, None), 'pdf_parse': ('j1', 2),
+                    'dynamodb_update': ('j1', None), 'ocr_aws': (None, None)}
+
+
+def test_error_is_recorded_and_raised(sink):
+    @timed
+    def handler(event, context):
+        raise ValueError(event)
+
+    with pytest.raises(ValueError):
+        handler('x', None)
+    assert sink.stages() == ['handler']
+    assert sink[0]['error'] == 'ValueError'
+
+
+def test_disabled():
+    previous = metrics.use(None)
+    try:
+        assert measure('s3_get', page=1) is measure('ocr_aws')
+
+        @timed
+        def handler(event, context):
+            with measure('s3_get') as measurement:
+                measurement.set(bytes=1)
+            return event
+
+        assert handler(1, None) == 1
+    finally:
+        metrics.use(previous)
@@ -0,0 +1,346 @@
+"""Exercise models.py against DynamoDB Local, and its page counting against a fake client too.
+
+Start DynamoDB Local on port 8000, where models.py looks when ENV is set:
+    docker run -p 8000:8000 amazon/dynamodb-local
+then run:
+    python -m pytest test_models.py
+The tests marked local are skipped when nothing is listening on localhost:8000.
+"""
+import os
+import random
+import re
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import pytest
+from botocore.exceptions import ClientError
+
+os.environ.setdefault('ENV', 'test')  # models.Meta uses http://localhost:8000
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import clients  # noqa: E402
+from models import DocDigest, OcrEngineStats, PDFPage, PDFUpload  # noqa: E402
+
+
+def _dynamodb_local_running():
+    try:
+        socket.create_connection(('localhost', 8000), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+DYNAMODB_LOCAL = _dynamodb_local_running()
+local = pytest.mark.skipif(not DYNAMODB_LOCAL, reason='DynamoDB Local is not running on localhost:8000')
+
+
+@pytest.fixture(scope='module', autouse=True)
+def table():
+    if not DYNAMODB_LOCAL:
+        return
+    for model in (PDFUpload, PDFPage, OcrEngineStats, DocDigest):
+        if not model.exists():
+            model.create_table(read_capacity_units=5, write_capacity_units=5, wait=True)
+
+
+def _new_upload(num_pages):
+    jid = uuid4().hex
+    PDFUpload(uuid=jid, desired_filename='doc.pdf', status='split', num_pages=num_pages).save()
+    PDFPage.save_pages(jid, range(num_pages), {n: f'page_pdf/{jid}/{n:04}.pdf' for n in range(num_pages)})
+    return jid
+
+
+@local
+def test_mark_page_done_last_page():
+    jid = _new_upload(2)
+    assert PDFUpload.get(jid).mark_page_done(0) is False
+    # as ocr_page does, without reading the upload first
+    assert PDFUpload(jid).mark_page_done(1, text_path='page_pdf/j/0001_aws.txt') is True
+    pdf_upload = PDFUpload.get(jid)
+    assert (pdf_upload.status, pdf_upload.pages_done) == ('ocred', 2)
+    assert PDFPage.get(jid, 1).text_path == 'page_pdf/j/0001_aws.txt'
+    # a redelivered last page doesn't finish the document again
+    assert PDFUpload.get(jid).mark_page_done(1) is False
+
+
+@local
+def test_mark_page_done_ignores_repeats():
+    jid = _new_upload(2)
+    assert PDFUpload.get(jid).mark_page_done(0) is False
+    assert PDFUpload.get(jid).mark_page_done(0) is False
+    assert PDFUpload.get(jid).pages_done == 1
+
+
+@local
+def test_mark_page_done_concurrent():
+    """Every page, some delivered twice, completed from many threads at once."""
+    num_pages = 200
+    jid = _new_upload(num_pages)
+    deliveries = list(range(num_pages)) + random.sample(range(num_pages), 50)
+    random.shuffle(deliveries)
+
+    def complete(page_num):
+        return PDFUpload.get(jid).mark_page_done(page_num)
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        lasts = list(pool.map(complete, deliveries))
+    assert lasts.count(True) == 1
+    pdf_upload = PDFUpload.get(jid)
+    assert pdf_upload.pages_done == num_pages
+    assert {page.status for page in PDFPage.query(jid)} == {'ocred'}
+
+
+@local
+def test_mark_pages_done_batches():
+    jid = _new_upload(5)
+    assert PDFUpload.get(jid).mark_pages_done([0, 1, 2]) is False
+    # redelivered batch: only the new pages count
+    assert PDFUpload.get(jid).mark_pages_done([2, 3, 4]) is True
+    pdf_upload = PDFUpload.get(jid)
+    assert pdf_upload.pages_done == 5
+    assert pdf_upload.mark_pages_done([0, 4]) is False
+
+
+@local
+def test_commit_coalesces_and_retries_conflicts():
+    jid = _new_upload(2)
+    first, second = PDFUpload.get(jid), PDFUpload.get(jid)
+    first.queue(PDFUpload.status.set('splitting')).queue(PDFUpload.filename.set('a.pdf'))
+    assert first.commit() is True
+    # second read the item before first committed: it reads it again and commits on top
+    assert second.update_with_log([PDFUpload.task_token.set('token')]) is True
+    pdf_upload = PDFUpload.get(jid)
+    assert (pdf_upload.status, pdf_upload.filename, pdf_upload.task_token) == ('splitting', 'a.pdf', 'token')
+    assert pdf_upload.version == 2
+
+
+@local
+def test_commit_check_drops_stale_actions():
+    jid = _new_upload(2)
+    first, second = PDFUpload.get(jid), PDFUpload.get(jid)
+    first.update_with_log([PDFUpload.status.set('ocred')])
+    assert second.queue(PDFUpload.status.set('split')).commit(check=lambda upload: upload.status != 'ocred') is False
+    assert PDFUpload.get(jid).status == 'ocred'
+
+
+@local
+def test_save_pages_keeps_existing():
+    jid = _new_upload(30)
+    assert PDFUpload.get(jid).mark_page_done(3) is False
+    # a retried split writes only the pages it hasn't, and keeps page 3 ocred
+    assert PDFPage.save_pages(jid, range(20, 40), {n: f'p{n}' for n in range(40)}) == 10
+    pages = list(PDFPage.query(jid, page_size=7))  # paginated
+    assert [page.page_id for page in pages] == list(range(40))
+    assert [page.page_id for page in pages if page.status == 'ocred'] == [3]
+
+
+@local
+def test_ocr_engine_stats_add_and_total():
+    engine = uuid4().hex
+    OcrEngineStats(engine, '2019-08-23T13').add_sums({'n': 2, 'y': 3.5, 'errors': 0}, expires=1)
+    OcrEngineStats(engine, '2019-08-23T14').add_sums({'n': 1, 'y': 0.5}, expires=1)
+    OcrEngineStats(engine, '2019-08-23T14').add_sums({'n': 1, 'errors': 1}, expires=1)
+    totals = OcrEngineStats.get_sums(engine, '2019-08-23T14')
+    assert (totals['n'], totals['y'], totals['errors']) == (2, 0.5, 1)
+    assert OcrEngineStats.get_sums(engine, '2019-08-23T00')['n'] == 4
+
+
+@local
+def test_doc_digest_first_claim_wins():
+    digest = 'sha256:' + uuid4().hex
+    assert DocDigest.get_or_none(digest) is None
+    assert DocDigest.claim(digest, 'first', 'abc', 10) is None
+    assert DocDigest.claim(digest, 'second', 'abc', 10).jid == 'first'
+    assert DocDigest.get_or_none(digest).jid == 'first'
+
+
+class DynamoDB(object):
+    """The DynamoDB client calls models makes, on dicts of items as DynamoDB returns them.
+
+    Conditions are evaluated under a lock, so concurrent callers race as
+    they would on DynamoDB; only the expressions models.py sends are understood.
+    """
+
+    def __init__(self):
+        self.tables = {}  # table name -> {key: item}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def put(self, table, item):
+        self.tables.setdefault(table, {})[_key(item)] = dict(item)
+
+    def get(self, table, **key):
+        item = self.tables.get(table, {}).get(tuple(sorted((name, str(value)) for name, value in key.items())))
+        return item and {name: _value(value) for name, value in item.items()}
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.tables.get(TableName, {}).get(_key(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def update_item(self, ReturnValues='NONE', **update):
+        with self._lock:
+            self.calls.append(('update_item', update))
+            if not self._check(update):
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+            return {'Attributes': dict(self._apply(update))}
+
+    def transact_write_items(self, TransactItems):
+        with self._lock:
+            self.calls.append(('transact_write_items', TransactItems))
+            updates = [item['Update'] for item in TransactItems]
+            if not all(self._check(update) for update in updates):
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException'}}, 'TransactWriteItems')
+            for update in updates:
+                self._apply(update)
+            return {}
+
+    def _check(self, update):
+        condition = update.get('ConditionExpression')
+        if not condition:
+            return True
+        item = self.tables.get(update['TableName'], {}).get(_key(update['Key']), {})
+        item = {name: _value(value) for name, value in item.items()}
+        names, values = update['ExpressionAttributeNames'], update['ExpressionAttributeValues']
+        # as a Python expression on item
+        condition = re.sub(r'attribute_(not_)?exists \((#\w+)\)',
+                           lambda m: '%r %sin item' % (names[m.group(2)], 'not ' if m.group(1) else ''), condition)
+        condition = re.sub(r'#\w+', lambda m: 'item.get(%r)' % names[m.group(0)], condition)
+        condition = re.sub(r':\w+', lambda m: repr(_value(values[m.group(0)])), condition)
+        for dynamodb, python in ((' AND ', ' and '), (' OR ', ' or '), (' <> ', ' != '), (' = ', ' == ')):
+            condition = condition.replace(dynamodb, python)
+        return eval(condition, {'item': item})
+
+    def _apply(self, update):
+        table = self.tables.setdefault(update['TableName'], {})
+        item = table.setdefault(_key(update['Key']), dict(update['Key']))
+        names, values = update['ExpressionAttributeNames'], update['ExpressionAttributeValues']
+        for action, clauses in re.findall(r'(SET|ADD) ((?:(?! SET | ADD ).)*)', update['UpdateExpression']):
+            for clause in clauses.split(', '):
+                name, value = re.match(r'(#\w+)(?: =)? (:\w+)', clause).groups()
+                name, value = names[name], values[value]
+                if action == 'ADD' and name in item:
+                    value = {'N': str(_value(item[name]) + _value(value))}
+                item[name] = value
+        return item
+
+
+def _key(item):
+    return tuple(sorted((name, list(item[name].values())[0])
+                        for name in ('uuid', 'page_id') if name in item))
+
+
+def _value(value):
+    (kind, value), = value.items()
+    return int(value) if kind == 'N' else value
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    dynamodb = DynamoDB()
+    monkeypatch.setitem(clients._clients, 'dynamodb', dynamodb)
+
+    def statuses(jid, page_nums):
+        pages = [dynamodb.get('PDFPage', uuid=jid, page_id=page_num) for page_num in page_nums]
+        return {page['page_id']: page['status'] for page in pages if page}
+
+    monkeypatch.setattr(PDFPage, 'statuses', statuses)
+    return dynamodb
+
+
+def _fake_upload(dynamodb, num_pages, pages=None):
+    jid = uuid4().hex
+    dynamodb.put('PDFUpload', {'uuid': {'S': jid}, 'desired_filename': {'S': 'doc.pdf'}, 'status': {'S': 'split'},
+                               'num_pages': {'N': str(num_pages)}, 'version': {'N': '1'}})
+    for page_num in (range(num_pages) if pages is None else pages):
+        dynamodb.put('PDFPage', {'uuid': {'S': jid}, 'page_id': {'N': str(page_num)},
+                                 'file_path': {'S': f'page_pdf/{jid}/{page_num:04}.pdf'}, 'status': {'S': 'split'}})
+    return jid
+
+
+def test_count_pages_only_updates_existing_pages(dynamodb):
+    jid = _fake_upload(dynamodb, 3, pages=[0, 1])
+    assert PDFUpload(jid).mark_pages_done([0, 1], {1: 'page_pdf/j/0001_aws.txt'}) is False
+    (_, items), = [call for call in dynamodb.calls if call[0] == 'transact_write_items']
+    assert [item['Update']['Key'] for item in items] == [
+        {'uuid': {'S': jid}, 'page_id': {'N': '0'}}, {'uuid': {'S': jid}, 'page_id': {'N': '1'}}, {'uuid': {'S': jid}}]
+    assert all('attribute_exists' in item['Update']['ConditionExpression'] for item in items[:2])
+    assert dynamodb.get('PDFPage', uuid=jid, page_id=1)['text_path'] == 'page_pdf/j/0001_aws.txt'
+    # counting a page split never wrote doesn't create it without its file_path
+    with pytest.raises(PDFPage.DoesNotExist):
+        PDFUpload(jid).mark_page_done(2)
+    assert dynamodb.get('PDFPage', uuid=jid, page_id=2) is None
+    assert dynamodb.get('PDFUpload', uuid=jid)['pages_done'] == 2
+
+
+def test_finish_once_concurrently(dynamodb):
+    """Every page, some delivered twice, some in batches, counted from many threads at once."""
+    num_pages = 120
+    jid = _fake_upload(dynamodb, num_pages)
+    deliveries = [[page_num] for page_num in range(num_pages)] + [[page_num] for page_num in random.sample(
+        range(num_pages), 30)] + [list(range(start, start + 5)) for start in range(0, num_pages, 20)]
+    random.shuffle(deliveries)
+
+    def complete(page_nums):
+        return PDFUpload(jid).mark_pages_done(page_nums)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        lasts = list(pool.map(complete, deliveries))
+    assert lasts.count(True) == 1
+    pdf_upload = dynamodb.get('PDFUpload', uuid=jid)
+    assert (pdf_upload['status'], pdf_upload['pages_done']) == ('ocred', num_pages)
+    assert pdf_upload['version'] == 2  # only the finishing commit
+    assert {dynamodb.get('PDFPage', uuid=jid, page_id=n)['status'] for n in range(num_pages)} == {'ocred'}
+
+
+def test_commit_rereads_on_conflict(dynamodb):
+    jid = _fake_upload(dynamodb, 2)
+    first, second = PDFUpload(jid), PDFUpload(jid)
+    first.reread()
+    second.reread()
+    assert first.update_with_log([PDFUpload.status.set('splitting')]) is True
+    # second read the item before first committed: it reads it again and commits on top
+    assert second.update_with_log([PDFUpload.task_token.set('token')]) is True
+    assert (second.status, second.task_token, second.version) == ('splitting', 'token', 3)
+    conditions = [call[1]['ConditionExpression'] for call in dynamodb.calls if call[0] == 'update_item']
+    assert len(conditions) == 3
+    # a stale status isn't written over the newer one
+    first.queue(PDFUpload.status.set('split'))
+    assert first.commit(check=lambda upload: upload.status == 'splitting') is True
+    assert second.queue(PDFUpload.status.set('ocred')).commit(check=lambda upload: upload.status == 'splitting') is False
+    assert dynamodb.get('PDFUpload', uuid=jid)['status'] == 'split'
+
+
+def test_mark_page_done_keeps_only_a_counter(dynamodb):
+    """The page records guard against counting twice, so the upload item doesn't grow with its pages."""
+    jid = _fake_upload(dynamodb, 300)
+    for page_num in range(300):
+        PDFUpload(jid).mark_page_done(page_num)
+    assert PDFUpload(jid).mark_page_done(7) is False
+    upload_updates = [items[-1]['Update'] for call, items in dynamodb.calls if call == 'transact_write_items']
+    for update in upload_updates:
+        assert sorted(update['ExpressionAttributeNames'].values()) == ['pages_done', 'updatedAt']
+        assert 'ADD' in update['UpdateExpression']
+        assert not any(set(value) & {'NS', 'SS', 'L'} for value in update['ExpressionAttributeValues'].values())
+    assert dynamodb.get('PDFUpload', uuid=jid)['pages_done'] == 300
+
+
+def test_commit_does_not_create_a_missing_upload(dynamodb):
+    with pytest.raises(PDFUpload.DoesNotExist):
+        PDFUpload('missing').update_with_log([PDFUpload.status.set('split')])
+    assert dynamodb.get('PDFUpload', uuid='missing') is None
+
+
+def test_finish_split_does_not_overwrite_ocred(dynamodb):
+    import split
+    jid = _fake_upload(dynamodb, 2)
+    PDFUpload(jid).update_with_log([PDFUpload.status.set('splitting')])
+    assert split.finish_split({'mode': 'done', 'jid': jid}) == {'jid': jid, 'status': 'split'}
+    assert dynamodb.get('PDFUpload', uuid=jid)['status'] == 'split'
+    # the last page's OCR finished before SplitDone ran
+    PDFUpload(jid).update_with_log([PDFUpload.status.set('ocred')])
+    assert split.finish_split({'mode': 'done', 'jid': jid}) == {'jid': jid, 'status': 'ocred'}
+    assert dynamodb.get('PDFUpload', uuid=jid)['status'] == 'ocred'
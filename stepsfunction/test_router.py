@@ -0,0 +1,107 @@
+import os
+from collections import namedtuple
+
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import pytest  # noqa: E402
+
+from models import OcrEngineStats  # noqa: E402
+from router import OcrRouter, predict_seconds  # noqa: E402
+
+Image = namedtuple('Image', ['data', 'width', 'height', 'placement'])
+
+
+class Stats(object):
+    """OcrEngineStats kept in a dict, standing in for the table."""
+
+    SUMS = OcrEngineStats.SUMS
+    items = {}
+
+    def __init__(self, engine, window):
+        self.key = (engine, window)
+
+    def add_sums(self, sums, expires):
+        item = Stats.items.setdefault(self.key, dict.fromkeys(self.SUMS, 0))
+        for name, value in sums.items():
+            item[name] += value
+
+    @classmethod
+    def get_sums(cls, engine, since):
+        totals = dict.fromkeys(cls.SUMS, 0)
+        for (item_engine, window), item in cls.items.items():
+            if item_engine == engine and window >= since:
+                for name in cls.SUMS:
+                    totals[name] += item[name]
+        return totals
+
+
+@pytest.fixture(autouse=True)
+def stats():
+    Stats.items = {}
+
+
+def _page(megapixels):
+    return [Image(data=b'x' * 1000, width=1000, height=int(megapixels * 1000), placement=None)]
+
+
+def _router(**kwargs):
+    kwargs.setdefault('explore', 0)
+    return OcrRouter(stats_model=Stats, **kwargs)
+
+
+def _learn(router, engine, seconds_per_megapixel, overhead, pages=10):
+    for num in range(pages):
+        megapixels = 1 + num % 5
+        router.record(engine, _page(megapixels), overhead + seconds_per_megapixel * megapixels)
+
+
+def test_predict_seconds_fits_line():
+    router = _router()
+    _learn(router, 'tesseract', 2.0, 0.5)
+    sums = router._sums('tesseract')
+    assert predict_seconds(sums, (8, 0.001)) == pytest.approx(16.5, rel=1e-3)
+
+
+def test_rank_tries_unknown_engines_first():
+    router = _router(min_samples=5)
+    _learn(router, 'tesseract', 0.1, 0.1)
+    assert router.rank(_page(1))[0] == 'aws'
+
+
+def test_rank_by_latency_and_cost():
+    router = _router(objective='latency')
+    _learn(router, 'tesseract', 2.0, 0.5)   # slow for big pages
+    _learn(router, 'aws', 0.1, 1.5)         # slow to call, fast per megapixel
+    assert router.rank(_page(0.2))[0] == 'tesseract'
+    assert router.rank(_page(8))[0] == 'aws'
+    router.objective = 'cost'
+    assert router.rank(_page(8)) == ['tesseract', 'aws']
+
+
+def test_rank_allows_for_errors():
+    router = _router()
+    _learn(router, 'tesseract', 0.1, 0.1)
+    _learn(router, 'aws', 0.1, 0.2)
+    for _ in range(20):
+        router.record('tesseract', _page(1), 0, error=True)
+    assert router.rank(_page(1))[0] == 'aws'
+
+
+def test_flush_shares_stats():
+    router = _router(flush_seconds=3600)
+    _learn(router, 'tesseract', 1.0, 0.0)
+    router.flush()
+    other = _router()
+    other.rank(_page(1))  # a new router reads the table first
+    assert other._sums('tesseract') == router._sums('tesseract')
+    assert other._sums('tesseract')['n'] == 10
+
+
+def test_rank_stops_trying_an_engine_that_always_fails():
+    router = _router(min_samples=5)
+    _learn(router, 'tesseract', 0.1, 0.1)
+    for attempt in range(5):
+        assert router.rank(_page(1))[0] == 'aws'
+        router.record('aws', _page(1), 0.05, error=True)  # say, no Textract in our region
+    assert router.rank(_page(1)) == ['tesseract', 'aws']
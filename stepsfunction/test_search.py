@@ -0,0 +1,128 @@
+import io
+import os
+import re
+from datetime import datetime, timedelta
+
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import pytest  # noqa: E402
+
+import clients  # noqa: E402
+import search  # noqa: E402
+from assemble import write_text  # noqa: E402
+from search import Segment, SegmentWriter, index_text, merge_index, merge_segments, tokenize  # noqa: E402
+
+NOW = datetime(2019, 8, 23)
+
+
+class S3(object):
+    """The S3 client calls search makes, on a dict, counting range GETs."""
+
+    def __init__(self):
+        self.objects = {}  # key -> (body, LastModified)
+        self.range_gets = 0
+
+    def put_object(self, Bucket, Key, Body, **_kwargs):
+        self.objects[Key] = (bytes(Body), NOW + timedelta(seconds=len(self.objects)))
+
+    def get_object(self, Bucket, Key, Range=None):
+        body = self.objects[Key][0]
+        if Range:
+            self.range_gets += 1
+            start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+            body = body[start:end + 1]
+        return {'Body': io.BytesIO(body)}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': key, 'Size': len(body), 'LastModified': modified}
+                            for key, (body, modified) in sorted(self.objects.items()) if key.startswith(Prefix)]}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            del self.objects[obj['Key']]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = S3()
+    monkeypatch.setitem(clients._clients, 's3', s3)
+    monkeypatch.setattr(search, '_segments', {})
+    return s3
+
+
+def _segment(docs):
+    writer = SegmentWriter()
+    for jid, pages in docs:
+        doc = writer.add_doc(jid)
+        for page_num, text in enumerate(pages):
+            writer.add_page(doc, page_num, text)
+    return Segment.from_bytes(writer.to_bytes())
+
+
+def test_tokenize():
+    assert tokenize('The Quick, brown-fox a 42 STRASSE Straße') == \
+        ['the', 'quick', 'brown', 'fox', '42', 'strasse', 'strasse']
+
+
+def test_segment_lookup():
+    words = [f'word{n:04}' for n in range(1000)]  # several blocks
+    segment = _segment([('j1', [' '.join(words[:500]), 'Alpha beta', ' '.join(words[500:])]),
+                        ('j2', ['beta gamma', 'alpha'])])
+    assert segment.jids == ['j1', 'j2']
+    assert segment.search({'alpha'}) == {('j1', 1), ('j2', 1)}
+    assert segment.search({'alpha', 'beta'}) == {('j1', 1)}
+    assert segment.search({'word0000'}) == {('j1', 0)}
+    assert segment.search({'word0999', 'word0500'}) == {('j1', 2)}
+    assert segment.search({'alpha', 'missing'}) == set()
+    assert segment.search({'aaa'}) == segment.search({'zzz'}) == set()
+    assert [term for term, keys in segment.terms()] == sorted(words + ['alpha', 'beta', 'gamma'])
+
+
+def test_segment_from_file(tmpdir):
+    path = tmpdir.join('j1.seg')
+    writer = SegmentWriter()
+    writer.add_page(writer.add_doc('j1'), 7, 'mapped text')
+    path.write_binary(writer.to_bytes())
+    assert Segment.from_file(str(path)).search({'mapped'}) == {('j1', 7)}
+
+
+def test_merge_segments():
+    old = _segment([('j1', ['old text']), ('j2', ['other text'])])
+    new = _segment([('j1', ['new text']), ('j3', ['', 'text'])])
+    merged = Segment.from_bytes(merge_segments([old, new]).to_bytes())
+    assert merged.jids == ['j2', 'j1', 'j3']
+    assert merged.search({'text'}) == {('j1', 0), ('j2', 0), ('j3', 1)}
+    assert merged.search({'old'}) == set()
+
+
+def test_index_merge_search(s3, monkeypatch):
+    monkeypatch.setattr(search, 'INDEX_MERGE_MIN_SEGMENTS', 2)
+    monkeypatch.setattr(search, 'HEAD_BYTES', 64)
+    for jid, pages in [('j1', ['red fish', 'blue fish']), ('j2', ['one fish two fish red'])]:
+        offsets = write_text('b', f'doc_txt/{jid}/doc.txt', (page.encode() for page in pages))
+        s3.put_object('b', f'doc_txt/{jid}/doc.idx', b''.join(offset.to_bytes(8, 'big') for offset in offsets))
+        index_text({'bucket': 'b', 'jid': jid}, None)
+
+    assert search.search('b', 'Red FISH') == [('j1', 0), ('j2', 0)]
+    assert s3.range_gets > 0  # HEAD_BYTES doesn't cover the segments
+
+    assert merge_index({'bucket': 'b'}, None)['merged'] == 2
+    assert len([key for key in s3.objects if key.startswith('index/')]) == 1
+    assert search.search('b', 'blue fish') == [('j1', 1)]
+    assert search.search('b', '') == []
+
+
+def test_merge_inputs_fit_the_memory_budget(monkeypatch):
+    monkeypatch.setattr(search, 'INDEX_MERGE_MAX_BYTES', 100)
+    monkeypatch.setattr(search, 'INDEX_MERGE_MAX_SEGMENTS', 5)
+    monkeypatch.setattr(search, 'INDEX_MERGE_BUDGET_BYTES', 200)
+    objects = [{'Key': f'{i}.seg', 'Size': size} for i, size in enumerate([60, 500, 60, 60, 60, 10])]
+    assert [obj['Key'] for obj in search.merge_inputs(objects)] == ['0.seg', '2.seg', '3.seg']
+    monkeypatch.setattr(search, 'INDEX_MERGE_BUDGET_BYTES', 10 ** 6)
+    assert [obj['Key'] for obj in search.merge_inputs(objects)] == ['0.seg', '2.seg', '3.seg', '4.seg', '5.seg']
+    monkeypatch.setattr(search, 'INDEX_MERGE_MAX_SEGMENTS', 2)
+    assert [obj['Key'] for obj in search.merge_inputs(objects)] == ['0.seg', '2.seg']
@@ -0,0 +1,151 @@
+"""Uploaded and StartStateMachine: record an uploaded document and start processing it."""
+from json import dumps
+import hashlib
+import logging
+import os
+from datetime import datetime
+from time import time
+
+import clients
+from metrics import measure, tagged, timed
+from models import DocDigest, PDFUpload
+from records import process_records
+
+STATEMACHINE_ARN = os.environ.get('STATEMACHINE_ARN', "")
+
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+
+@timed
+def uploaded(event, context):
+    """Handle the S3 ObjectCreated trigger: start the state machine, unless we know the document.
+
+    If the same bytes were uploaded and OCRed before, the new PDFUpload is
+    linked to that upload's page text instead, see find_known_doc.
+    """
+    LOG.info(f'event: {dumps(event)}')
+    LOG.info(f'STATEMACHINE_ARN={STATEMACHINE_ARN}')
+    return process_records(event, upload_record)
+
+
+def upload_record(s3rec):
+    """Record one uploaded document and start its state machine, or link it to a known copy.
+
+    S3 retries the whole event if another record failed, so this must be
+    safe to run again: the PDFUpload is only saved if it is new, and an
+    execution already started for the jid is left alone.
+    """
+    bucket = s3rec['bucket']['name']
+    key = s3rec['object']['key']
+    size = s3rec['object']['size']
+    etag = s3rec['object']['eTag']
+    _doc_pdf, jid, name_pdf = key.split('/')
+    LOG.info(f'bucket={bucket} etag={etag} size={size} key={key} jid={jid} name_pdf={name_pdf}')
+    with tagged(jid=jid):
+        source = find_known_doc(bucket, key, etag, size, jid)
+        file_info = save_info(name_pdf, jid, source=source)
+        if source is not None:
+            if file_info.source_jid is None:  # saved by an earlier try, before we knew the source
+                link_known_doc(file_info, source)
+            return
+
+        sf_input = dumps({'bucket': bucket, 'key': key, 'etag': etag,
+                          'size': size, 'jid': jid, 'name_pdf': name_pdf})
+        sf = clients.stepfunctions()
+        try:
+            res = sf.start_execution(stateMachineArn=STATEMACHINE_ARN,
+                                     name=f'{jid}',  # use our JobID as unique SM invocation ID
+                                     input=sf_input)  # state needs JSON str input
+        except sf.exceptions.ExecutionAlreadyExists:
+            LOG.info(f'upload_record jid={jid} execution already started')
+            return
+        LOG.info(f'SF.start_execurtion res={res}')
+
+
+def find_known_doc(bucket, key, etag, size, jid):
+    """Return the OCRed PDFUpload of an earlier upload of the same bytes, or None.
+
+    The ETag and size from the S3 event find documents we have seen before
+    with one GetItem. Otherwise we hash the object as we stream it from S3,
+    so a copy uploaded in different parts, with a different ETag, is found
+    by its SHA-256. The first upload of some bytes claims their DocDigest
+    items for its jid; later ones reuse its page text once it is OCRed.
+    While it is still being OCRed, they are processed as usual.
+    """
+    etag_digest = f'etag:{etag}:{size}'
+    doc_digest = DocDigest.get_or_none(etag_digest)
+    if doc_digest is not None:
+        sha256 = doc_digest.sha256
+    else:
+        sha256 = s3_sha256(bucket, key)
+        DocDigest.claim(etag_digest, jid, sha256, size)
+    sha_digest = f'sha256:{sha256}'
+    doc_digest = DocDigest.get_or_none(sha_digest) or DocDigest.claim(sha_digest, jid, sha256, size)
+    if doc_digest is None or doc_digest.jid == jid:
+        LOG.info(f'find_known_doc new sha256={sha256} jid={jid}')
+        return None
+    try:
+        source = PDFUpload.get(hash_key=doc_digest.jid)
+    except PDFUpload.DoesNotExist:
+        return None
+    if source.status != 'ocred':
+        LOG.info(f'find_known_doc sha256={sha256} jid={jid} source_jid={source.uuid} status={source.status}')
+        return None
+    LOG.info(f'find_known_doc known sha256={sha256} jid={jid} source_jid={source.uuid}')
+    return source
+
+
+def s3_sha256(bucket, key, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 of an S3 object, streaming it rather than holding it in memory."""
+    t_0 = time()
+    sha = hashlib.sha256()
+    with measure('s3_get') as measurement:
+        body = clients.s3().get_object(Bucket=bucket, Key=key)['Body']
+        read = 0
+        for chunk in iter(lambda: body.read(chunk_size), b''):
+            sha.update(chunk)
+            read += len(chunk)
+        measurement.set(bytes=read)
+    LOG.info(f's3_sha256 key={key} sha256_seconds={time() - t_0}')
+    return sha.hexdigest()
+
+
+def link_known_doc(pdf_upload, source):
+    """Point a new upload at the page text of an earlier upload of the same bytes; no split or OCR."""
+    pdf_upload.update_with_log(
+        actions=[getattr(PDFUpload, name).set(value) for name, value in _linked(source).items()])
+
+
+def _linked(source):
+    """The attributes of an upload linked to source."""
+    return {'status': 'ocred', 'source_jid': source.source_jid or source.uuid,
+            'num_pages': source.num_pages, 'pages_done': source.num_pages}
+
+
+@timed
+def start_state_machine(event, context):
+    """Take input from start of statemachine, enter an event in DDB, pass useful bits to next state."""
+    LOG.info(f'event: {dumps(event)}')
+    # TODO enter info into the DB: jid+dt, event=uploaded, bucket, key, ...
+    return {'bucket': event['bucket'], 'key': event['key'], 'jid': event['jid']}
+
+
+def save_info(desired_filename, jid, source=None):
+    """Save information when user get presigned url; already linked to source if we know the document.
+
+    Linking as we save is one PutItem instead of a PutItem then an UpdateItem.
+    """
+    attributes = {'status': "uploaded", 'filename': '', 'createdAt': datetime.now()}
+    if source is not None:
+        attributes.update(_linked(source))
+    file_upload = PDFUpload(
+        desired_filename=desired_filename,
+        uuid=jid,
+        **attributes
+    )
+    if not file_upload.save_if_new():
+        LOG.info(f'save_info jid={jid} already saved')
+        return PDFUpload.get(hash_key=jid)
+    return file_upload
@@ -0,0 +1,79 @@
+"""GetUploadUrl: presign an upload URL, importing no more than boto3."""
+from json import dumps
+import logging
+import os
+from uuid import uuid4
+
+import clients
+from metrics import timed
+
+UPLOAD_BUCKET_NAME = os.environ.get('UPLOAD_BUCKET_NAME', "")
+
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+
+@timed
+def get_upload_url(event, _context):
+    """Return presigned URL to PUT file to our S3 bucket with read access.
+
+    Ensure the file is a PDF, in suffix and content type.
+    Create a UUID jobid and use that for the SM invocation for tracking.
+    NOTE: our Lambda must be given s3:PutObject rights or PUT to the URL will be denied.
+    Test like:
+        curl -H "content-type: application/pdf" "$urlget?filename=doc.pdf"
+    then set a variable 'urlupload' to the returned value, and upload (via PUT):
+        curl -v -H "content-type: application/pdf" --upload-file mydoc.pdf "$urlupload"
+    """
+    # Later want userid so we can include it in PSURL for tracking
+
+    LOG.info('event=%s', dumps(event))
+    content_type = event['headers'].get('content-type')  # APIG downcases this
+    filename = event['queryStringParameters'].get('filename')
+    if not filename:
+        return {'statusCode': 400,
+                'body': 'Must supply query string "filename=..."'}
+    if not filename.endswith('.pdf'):
+        return {'statusCode': 400,
+                'body': 'Filename must end with ".pdf"'}
+    if content_type != 'application/pdf':
+        return {'statusCode': 400,
+                'body': 'Filename must have "Content-Type: application/pdf"'}
+    LOG.info('api_http_get filename=%s content-type=%s',
+             filename, content_type)
+    LOG.debug('Got Task? event=%s', dumps(event))
+    LOG.debug('Got Task? context=%s', dumps(dir(_context)))
+    try:
+        filename = event['queryStringParameters']['filename']  # TODO: URLdecode defense
+    except Exception as err:
+        return {'statusCode': 400,
+                'body': 'Must supply query string "filename=..."'}
+    if not filename.endswith('.pdf'):
+        return {'statusCode': 400,
+                'body': 'Filename must end with ".pdf"'}
+    try:
+        content_type = event['headers']['content-type']  # APIG downcases this
+        if content_type != 'application/pdf':
+            raise ValueError('Must specify Content-Type: application/pdf')
+    except Exception as err:
+        return {'statusCode': 400, 'body': f'{err}'}
+    LOG.info(f'content-type={content_type} filename={filename}')
+
+    # We need to spec content-type since NG sets this header;
+    # ContentType is boto3 key spelling, no dash; the value must be lowercase.
+    jid = uuid4().hex
+    params = {
+        'Bucket': UPLOAD_BUCKET_NAME,
+        'Key': f'doc_pdf/{jid}/{filename}',
+        'ContentType': content_type,
+        # 'ServerSideEncryption': 'AES256'
+    }
+    LOG.info(f'PSURL params={params}')
+    url = clients.s3().generate_presigned_url(ClientMethod='put_object',
+                                              Params=params,
+                                              ExpiresIn=3600)
+    LOG.debug('url=%s', url)
+    return {'statusCode': 200,
+            'headers': {'Access-Control-Allow-Origin': '*'},  # for CORS
+            'body': dumps({'url': url})}